@@ -20,21 +20,37 @@ __version__ = "1.112"
 __branch__ = "extended"
 
 import argparse
+import json
 import os
+import signal
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
 from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
-
 from configuration.config_providers import (
     ConfigFileConfigProvider,
     MqttHandler,
     ConfigProviderChain
 )
-from utils.factories import *
+from configuration.config_watcher import ConfigFileWatcher
+from GLOBALS import *
+from metering.samples import MeterSample, get_compensated_watts, is_new_reading
+from monitoring.energy import EnergyAccounting
+from monitoring.history import HistoryRecorder
+from monitoring.metrics import MetricsServer, Registry, collect_http_clients, format_labels
+from monitoring.status_segment import StatusSegmentWriter
+from monitoring.tracing import SpanRecorder
+from utils.factories import DRIVER_SECTIONS, Factory
 from utils.helper_functions import *
+from utils.cycle_summary import CHANGE, CycleSummary, RoutineMessageFilter
+from utils.http_clients import HttpClient
+from utils.logging_handlers import BatchingLogShipper
+from utils.state_snapshot import load_snapshot, save_snapshot
+from utils.sun import get_seconds_until_daylight, get_wait_interval
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--config', help='Override configuration file path')
@@ -49,9 +65,11 @@ try:
 
     ENABLE_LOG_TO_FILE = config.getboolean('COMMON', 'ENABLE_LOG_TO_FILE')
     LOG_BACKUP_COUNT = config.getint('COMMON', 'LOG_BACKUP_COUNT')
+    LOG_MODE = config.get('COMMON', 'LOG_MODE', fallback='detailed').lower()
 except Exception as e:
     logger.info('Error on reading ENABLE_LOG_TO_FILE, set it to DISABLED')
     ENABLE_LOG_TO_FILE = False
+    LOG_MODE = 'detailed'
     if hasattr(e, 'message'):
         logger.error(e.message)
     else:
@@ -73,6 +91,7 @@ if ENABLE_LOG_TO_FILE:
     logger.addHandler(rotating_file_handler)
 
 logger.info('Log write to file: %s', ENABLE_LOG_TO_FILE)
+logger.info('Log mode: %s', LOG_MODE)
 logger.info('Python Version: ' + sys.version)
 
 try:
@@ -89,14 +108,16 @@ def set_limit(p_limit):
             set_limit.LastLimitAck = bool(False)
         if (set_limit.LastLimit == cast_to_int(p_limit)) and set_limit.LastLimitAck:
             logger.info("Inverterlimit was already accepted at %s Watt", cast_to_int(p_limit))
+            METRIC_LIMIT_SUPPRESSED.inc()
             cross_check_limit()
             return
         if (set_limit.LastLimit == cast_to_int(p_limit)) and not set_limit.LastLimitAck:
-            logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...", cast_to_int(p_limit))
+            logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...", cast_to_int(p_limit), extra=CHANGE)
 
-        logger.info("setting new limit to %s Watt", cast_to_int(p_limit))
+        logger.info("setting new limit to %s Watt", cast_to_int(p_limit), extra=CHANGE)
         set_limit.LastLimit = cast_to_int(p_limit)
         set_limit.LastLimitAck = True
+        METRIC_LIMIT_SETPOINT.set(set_limit.LastLimit)
 
         min_watt_all_inverters = get_min_watt_from_all_inverters()
         if (cast_to_int(p_limit) <= min_watt_all_inverters):
@@ -104,6 +125,9 @@ def set_limit(p_limit):
             publish_global_state("limit", min_watt_all_inverters)
         else:
             publish_global_state("limit", cast_to_int(p_limit))
+        if not hasattr(set_limit, "History"):
+            set_limit.History = deque(maxlen=16)
+        set_limit.History.append((time.time(), cast_to_int(p_limit)))
 
         remaining_limit = cast_to_int(p_limit)
 
@@ -133,13 +157,13 @@ def set_limit(p_limit):
 
             if (new_limit == cast_to_int(CURRENT_LIMIT[i])) and LASTLIMITACKNOWLEDGED[i]:
                 logger.info('Inverter "%s": Already at %s Watt', NAME[i], cast_to_int(new_limit))
+                METRIC_LIMIT_SUPPRESSED.inc()
                 continue
 
             LASTLIMITACKNOWLEDGED[i] = True
 
             publish_inverter_state(i, "limit", new_limit)
-            DTU.set_limit(i, new_limit)
-            if not DTU.wait_for_ack(i, SET_LIMIT_TIMEOUT_SECONDS):
+            if not send_inverter_limit(i, new_limit):
                 set_limit.LastLimitAck = False
                 LASTLIMITACKNOWLEDGED[i] = False
 
@@ -162,7 +186,7 @@ def set_limit(p_limit):
                     continue
                 if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
                     continue
-                if CONFIG_PROVIDER.get_battery_priority(i) != j:
+                if CONFIG.battery_priority[i] != j:
                     continue
 
                 # Calculate proportional limit for battery inverters
@@ -177,13 +201,13 @@ def set_limit(p_limit):
 
                 if (new_limit == cast_to_int(CURRENT_LIMIT[i])) and LASTLIMITACKNOWLEDGED[i]:
                     logger.info('Inverter "%s": Already at %s Watt', NAME[i], cast_to_int(new_limit))
+                    METRIC_LIMIT_SUPPRESSED.inc()
                     continue
 
                 LASTLIMITACKNOWLEDGED[i] = True
 
                 publish_inverter_state(i, "limit", new_limit)
-                DTU.set_limit(i, new_limit)
-                if not DTU.wait_for_ack(i, SET_LIMIT_TIMEOUT_SECONDS):
+                if not send_inverter_limit(i, new_limit):
                     set_limit.LastLimitAck = False
                     LASTLIMITACKNOWLEDGED[i] = False
 
@@ -193,6 +217,18 @@ def set_limit(p_limit):
         set_limit.LastLimitAck = False
         raise
 
+def send_inverter_limit(pInverterId, pLimit):
+    # returns False if the inverter did not acknowledge the limit in time
+    DTU.set_limit(pInverterId, pLimit)
+    set_limit.LastChangeTime = time.time()
+    start_time = time.perf_counter()
+    if not DTU.wait_for_ack(pInverterId, SET_LIMIT_TIMEOUT_SECONDS):
+        METRIC_LIMIT_TIMEOUT.inc()
+        return False
+    METRIC_LIMIT_ACK_DURATION.labels(NAME[pInverterId]).observe(time.perf_counter() - start_time)
+    METRIC_LIMIT_ACKNOWLEDGED.inc()
+    return True
+
 def reset_inverter_data(pInverterId):
     attributes_to_delete = [
         "LastLimit",
@@ -232,7 +268,7 @@ def get_hoymiles_available():
                     GetHoymilesAvailable = True
                     if not WasAvail:
                         reset_inverter_data(i)
-                        get_hoymiles_info()
+                        get_hoymiles_info(i)
             except Exception as e:
                 AVAILABLE[i] = False
                 logger.error("Exception at GetHoymilesAvailable, Inverter %s (%s) not reachable", i, NAME[i])
@@ -245,22 +281,18 @@ def get_hoymiles_available():
         logger.error('Exception at GetHoymilesAvailable')
         raise
 
-def get_hoymiles_info():
+def get_hoymiles_info(pInverterId):
+    # only called for the inverter which just became available, the others keep their known info
     try:
-        for i in range(INVERTER_COUNT):
-            try:
-                if not AVAILABLE[i]:
-                    continue
-                DTU.get_info(i)
-            except Exception as e:
-                logger.error('Exception at GetHoymilesInfo, Inverter "%s" not reachable', NAME[i])
-                if hasattr(e, 'message'):
-                    logger.error(e.message)
-                else:
-                    logger.error(e)
-    except:
-        logger.error("Exception at GetHoymilesInfo")
-        raise
+        if not AVAILABLE[pInverterId]:
+            return
+        DTU.get_info(pInverterId)
+    except Exception as e:
+        logger.error('Exception at GetHoymilesInfo, Inverter "%s" not reachable', NAME[pInverterId])
+        if hasattr(e, 'message'):
+            logger.error(e.message)
+        else:
+            logger.error(e)
 
 def get_hoymiles_panel_min_voltage(pInverterId):
     try:
@@ -287,24 +319,27 @@ def set_hoymiles_power_status(pInverterId, pActive):
             return
         if SET_POWERSTATUS_CNT > 0:
             if not hasattr(set_hoymiles_power_status, "LastPowerStatus"):
-                set_hoymiles_power_status.last_power_status = []
-                set_hoymiles_power_status.last_power_status = [False for i in range(INVERTER_COUNT)]
+                set_hoymiles_power_status.LastPowerStatus = []
+                set_hoymiles_power_status.LastPowerStatus = [False for i in range(INVERTER_COUNT)]
             if not hasattr(set_hoymiles_power_status, "SamePowerStatusCnt"):
                 set_hoymiles_power_status.SamePowerStatusCnt = []
                 set_hoymiles_power_status.SamePowerStatusCnt = [0 for i in range(INVERTER_COUNT)]
-            if set_hoymiles_power_status.last_power_status[pInverterId] == pActive:
+            if set_hoymiles_power_status.LastPowerStatus[pInverterId] == pActive:
                 set_hoymiles_power_status.SamePowerStatusCnt[pInverterId] = set_hoymiles_power_status.SamePowerStatusCnt[pInverterId] + 1
             else:
-                set_hoymiles_power_status.last_power_status[pInverterId] = pActive
+                set_hoymiles_power_status.LastPowerStatus[pInverterId] = pActive
                 set_hoymiles_power_status.SamePowerStatusCnt[pInverterId] = 0
+                logger.info('Inverter "%s": power status changes to %s', NAME[pInverterId], 'ON' if pActive else 'OFF', extra=CHANGE)
             if set_hoymiles_power_status.SamePowerStatusCnt[pInverterId] > SET_POWERSTATUS_CNT:
                 if pActive:
                     logger.info("Retry Counter exceeded: Inverter PowerStatus already ON")
                 else:
                     logger.info("Retry Counter exceeded: Inverter PowerStatus already OFF")
+                METRIC_POWER_STATUS_SUPPRESSED.inc()
                 return
         DTU.set_power_status(pInverterId, pActive)
-        time.sleep(SET_POWER_STATUS_DELAY_IN_SECONDS)
+        METRIC_POWER_STATUS_SENT.inc()
+        loop_sleep(SET_POWER_STATUS_DELAY_IN_SECONDS)
     except:
         logger.error("Exception at SetHoymilesPowerStatus")
         raise
@@ -324,11 +359,11 @@ def get_check_battery():
                 if minVoltage <= HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V[i]:
                     set_hoymiles_power_status(i, False)
                     HOY_BATTERY_GOOD_VOLTAGE[i] = False
-                    HOY_MAX_WATT[i] = CONFIG_PROVIDER.get_reduce_wattage(i)
+                    HOY_MAX_WATT[i] = CONFIG.reduce_wattage[i]
 
                 elif minVoltage <= HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V[i]:
-                    if HOY_MAX_WATT[i] != CONFIG_PROVIDER.get_reduce_wattage(i):
-                        HOY_MAX_WATT[i] = CONFIG_PROVIDER.get_reduce_wattage(i)
+                    if HOY_MAX_WATT[i] != CONFIG.reduce_wattage[i]:
+                        HOY_MAX_WATT[i] = CONFIG.reduce_wattage[i]
                         set_limit.LastLimit = -1
 
                 elif minVoltage >= HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V[i]:
@@ -338,13 +373,13 @@ def get_check_battery():
                         DTU.wait_for_ack(i, SET_LIMIT_TIMEOUT_SECONDS)
                         set_limit.LastLimit = -1
                     HOY_BATTERY_GOOD_VOLTAGE[i] = True
-                    if (minVoltage >= HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V[i]) and (HOY_MAX_WATT[i] != CONFIG_PROVIDER.get_normal_wattage(i)):
-                        HOY_MAX_WATT[i] = CONFIG_PROVIDER.get_normal_wattage(i)
+                    if (minVoltage >= HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V[i]) and (HOY_MAX_WATT[i] != CONFIG.normal_wattage[i]):
+                        HOY_MAX_WATT[i] = CONFIG.normal_wattage[i]
                         set_limit.LastLimit = -1
 
                 elif minVoltage >= HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V[i]:
-                    if HOY_MAX_WATT[i] != CONFIG_PROVIDER.get_normal_wattage(i):
-                        HOY_MAX_WATT[i] = CONFIG_PROVIDER.get_normal_wattage(i)
+                    if HOY_MAX_WATT[i] != CONFIG.normal_wattage[i]:
+                        HOY_MAX_WATT[i] = CONFIG.normal_wattage[i]
                         set_limit.LastLimit = -1
 
                 if HOY_BATTERY_GOOD_VOLTAGE[i]:
@@ -367,11 +402,24 @@ def get_hoymiles_temperature():
         logger.error("Exception at GetHoymilesTemperature")
         raise
 
-def get_hoymiles_actual_power():
+def read_intermediate_powermeter():
+    # only reads the meter, so it can run in the METER_EXECUTOR. The error handling, which falls back to the DTU
+    # and may set limits, stays in get_hoymiles_actual_power() on the main thread
+    start_time = time.time()
+    Watts = abs(INTERMEDIATE_POWERMETER.get_powermeter_watts())
+    end_time = time.time()
+    METRIC_PRODUCTION_READ_DURATION.observe(end_time - start_time)
+    return Watts, (start_time + end_time) / 2
+
+def get_hoymiles_actual_power(pPendingRead=None):
+    # pPendingRead is a read_intermediate_powermeter() already submitted to the METER_EXECUTOR
     try:
         try:
-            Watts = abs(INTERMEDIATE_POWERMETER.get_powermeter_watts())
-            logger.info(f"intermediate meter {INTERMEDIATE_POWERMETER.__class__.__name__}: {Watts} Watt")
+            if pPendingRead is None:
+                Watts, get_hoymiles_actual_power.ReadTime = read_intermediate_powermeter()
+            else:
+                Watts, get_hoymiles_actual_power.ReadTime = pPendingRead.result()
+            logger.info("intermediate meter %s: %s Watt", INTERMEDIATE_POWERMETER.__class__.__name__, Watts)
             return Watts
         except Exception as e:
             logger.error("Exception at GetHoymilesActualPower")
@@ -380,36 +428,266 @@ def get_hoymiles_actual_power():
             else:
                 logger.error(e)
             logger.error("try reading actual power from DTU:")
+            start_time = time.time()
             Watts = DTU.get_powermeter_watts()
-            logger.info(f"intermediate meter {DTU.__class__.__name__}: {Watts} Watt")
+            get_hoymiles_actual_power.ReadTime = (start_time + time.time()) / 2
+            logger.info("intermediate meter %s: %s Watt", DTU.__class__.__name__, Watts)
+            return Watts
     except:
         logger.error("Exception at GetHoymilesActualPower")
         if SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR:
             set_limit(0)
         raise
 
-def get_powermeter_watts():
+def get_powermeter_reading():
     try:
-        Watts = POWERMETER.get_powermeter_watts()
-        logger.info(f"metering {POWERMETER.__class__.__name__}: {Watts} Watt")
-        return Watts
+        start_time = time.perf_counter()
+        Reading = POWERMETER.get_powermeter_reading()
+        METRIC_GRID_READ_DURATION.observe(time.perf_counter() - start_time)
+        if Reading.source_timestamp is None:
+            logger.info("metering %s: %s Watt", POWERMETER.__class__.__name__, Reading.watts)
+        else:
+            logger.info("metering %s: %s Watt, measured %.1f s ago", POWERMETER.__class__.__name__, Reading.watts, Reading.age)
+        return Reading
     except:
         logger.error("Exception at GetPowermeterWatts")
         if SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR:
             set_limit(0)        
         raise
 
+def get_powermeter_watts():
+    return get_powermeter_reading().watts
+
+def get_battery_state():
+    if BATTERY_STATE_PROVIDER is None:
+        return None
+    try:
+        return BATTERY_STATE_PROVIDER.get_battery_state()
+    except:
+        logger.error("Exception at GetBatteryState")
+        raise
+
+def log_http_statistics():
+    if HTTP_STATISTICS_INTERVAL_IN_SECONDS <= 0:
+        return
+    if not hasattr(log_http_statistics, "LastLogTime"):
+        log_http_statistics.LastLogTime = time.time()
+    if time.time() - log_http_statistics.LastLogTime >= HTTP_STATISTICS_INTERVAL_IN_SECONDS:
+        log_http_statistics.LastLogTime = time.time()
+        HttpClient.log_statistics(logger)
+
+def loop_sleep(pSeconds):
+    # sleeps within the loop, the time is reported as sleep phase of the cycle
+    loop_sleep.SleepTime = getattr(loop_sleep, "SleepTime", 0) + pSeconds
+    with SPANS.span('sleep'):
+        time.sleep(pSeconds)
+
+def observe_loop_timing():
+    # called at the start of every cycle, records the duration of the previous one
+    now = time.perf_counter()
+    if hasattr(observe_loop_timing, "CycleStartTime"):
+        duration = now - observe_loop_timing.CycleStartTime
+        sleep_time = min(getattr(loop_sleep, "SleepTime", 0), duration)
+        METRIC_LOOP_DURATION.observe(duration)
+        METRIC_LOOP_WORK_SECONDS.inc(duration - sleep_time)
+        METRIC_LOOP_SLEEP_SECONDS.inc(sleep_time)
+    observe_loop_timing.CycleStartTime = now
+    loop_sleep.SleepTime = 0
+
+def collect_inverter_metrics(lines):
+    lines.append('# HELP hoymiles_inverter_limit_watts Current limit of the inverters')
+    lines.append('# TYPE hoymiles_inverter_limit_watts gauge')
+    for i in range(INVERTER_COUNT):
+        lines.append(f'hoymiles_inverter_limit_watts{format_labels(("inverter",), (NAME[i],))} {CURRENT_LIMIT[i]}')
+    lines.append('# HELP hoymiles_inverter_available Whether the inverters are reachable and producing')
+    lines.append('# TYPE hoymiles_inverter_available gauge')
+    for i in range(INVERTER_COUNT):
+        lines.append(f'hoymiles_inverter_available{format_labels(("inverter",), (NAME[i],))} {int(AVAILABLE[i])}')
+
+def get_idle_interval(pInvertersAvailable):
+    # No inverter available: wait a little longer each cycle. At night the inverters are only probed every
+    # NIGHT_PROBE_INTERVAL_IN_SECONDS, and the sleep ends in time to start with short intervals before sunrise.
+    seconds_until_daylight = 0
+    if not pInvertersAvailable and SCHEDULE_LATITUDE is not None and SCHEDULE_LONGITUDE is not None:
+        seconds_until_daylight = get_seconds_until_daylight(SCHEDULE_LATITUDE, SCHEDULE_LONGITUDE, SCHEDULE_SUN_MARGIN_IN_MINUTES)
+    interval, get_idle_interval.IdleCount = get_wait_interval(
+        pInvertersAvailable, getattr(get_idle_interval, "IdleCount", 0), LOOP_INTERVAL_IN_SECONDS, IDLE_MAX_INTERVAL_IN_SECONDS,
+        NIGHT_PROBE_INTERVAL_IN_SECONDS, seconds_until_daylight)
+    if pInvertersAvailable:
+        # only the battery voltage is too low, it is checked again after the normal interval
+        return interval
+    if seconds_until_daylight != 0:
+        logger.info("Night: next check of the inverters in %s s", interval, extra=CHANGE)
+    else:
+        logger.info("No inverter available: next check in %s s", interval, extra=CHANGE)
+    return interval
+
+def get_state_snapshot():
+    return {
+        'inverter_count': INVERTER_COUNT,
+        'dtu': DTU.__class__.__name__,
+        'dtu_version': DTU.firmware_version,
+        'serial_number': SERIAL_NUMBER,
+        'name': NAME,
+        'available': AVAILABLE,
+        'current_limit': CURRENT_LIMIT,
+        'limit_acknowledged': LASTLIMITACKNOWLEDGED,
+        'battery_good_voltage': HOY_BATTERY_GOOD_VOLTAGE,
+        'panel_voltage': HOY_PANEL_VOLTAGE_LIST,
+        'panel_min_voltage_history': HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST,
+        'last_limit': getattr(set_limit, "LastLimit", None),
+        'last_limit_ack': getattr(set_limit, "LastLimitAck", False),
+        'power_status': getattr(set_hoymiles_power_status, "LastPowerStatus", None),
+        'same_power_status_cnt': getattr(set_hoymiles_power_status, "SamePowerStatusCnt", None),
+        'limit_setpoint': new_limit_setpoint,
+    }
+
+def save_state_snapshot(pForce=False):
+    if STATE_SNAPSHOT_MAX_AGE_IN_SECONDS <= 0:
+        return
+    # these change almost every cycle, they are only saved every STATE_SNAPSHOT_MAX_AGE_IN_SECONDS / 2 and on exit.
+    # A change of the others (availability, power status, ...) is saved right away
+    volatile_keys = ('current_limit', 'last_limit', 'limit_setpoint', 'panel_voltage', 'panel_min_voltage_history', 'same_power_status_cnt')
+    try:
+        state = get_state_snapshot()
+        serialized_state = json.dumps({key: value for key, value in state.items() if key not in volatile_keys}, sort_keys=True)
+        if (not pForce and serialized_state == getattr(save_state_snapshot, "LastState", None)
+                and time.time() - save_state_snapshot.LastSaveTime < STATE_SNAPSHOT_MAX_AGE_IN_SECONDS / 2):
+            return
+        save_snapshot(STATE_SNAPSHOT_FILE, state)
+        save_state_snapshot.LastState = serialized_state
+        save_state_snapshot.LastSaveTime = time.time()
+    except Exception as e:
+        logger.error("Exception at SaveStateSnapshot: %s", e)
+
+def restore_state_snapshot(pState):
+    # only resume if the snapshot was written for the same DTU and inverters
+    matching = pState['inverter_count'] == INVERTER_COUNT and pState['dtu'] == DTU.__class__.__name__
+    for i in range(min(INVERTER_COUNT, len(pState['serial_number']))):
+        if SERIAL_NUMBER[i] != '' and SERIAL_NUMBER[i] != pState['serial_number'][i]:
+            matching = False
+    if not matching:
+        logger.info("State snapshot does not match the configured inverters, starting from scratch")
+        return False
+    SERIAL_NUMBER[:] = pState['serial_number']
+    NAME[:] = pState['name']
+    AVAILABLE[:] = [ENABLED[i] and pState['available'][i] for i in range(INVERTER_COUNT)]
+    CURRENT_LIMIT[:] = pState['current_limit']
+    LASTLIMITACKNOWLEDGED[:] = pState['limit_acknowledged']
+    HOY_BATTERY_GOOD_VOLTAGE[:] = pState['battery_good_voltage']
+    HOY_PANEL_VOLTAGE_LIST[:] = pState['panel_voltage']
+    HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[:] = pState['panel_min_voltage_history']
+    if pState['last_limit'] is not None:
+        set_limit.LastLimit = pState['last_limit']
+        set_limit.LastLimitAck = pState['last_limit_ack']
+    if pState['power_status'] is not None:
+        set_hoymiles_power_status.LastPowerStatus = pState['power_status']
+    if pState['same_power_status_cnt'] is not None:
+        set_hoymiles_power_status.SamePowerStatusCnt = pState['same_power_status_cnt']
+    DTU.firmware_version = pState['dtu_version']
+    return True
+
+def save_energy_state(pForce=False):
+    if not ENERGY_STATE_FILE:
+        return
+    if not pForce and time.time() - getattr(save_energy_state, "LastSaveTime", 0) < 300:
+        return
+    try:
+        save_snapshot(ENERGY_STATE_FILE, ENERGY.get_state())
+        save_energy_state.LastSaveTime = time.time()
+    except Exception as e:
+        logger.error("Exception at SaveEnergyState: %s", e)
+
+def append_history(pSample):
+    # a failed write is retried with the next sample (the file is opened again), after 10 failures in a row the
+    # history is disabled. It must not stop the control
+    global HISTORY
+    if HISTORY is None:
+        return
+    try:
+        # the SoC is the one of the previous cycle, the battery state is read later in the cycle
+        HISTORY.append(pSample.timestamp, pSample.powermeter_watts, pSample.hoymiles_actual_power, new_limit_setpoint, CURRENT_LIMIT,
+                       None if battery_state is None else battery_state.soc)
+        append_history.ErrorCount = 0
+    except Exception as e:
+        append_history.ErrorCount = getattr(append_history, "ErrorCount", 0) + 1
+        logger.error("Exception at AppendHistory: %s", e)
+        try:
+            HISTORY.close()
+        except Exception:
+            pass
+        if append_history.ErrorCount >= 10:
+            logger.error("History disabled after %s failed writes", append_history.ErrorCount)
+            HISTORY = None
+
+def get_curtailment_watts(pGrid, pProduction, pSetpoint):
+    # estimate of the power withheld by the limit, only while the limit is binding: the setpoint is below the maximum,
+    # the inverters produce at the setpoint and the grid is not above the target. With more import the controller
+    # raises the limit, a production at the setpoint is then limited by the panels, not by the limit.
+    # The headroom up to the maximum is an upper bound, the panels may not be able to deliver all of it
+    max_watt = get_max_watt_from_all_inverters()
+    if pProduction <= 0 or pSetpoint >= max_watt or pProduction < pSetpoint * 0.95 or pGrid > powermeter_target_point + powermeter_tolerance:
+        return 0
+    return max_watt - pSetpoint
+
+def publish_energy_state():
+    if MQTT is None:
+        return
+    for state_name, state_value in ENERGY.get_states().items():
+        MQTT.publish_state(state_name, state_value)
+
+def update_status_segment():
+    if STATUS_SEGMENT is None:
+        return
+    update_status_segment.Cycle = getattr(update_status_segment, "Cycle", 0) + 1
+    power_status = getattr(set_hoymiles_power_status, "LastPowerStatus", None)
+    try:
+        STATUS_SEGMENT.update(
+            update_status_segment.Cycle, powermeter_watts, hoymiles_actual_power, new_limit_setpoint, get_max_watt_from_all_inverters(),
+            None if battery_state is None else battery_state.soc, any(AVAILABLE),
+            [(NAME[i], CURRENT_LIMIT[i], HOY_MAX_WATT[i], AVAILABLE[i], LASTLIMITACKNOWLEDGED[i],
+              None if power_status is None else power_status[i], HOY_BATTERY_MODE[i], HOY_BATTERY_GOOD_VOLTAGE[i])
+             for i in range(INVERTER_COUNT)])
+    except Exception as e:
+        logger.error("Exception at UpdateStatusSegment: %s", e)
+
+def handle_sigterm(signum, frame):
+    logger.info("---Stop Zero Export---", extra=CHANGE)
+    save_state_snapshot(True)
+    save_energy_state(True)
+    sys.exit(0)
+
+def is_new_sample(pReading):
+    # Only react to meter values which were not used before
+    if not is_new_reading(pReading, getattr(is_new_sample, "LastSourceTimestamp", None), getattr(set_limit, "LastChangeTime", 0), 3 * LOOP_INTERVAL_IN_SECONDS):
+        return False
+    if pReading.source_timestamp is not None:
+        is_new_sample.LastSourceTimestamp = pReading.source_timestamp
+    return True
+
+def get_age_compensated_watts(pReading):
+    return get_compensated_watts(pReading, getattr(set_limit, "History", None))
+
+def get_meter_sample(pPowermeterReading, pProductionRead=None):
+    # pairs the grid reading the poll loop acted on with the production (intermediate meter or DTU). The last poll
+    # reads the production at the same time, so formulas combining both values do not mix a fresh consumption with
+    # a production value taken seconds before. After an early end of the poll loop the production is read now
+    hoymiles_actual_power = get_hoymiles_actual_power(pProductionRead)
+    production_time = get_hoymiles_actual_power.ReadTime
+    skew = abs(pPowermeterReading.timestamp - production_time)
+    logger.info('metering sample: %s Watt consumption / %s Watt production, skew %.0f ms', pPowermeterReading.watts, hoymiles_actual_power, skew * 1000)
+    return MeterSample(pPowermeterReading, hoymiles_actual_power, (pPowermeterReading.timestamp + production_time) / 2, skew)
+
 def get_min_watt(pInverter: int):
-    min_watt_percent = CONFIG_PROVIDER.get_min_wattage_in_percent(pInverter)
+    min_watt_percent = CONFIG.min_wattage_in_percent[pInverter]
     return int(HOY_INVERTER_WATT[pInverter] * min_watt_percent / 100)
 
-def cut_limit_to_production(pSetpoint):
+def cut_limit_to_production(pSetpoint, ActualPower):
     if pSetpoint != get_max_watt_from_all_inverters():
-        ActualPower = get_hoymiles_actual_power()
         # prevent the setpoint from running away...
         if pSetpoint > ActualPower + (get_max_watt_from_all_inverters() * MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER / 100):
             pSetpoint = cast_to_int(ActualPower + (get_max_watt_from_all_inverters() * MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER / 100))
-            logger.info('Cut limit to %s Watt, limit was higher than %s percent of live-production', cast_to_int(pSetpoint), MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER)
+            logger.info('Cut limit to %s Watt, limit was higher than %s percent of live-production', cast_to_int(pSetpoint), MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER, extra=CHANGE)
     return cast_to_int(pSetpoint)
 
 def check_and_apply_upper_and_lower_limits(pSetpoint):
@@ -441,8 +719,9 @@ def cross_check_limit():
                 LimitMax = float(CURRENT_LIMIT[i] + HOY_INVERTER_WATT[i] * 0.05)
                 LimitMin = float(CURRENT_LIMIT[i] - HOY_INVERTER_WATT[i] * 0.05)
                 if not (min(LimitMax, LimitMin) < DTULimitInW < max(LimitMax, LimitMin)):
-                    logger.info('CrossCheckLimit: DTU ( %s ) <> SetLimit ( %s ). Resend limit to DTU', "{:.1f}".format(DTULimitInW), "{:.1f}".format(CURRENT_LIMIT[i]))
+                    logger.info('CrossCheckLimit: DTU ( %s ) <> SetLimit ( %s ). Resend limit to DTU', "{:.1f}".format(DTULimitInW), "{:.1f}".format(CURRENT_LIMIT[i]), extra=CHANGE)
                     DTU.set_limit(i, CURRENT_LIMIT[i])
+                    METRIC_LIMIT_RESENT.inc()
     except:
         logger.error("Exception at CrossCheckLimit")
         raise
@@ -459,7 +738,7 @@ def get_max_watt_from_all_inverters():
 def get_max_watt_from_all_battery_inverters_same_prio(pPriority):
     return sum(
         HOY_MAX_WATT[i] for i in range(INVERTER_COUNT)
-        if AVAILABLE[i] and HOY_BATTERY_GOOD_VOLTAGE[i] and HOY_BATTERY_MODE[i] and CONFIG_PROVIDER.get_battery_priority(i) == pPriority
+        if AVAILABLE[i] and HOY_BATTERY_GOOD_VOLTAGE[i] and HOY_BATTERY_MODE[i] and CONFIG.battery_priority[i] == pPriority
     )
 
 def get_max_inverter_watt_from_all_inverters():
@@ -504,7 +783,7 @@ def get_min_watt_from_all_battery_inverters():
 def get_min_watt_from_all_battery_inverters_with_same_priority(pPriority):
     minWatt = 0
     for i in range(INVERTER_COUNT):
-        if (not AVAILABLE[i]) or (not HOY_BATTERY_MODE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]) or (CONFIG_PROVIDER.get_battery_priority(i) != pPriority):
+        if (not AVAILABLE[i]) or (not HOY_BATTERY_MODE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]) or (CONFIG.battery_priority[i] != pPriority):
             continue
         minWatt = minWatt + get_min_watt(i)
     return minWatt  
@@ -512,18 +791,18 @@ def get_min_watt_from_all_battery_inverters_with_same_priority(pPriority):
 def publish_config_state():
     if MQTT is None:
         return
-    MQTT.publish_state("on_grid_usage_jump_to_limit_percent", CONFIG_PROVIDER.on_grid_usage_jump_to_limit_percent())
-    MQTT.publish_state("on_grid_feed_fast_limit_decrease", CONFIG_PROVIDER.on_grid_feed_fast_limit_decrease())
-    MQTT.publish_state("powermeter_target_point", CONFIG_PROVIDER.get_powermeter_target_point())
-    MQTT.publish_state("powermeter_max_point", CONFIG_PROVIDER.get_powermeter_max_point())
-    MQTT.publish_state("powermeter_min_point", CONFIG_PROVIDER.get_powermeter_min_point())
-    MQTT.publish_state("powermeter_tolerance", CONFIG_PROVIDER.get_powermeter_tolerance())
+    MQTT.publish_state("on_grid_usage_jump_to_limit_percent", CONFIG.on_grid_usage_jump_to_limit_percent)
+    MQTT.publish_state("on_grid_feed_fast_limit_decrease", CONFIG.on_grid_feed_fast_limit_decrease)
+    MQTT.publish_state("powermeter_target_point", CONFIG.powermeter_target_point)
+    MQTT.publish_state("powermeter_max_point", CONFIG.powermeter_max_point)
+    MQTT.publish_state("powermeter_min_point", CONFIG.powermeter_min_point)
+    MQTT.publish_state("powermeter_tolerance", CONFIG.powermeter_tolerance)
     MQTT.publish_state("inverter_count", INVERTER_COUNT)
     for i in range(INVERTER_COUNT):
-        MQTT.publish_inverter_state(i, "min_watt_in_percent", CONFIG_PROVIDER.get_min_wattage_in_percent(i))
-        MQTT.publish_inverter_state(i, "normal_watt", CONFIG_PROVIDER.get_normal_wattage(i))
-        MQTT.publish_inverter_state(i, "reduce_watt", CONFIG_PROVIDER.get_reduce_wattage(i))
-        MQTT.publish_inverter_state(i, "battery_priority", CONFIG_PROVIDER.get_battery_priority(i))
+        MQTT.publish_inverter_state(i, "min_watt_in_percent", CONFIG.min_wattage_in_percent[i])
+        MQTT.publish_inverter_state(i, "normal_watt", CONFIG.normal_wattage[i])
+        MQTT.publish_inverter_state(i, "reduce_watt", CONFIG.reduce_wattage[i])
+        MQTT.publish_inverter_state(i, "battery_priority", CONFIG.battery_priority[i])
 
 def publish_global_state(state_name, state_value):
     if MQTT is None:
@@ -535,17 +814,23 @@ def publish_inverter_state(inverter_idx, state_name, state_value):
         return
     MQTT.publish_inverter_state(inverter_idx, state_name, state_value)
 
+def publish_cycle_state():
+    # with MQTT_STATE_AS_JSON the state of the cycle is sent as one document when the cycle is done
+    if MQTT is None:
+        return
+    try:
+        MQTT.publish_state_document()
+    except Exception as e:
+        logger.error("Exception at PublishCycleState: %s", e)
+
 def load_config():
-    global MAX_RETRIES, RETRY_STATUS_CODES, RETRY_BACKOFF_FACTOR, DTU, POWERMETER, INTERMEDIATE_POWERMETER, INVERTER_COUNT, LOOP_INTERVAL_IN_SECONDS, SET_LIMIT_TIMEOUT_SECONDS, SET_POWER_STATUS_DELAY_IN_SECONDS, POLL_INTERVAL_IN_SECONDS, MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER, SET_POWERSTATUS_CNT, SLOW_APPROX_FACTOR_IN_PERCENT, LOG_TEMPERATURE, SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR, powermeter_target_point, MAX_UNLIMITED_CHARGE_SOC
+    global DTU, POWERMETER, INTERMEDIATE_POWERMETER, BATTERY_STATE_PROVIDER
     logger.info(
         "read config file: " + str(Path.joinpath(Path(__file__).parent.resolve(), "HoymilesZeroExport_Config.ini")))
     if args.config:
         logger.info("read additional config file: " + args.config)
     VERSION = config.get('VERSION', 'VERSION')
     logger.info("Config file V %s", VERSION)
-    MAX_RETRIES = config.getint('COMMON', 'MAX_RETRIES', fallback=3)
-    RETRY_STATUS_CODES = config.get('COMMON', 'RETRY_STATUS_CODES', fallback='500,502,503,504')
-    RETRY_BACKOFF_FACTOR = config.getfloat('COMMON', 'RETRY_BACKOFF_FACTOR', fallback=0.1)
     USE_AHOY = config.getboolean('SELECT_DTU', 'USE_AHOY')
     USE_OPENDTU = config.getboolean('SELECT_DTU', 'USE_OPENDTU')
     AHOY_IP = config.get('AHOY_DTU', 'AHOY_IP')
@@ -554,22 +839,181 @@ def load_config():
     OPENDTU_PASS = config.get('OPEN_DTU', 'OPENDTU_PASS')
     DTU = Factory.create_dtu()
     POWERMETER = Factory.create_powermeter()
-    INTERMEDIATE_POWERMETER = Factory.create_intermediate_powermeter()
-    INVERTER_COUNT = config.getint('COMMON', 'INVERTER_COUNT')
-    LOOP_INTERVAL_IN_SECONDS = config.getint('COMMON', 'LOOP_INTERVAL_IN_SECONDS')
-    SET_LIMIT_TIMEOUT_SECONDS = config.getint('COMMON', 'SET_LIMIT_TIMEOUT_SECONDS')
-    SET_POWER_STATUS_DELAY_IN_SECONDS = config.getint('COMMON', 'SET_POWER_STATUS_DELAY_IN_SECONDS')
-    POLL_INTERVAL_IN_SECONDS = config.getint('COMMON', 'POLL_INTERVAL_IN_SECONDS')
-    MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER = config.getint('COMMON',
-                                                                 'MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER')
-    SET_POWERSTATUS_CNT = config.getint('COMMON', 'SET_POWERSTATUS_CNT')
-    SLOW_APPROX_FACTOR_IN_PERCENT = config.getint('COMMON', 'SLOW_APPROX_FACTOR_IN_PERCENT')
-    LOG_TEMPERATURE = config.getboolean('COMMON', 'LOG_TEMPERATURE')
-    SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR = config.getboolean('COMMON', 'SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR',
-                                                                fallback=False)
-    powermeter_target_point = config.getint('CONTROL', 'POWERMETER_TARGET_POINT')
-    MAX_UNLIMITED_CHARGE_SOC = config.getint('CONTROL', 'MAX_UNLIMITED_CHARGE_SOC')
+    INTERMEDIATE_POWERMETER = Factory.create_intermediate_powermeter(DTU)
+    BATTERY_STATE_PROVIDER = Factory.create_battery_state_provider()
+    Factory.assign_http_client(DTU, 'DTU', 'dtu')
+    Factory.assign_http_client(POWERMETER, 'METER', 'powermeter')
+    if INTERMEDIATE_POWERMETER is not DTU:
+        Factory.assign_http_client(INTERMEDIATE_POWERMETER, 'METER', 'intermediate meter')
+    Factory.assign_http_client(BATTERY_STATE_PROVIDER, 'METER', 'battery')
+    load_settings(read_settings(config))
+
+def read_inverter_settings(pConfig, pInverterId):
+    section = 'INVERTER_' + str(pInverterId + 1)
+    max_watt = pConfig.getint(section, 'HOY_MAX_WATT')
+    return [
+        (SERIAL_NUMBER, pConfig.get(section, 'SERIAL_NUMBER', fallback='')),
+        (ENABLED, pConfig.getboolean(section, 'ENABLED', fallback = True)),
+        (HOY_MAX_WATT, max_watt),
+        (HOY_INVERTER_WATT, pConfig.getint(section, 'HOY_INVERTER_WATT') if pConfig.get(section, 'HOY_INVERTER_WATT') != '' else max_watt),
+        (HOY_BATTERY_MODE, pConfig.getboolean(section, 'HOY_BATTERY_MODE')),
+        (HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V, pConfig.getfloat(section, 'HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V')),
+        (HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V, pConfig.getfloat(section, 'HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V')),
+        (HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V, pConfig.getfloat(section, 'HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V')),
+        (HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V, pConfig.getfloat(section, 'HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V')),
+        (HOY_COMPENSATE_WATT_FACTOR, pConfig.getfloat(section, 'HOY_COMPENSATE_WATT_FACTOR')),
+        (HOY_BATTERY_IGNORE_PANELS, pConfig.get(section, 'HOY_BATTERY_IGNORE_PANELS')),
+        (HOY_BATTERY_AVERAGE_CNT, pConfig.getint(section, 'HOY_BATTERY_AVERAGE_CNT', fallback=1)),
+    ]
 
+def load_inverter_settings(pInverterId, pSettings):
+    # the settings are appended on the first call and replaced when the config file changed
+    for setting_list, value in pSettings:
+        if pInverterId < len(setting_list):
+            setting_list[pInverterId] = value
+        else:
+            setting_list.append(value)
+
+def get_script_path(pPath):
+    # relative to this script, an empty path stays empty (= disabled)
+    return str(Path.joinpath(Path(__file__).parent.resolve(), pPath)) if pPath else ''
+
+def read_settings(pConfig):
+    # everything except the drivers and the inverter settings, read again when the config file changed
+    return {
+        'HTTP_STATISTICS_INTERVAL_IN_SECONDS': pConfig.getint('COMMON', 'HTTP_STATISTICS_INTERVAL_IN_SECONDS', fallback=3600),
+        'METRICS_PORT': pConfig.getint('COMMON', 'METRICS_PORT', fallback=0),
+        'SPANS_FILE': get_script_path(pConfig.get('COMMON', 'SPANS_FILE', fallback='')),
+        'SPANS_FILE_MAX_SIZE_IN_MB': pConfig.getint('COMMON', 'SPANS_FILE_MAX_SIZE_IN_MB', fallback=10),
+        'PROFILE_EVERY_N_CYCLES': pConfig.getint('COMMON', 'PROFILE_EVERY_N_CYCLES', fallback=0),
+        'PROFILE_KEEP_COUNT': pConfig.getint('COMMON', 'PROFILE_KEEP_COUNT', fallback=10),
+        'HISTORY_DIR': get_script_path(pConfig.get('COMMON', 'HISTORY_DIR', fallback='')),
+        'ENERGY_STATE_FILE': get_script_path(pConfig.get('COMMON', 'ENERGY_STATE_FILE', fallback='HoymilesZeroExport_Energy.json')),
+        'STATUS_SEGMENT_FILE': pConfig.get('COMMON', 'STATUS_SEGMENT_FILE', fallback=''),
+        'INVERTER_COUNT': pConfig.getint('COMMON', 'INVERTER_COUNT'),
+        'LOOP_INTERVAL_IN_SECONDS': pConfig.getint('COMMON', 'LOOP_INTERVAL_IN_SECONDS'),
+        'SET_LIMIT_TIMEOUT_SECONDS': pConfig.getint('COMMON', 'SET_LIMIT_TIMEOUT_SECONDS'),
+        'SET_POWER_STATUS_DELAY_IN_SECONDS': pConfig.getint('COMMON', 'SET_POWER_STATUS_DELAY_IN_SECONDS'),
+        'POLL_INTERVAL_IN_SECONDS': pConfig.getint('COMMON', 'POLL_INTERVAL_IN_SECONDS'),
+        'MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER': pConfig.getint('COMMON', 'MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER'),
+        'SET_POWERSTATUS_CNT': pConfig.getint('COMMON', 'SET_POWERSTATUS_CNT'),
+        'SLOW_APPROX_FACTOR_IN_PERCENT': pConfig.getint('COMMON', 'SLOW_APPROX_FACTOR_IN_PERCENT'),
+        'SLOW_APPROX_LIMIT_IN_PERCENT': pConfig.getint('COMMON', 'SLOW_APPROX_LIMIT_IN_PERCENT'),
+        'LOG_TEMPERATURE': pConfig.getboolean('COMMON', 'LOG_TEMPERATURE'),
+        'SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR': pConfig.getboolean('COMMON', 'SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR', fallback=False),
+        'powermeter_target_point': pConfig.getint('CONTROL', 'POWERMETER_TARGET_POINT'),
+        'MAX_UNLIMITED_CHARGE_SOC': pConfig.getint('CONTROL', 'MAX_UNLIMITED_CHARGE_SOC'),
+        'SCHEDULE_LATITUDE': pConfig.getfloat('SCHEDULE', 'LATITUDE', fallback=None) if pConfig.get('SCHEDULE', 'LATITUDE', fallback='') else None,
+        'SCHEDULE_LONGITUDE': pConfig.getfloat('SCHEDULE', 'LONGITUDE', fallback=None) if pConfig.get('SCHEDULE', 'LONGITUDE', fallback='') else None,
+        'SCHEDULE_SUN_MARGIN_IN_MINUTES': pConfig.getint('SCHEDULE', 'SUN_MARGIN_IN_MINUTES', fallback=30),
+        'NIGHT_PROBE_INTERVAL_IN_SECONDS': pConfig.getint('SCHEDULE', 'NIGHT_PROBE_INTERVAL_IN_SECONDS', fallback=900),
+        'IDLE_MAX_INTERVAL_IN_SECONDS': pConfig.getint('SCHEDULE', 'IDLE_MAX_INTERVAL_IN_SECONDS', fallback=60),
+        'STATE_SNAPSHOT_FILE': get_script_path(pConfig.get('COMMON', 'STATE_SNAPSHOT_FILE', fallback='HoymilesZeroExport_State.json')),
+        'STATE_SNAPSHOT_MAX_AGE_IN_SECONDS': pConfig.getint('COMMON', 'STATE_SNAPSHOT_MAX_AGE_IN_SECONDS', fallback=300),
+    }
+
+def load_settings(pSettings):
+    # the settings of read_settings() become the globals of the same name, all at once
+    globals().update(pSettings)
+
+def rebuild_driver(pKind):
+    global DTU, POWERMETER, INTERMEDIATE_POWERMETER, BATTERY_STATE_PROVIDER
+    # the new driver is created first, if its config is broken or the DTU cannot be used the old one keeps running
+    driver = None
+    try:
+        if pKind == 'dtu':
+            driver = Factory.create_dtu()
+            Factory.assign_http_client(driver, 'DTU', 'dtu')
+            # quits if the firmware is too old
+            driver.check_min_version()
+        elif pKind == 'powermeter':
+            driver = Factory.create_powermeter()
+        elif pKind == 'intermediate meter':
+            driver = Factory.create_intermediate_powermeter(DTU)
+        else:
+            driver = Factory.create_battery_state_provider()
+    except (Exception, SystemExit) as e:
+        logger.error("Config: unable to create the new %s, keeping the old one: %s", pKind, e)
+        if driver is not None:
+            driver.close()
+        return
+    if pKind == 'dtu':
+        old_driver, DTU = DTU, driver
+        if INTERMEDIATE_POWERMETER is old_driver:
+            INTERMEDIATE_POWERMETER = DTU
+    elif pKind == 'powermeter':
+        old_driver, POWERMETER = POWERMETER, driver
+        Factory.assign_http_client(POWERMETER, 'METER', 'powermeter')
+    elif pKind == 'intermediate meter':
+        old_driver, INTERMEDIATE_POWERMETER = INTERMEDIATE_POWERMETER, driver
+        if INTERMEDIATE_POWERMETER is not DTU:
+            Factory.assign_http_client(INTERMEDIATE_POWERMETER, 'METER', 'intermediate meter')
+        if old_driver is DTU:
+            old_driver = None
+    else:
+        old_driver, BATTERY_STATE_PROVIDER = BATTERY_STATE_PROVIDER, driver
+        Factory.assign_http_client(BATTERY_STATE_PROVIDER, 'METER', 'battery')
+    if old_driver is not None:
+        old_driver.close()
+    logger.info("Config: %s is now %s", pKind, driver.__class__.__name__ if driver is not None else 'disabled', extra=CHANGE)
+
+def apply_config_change():
+    global SLOW_APPROX_LIMIT
+    if CONFIG_WATCHER is None:
+        return
+    change = CONFIG_WATCHER.get_change()
+    if change is None:
+        return
+    sections = {section: dict(values) for section, values in change[0].items()}
+    # the changes of a rejected config file are applied together with the next one
+    changes = {section: set(keys) for section, keys in getattr(apply_config_change, "RejectedChanges", {}).items()}
+    for section, keys in change[1].items():
+        changes.setdefault(section, set()).update(keys)
+    for section, keys in sorted(change[1].items()):
+        logger.info("Config: changed in [%s]: %s", section, ', '.join(sorted(key.upper() for key in keys)), extra=CHANGE)
+    try:
+        # these are only read at the start, keep the running values
+        for section, keys in RESTART_REQUIRED_SETTINGS.items():
+            # the config parser stores the keys in lower case
+            changed_keys = changes.get(section, set()) if keys is None else changes.get(section, set()) & {key.lower() for key in keys}
+            if not changed_keys:
+                continue
+            logger.warning("Config: [%s] %s take effect after a restart", section, ', '.join(sorted(key.upper() for key in changed_keys)))
+            if config.has_section(section):
+                running_values = dict(config.items(section, raw=True))
+                for key in changed_keys:
+                    if key in running_values:
+                        sections.setdefault(section, {})[key] = running_values[key]
+                    else:
+                        sections.get(section, {}).pop(key, None)
+        # everything is read from the new config before anything is applied, with an invalid value the running
+        # config stays as it is
+        new_config = ConfigParser()
+        new_config.read_dict(sections)
+        settings = read_settings(new_config)
+        inverter_settings = [read_inverter_settings(new_config, i) for i in range(INVERTER_COUNT)]
+        ConfigFileConfigProvider(new_config).get_snapshot(INVERTER_COUNT)
+    except Exception as e:
+        logger.error("Config: invalid config file, keeping the running config: %s", e)
+        apply_config_change.RejectedChanges = changes
+        return
+    apply_config_change.RejectedChanges = {}
+    try:
+        for section in config.sections():
+            config.remove_section(section)
+        config.read_dict(sections)
+        load_settings(settings)
+        for i in range(INVERTER_COUNT):
+            load_inverter_settings(i, inverter_settings[i])
+        SLOW_APPROX_LIMIT = cast_to_int(get_max_watt_from_all_inverters() * SLOW_APPROX_LIMIT_IN_PERCENT / 100)
+        ENERGY.max_gap = max(300, 3 * LOOP_INTERVAL_IN_SECONDS)
+        CONFIG_FILE_PROVIDER.reload()
+        # the drivers read the swapped config, a driver which cannot be created keeps the old one
+        for kind, driver_sections in DRIVER_SECTIONS.items():
+            if changes.keys() & set(driver_sections):
+                rebuild_driver(kind)
+    except Exception as e:
+        logger.error("Exception at ApplyConfigChange: %s", e)
 
 # ----- START -----
 logger.info("Author:         %s / Script Version: %s",__author__, __version__)
@@ -578,45 +1022,76 @@ logger.info("Contributor(s): %s", __contributors__)
 # read config:
 load_config()
 
-retry = Retry(total=MAX_RETRIES,
-              backoff_factor=RETRY_BACKOFF_FACTOR,
-              status_forcelist=[int(status_code) for status_code in RETRY_STATUS_CODES.split(',')],
-              allowed_methods={"GET", "POST"})
-adapter = HTTPAdapter(max_retries=retry)
+adapter = Factory.create_http_adapter()
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
 for i in range(INVERTER_COUNT):
-    SERIAL_NUMBER.append(config.get('INVERTER_' + str(i + 1), 'SERIAL_NUMBER', fallback=''))
-    ENABLED.append(config.getboolean('INVERTER_' + str(i + 1), 'ENABLED', fallback = True))
     NAME.append(str('yet unknown'))
     TEMPERATURE.append(str('--- degC'))
-    HOY_MAX_WATT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_MAX_WATT'))
-    
-    if (config.get('INVERTER_' + str(i + 1), 'HOY_INVERTER_WATT') != ''):
-        HOY_INVERTER_WATT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_INVERTER_WATT'))
-    else:
-        HOY_INVERTER_WATT.append(HOY_MAX_WATT[i])
-        
     CURRENT_LIMIT.append(int(-1))
     AVAILABLE.append(bool(False))
     LASTLIMITACKNOWLEDGED.append(bool(False))
     HOY_BATTERY_GOOD_VOLTAGE.append(bool(True))
-    HOY_BATTERY_MODE.append(config.getboolean('INVERTER_' + str(i + 1), 'HOY_BATTERY_MODE'))
-    HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V'))
-    HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V'))
-    HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V'))
-    HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V'))
-    HOY_COMPENSATE_WATT_FACTOR.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_COMPENSATE_WATT_FACTOR'))
-    HOY_BATTERY_IGNORE_PANELS.append(config.get('INVERTER_' + str(i + 1), 'HOY_BATTERY_IGNORE_PANELS'))
     HOY_PANEL_VOLTAGE_LIST.append([])
     HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST.append([])
-    HOY_BATTERY_AVERAGE_CNT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_AVERAGE_CNT', fallback=1))
-
-SLOW_APPROX_LIMIT = cast_to_int(get_max_watt_from_all_inverters() * config.getint('COMMON', 'SLOW_APPROX_LIMIT_IN_PERCENT') / 100)
-CONFIG_PROVIDER = ConfigFileConfigProvider(config)
+    load_inverter_settings(i, read_inverter_settings(config, i))
+
+METER_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='meter')
+SLOW_APPROX_LIMIT = cast_to_int(get_max_watt_from_all_inverters() * SLOW_APPROX_LIMIT_IN_PERCENT / 100)
+CONFIG_FILE_PROVIDER = ConfigFileConfigProvider(config)
+CONFIG_PROVIDER = CONFIG_FILE_PROVIDER
+# settings which are only read at the start, None = the whole section
+RESTART_REQUIRED_SETTINGS = {
+    'VERSION': None,
+    'MQTT_CONFIG': None,
+    'COMMON': ('INVERTER_COUNT', 'ENABLE_LOG_TO_FILE', 'LOG_BACKUP_COUNT', 'LOG_MODE', 'METRICS_PORT', 'SPANS_FILE',
+               'SPANS_FILE_MAX_SIZE_IN_MB', 'PROFILE_EVERY_N_CYCLES', 'PROFILE_KEEP_COUNT', 'HISTORY_DIR', 'STATUS_SEGMENT_FILE', 'CONFIG_RELOAD_INTERVAL_IN_SECONDS'),
+}
+CONFIG_RELOAD_INTERVAL_IN_SECONDS = config.getint('COMMON', 'CONFIG_RELOAD_INTERVAL_IN_SECONDS', fallback=5)
+CONFIG_WATCHER = ConfigFileWatcher([baseconfig, args.config], CONFIG_RELOAD_INTERVAL_IN_SECONDS) if CONFIG_RELOAD_INTERVAL_IN_SECONDS > 0 else None
 MQTT = None
 
+# metrics are always recorded, they are only served if METRICS_PORT is set. Children which are updated in the
+# loop are bound once here.
+METRICS = Registry()
+METRIC_LOOP_DURATION = METRICS.histogram('hoymiles_loop_duration_seconds', 'Duration of the control loop cycles', buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+METRIC_LOOP_SECONDS = METRICS.counter('hoymiles_loop_seconds_total', 'Time spent in the control loop by phase', ('phase',))
+METRIC_LOOP_WORK_SECONDS = METRIC_LOOP_SECONDS.labels('work')
+METRIC_LOOP_SLEEP_SECONDS = METRIC_LOOP_SECONDS.labels('sleep')
+METRIC_METER_READ_DURATION = METRICS.histogram('hoymiles_meter_read_duration_seconds', 'Duration of the meter reads', ('meter',))
+METRIC_GRID_READ_DURATION = METRIC_METER_READ_DURATION.labels('grid')
+METRIC_PRODUCTION_READ_DURATION = METRIC_METER_READ_DURATION.labels('production')
+METRIC_LIMIT_ACK_DURATION = METRICS.histogram('hoymiles_limit_ack_duration_seconds', 'Time until an inverter acknowledged a new limit', ('inverter',), buckets=(0.5, 1, 2, 3, 5, 10, 20, 30))
+METRIC_COMMANDS = METRICS.counter('hoymiles_commands_total', 'Commands to the inverters by result', ('command', 'result'))
+METRIC_LIMIT_ACKNOWLEDGED = METRIC_COMMANDS.labels('limit', 'acknowledged')
+METRIC_LIMIT_TIMEOUT = METRIC_COMMANDS.labels('limit', 'timeout')
+METRIC_LIMIT_SUPPRESSED = METRIC_COMMANDS.labels('limit', 'suppressed')
+METRIC_LIMIT_RESENT = METRIC_COMMANDS.labels('limit', 'resent')
+METRIC_POWER_STATUS_SENT = METRIC_COMMANDS.labels('power_status', 'sent')
+METRIC_POWER_STATUS_SUPPRESSED = METRIC_COMMANDS.labels('power_status', 'suppressed')
+METRIC_GRID_POWER = METRICS.gauge('hoymiles_grid_power_watts', 'Grid power of the last cycle, positive = consumption')
+METRIC_PRODUCTION = METRICS.gauge('hoymiles_production_watts', 'Production of the inverters in the last cycle')
+METRIC_LIMIT_SETPOINT = METRICS.gauge('hoymiles_limit_setpoint_watts', 'Limit setpoint of all inverters')
+METRICS.add_collector(collect_http_clients)
+METRICS.add_collector(collect_inverter_metrics)
+if METRICS_PORT > 0:
+    MetricsServer(METRICS, METRICS_PORT)
+# samples further apart than this (e.g. after idling at night) do not count as energy
+ENERGY = EnergyAccounting(max(300, 3 * LOOP_INTERVAL_IN_SECONDS))
+energy_state = load_snapshot(ENERGY_STATE_FILE, float('inf')) if ENERGY_STATE_FILE else None
+if energy_state is not None:
+    ENERGY.restore_state(energy_state)
+STATUS_SEGMENT = None
+if STATUS_SEGMENT_FILE:
+    try:
+        STATUS_SEGMENT = StatusSegmentWriter(STATUS_SEGMENT_FILE, INVERTER_COUNT)
+    except OSError as e:
+        logger.error("Unable to create status segment %s: %s", STATUS_SEGMENT_FILE, e)
+HISTORY = HistoryRecorder(HISTORY_DIR, INVERTER_COUNT) if HISTORY_DIR else None
+SPANS = SpanRecorder(SPANS_FILE, PROFILE_EVERY_N_CYCLES, str(Path.joinpath(Path(__file__).parent.resolve(), 'profiles')),
+                     SPANS_FILE_MAX_SIZE_IN_MB * 1024 * 1024, PROFILE_KEEP_COUNT)
+
 if config.has_section("MQTT_CONFIG"):
     broker = config.get("MQTT_CONFIG", "MQTT_BROKER")
     port = config.getint("MQTT_CONFIG", "MQTT_PORT", fallback=1883)
@@ -626,28 +1101,42 @@ if config.has_section("MQTT_CONFIG"):
     topic_prefix = config.get("MQTT_CONFIG", "MQTT_SET_TOPIC", fallback="zeropower")
     log_level_config_value = config.get("MQTT_CONFIG", "MQTT_LOG_LEVEL", fallback=None)
     mqtt_log_level = logging.getLevelName(log_level_config_value) if log_level_config_value else None
-    MQTT = MqttHandler(broker, port, client_id, username, password, topic_prefix, mqtt_log_level)
+    state_refresh_interval = config.getint("MQTT_CONFIG", "MQTT_STATE_REFRESH_INTERVAL_IN_SECONDS", fallback=300)
+    state_as_json = config.getboolean("MQTT_CONFIG", "MQTT_STATE_AS_JSON", fallback=False)
+    MQTT = MqttHandler(broker, port, client_id, username, password, topic_prefix, mqtt_log_level, state_refresh_interval, state_as_json)
 
     if mqtt_log_level is not None:
-        class MqttLogHandler(logging.Handler):
-            def emit(self, record):
-                MQTT.publish_log_record(record)
-
-        logger.addHandler(MqttLogHandler())
+        # the records are published in batches by a background thread, logging never waits for the broker
+        logger.addHandler(BatchingLogShipper(
+            MQTT.publish_log,
+            mqtt_log_level,
+            config.getint("MQTT_CONFIG", "MQTT_LOG_QUEUE_SIZE", fallback=1000),
+            config.getfloat("MQTT_CONFIG", "MQTT_LOG_INTERVAL_IN_SECONDS", fallback=5),
+            config.getint("MQTT_CONFIG", "MQTT_LOG_MAX_RECORDS_PER_MESSAGE", fallback=100)
+        ))
 
     CONFIG_PROVIDER = ConfigProviderChain([MQTT, CONFIG_PROVIDER])
 
+# immutable snapshot of the configuration, read once per loop cycle
+CONFIG = CONFIG_PROVIDER.get_snapshot(INVERTER_COUNT)
+
 try:
     logger.info("---Init---")
     new_limit_setpoint = 0
-    DTU.check_min_version()
-    if get_hoymiles_available():
-        for i in range(INVERTER_COUNT):
-            set_hoymiles_power_status(i, True)
-        new_limit_setpoint = get_min_watt_from_all_inverters()
-        set_limit(new_limit_setpoint)
-        get_hoymiles_actual_power()
-        get_check_battery()
+    state_snapshot = load_snapshot(STATE_SNAPSHOT_FILE, STATE_SNAPSHOT_MAX_AGE_IN_SECONDS) if STATE_SNAPSHOT_MAX_AGE_IN_SECONDS > 0 else None
+    if state_snapshot is not None and restore_state_snapshot(state_snapshot):
+        # warm restart: the inverters still run with the saved limits, no need to initialize them again
+        new_limit_setpoint = state_snapshot['limit_setpoint']
+        logger.info("Warm restart: resuming with the state from %.0f s ago, limit setpoint %s Watt", state_snapshot['age'], new_limit_setpoint)
+    else:
+        DTU.check_min_version()
+        if get_hoymiles_available():
+            for i in range(INVERTER_COUNT):
+                set_hoymiles_power_status(i, True)
+            new_limit_setpoint = get_min_watt_from_all_inverters()
+            set_limit(new_limit_setpoint)
+            get_hoymiles_actual_power()
+            get_check_battery()
     get_powermeter_watts()
 except Exception as e:
     if hasattr(e, 'message'):
@@ -656,32 +1145,33 @@ except Exception as e:
         logger.error(e)
     time.sleep(LOOP_INTERVAL_IN_SECONDS)
 logger.info("---Start Zero Export---")
+CYCLE_SUMMARY = CycleSummary()
+if LOG_MODE == 'summary':
+    # from now on the routine messages of a cycle are replaced by one summary record
+    logger.addFilter(RoutineMessageFilter())
+signal.signal(signal.SIGTERM, handle_sigterm)
+# values of the last cycle, also used for the status segment
+battery_state = None
+powermeter_watts = 0
+hoymiles_actual_power = 0
 
 while True:
-    socResult = session.get(
-        'http://192.168.37.6:8093/v1/state/growatt.0.2276541.devices.CYF6CF4005.statusData.SOC').json()
-    soc = socResult['val']
-
-    socResult = session.get(
-        'http://192.168.37.6:8093/v1/state/growatt.0.2276541.devices.CYF6CF4005.historyLast.batteryTemperature').json()
-    bat_temperature = socResult['val']
-
-    json = session.get(
-        'http://192.168.37.6:8093/v1/state/growatt.0.2276541.devices.CYF6CF4005.statusData.pdisCharge1').json()
-    discharge_watts = json['val'] * 1000.0
-
-    json = session.get(
-        'http://192.168.37.6:8093/v1/state/growatt.0.2276541.devices.CYF6CF4005.statusData.chargePower').json()
-    chargePower = json['val'] * 1000.0
-
-    CONFIG_PROVIDER.update()
-    publish_config_state()
-    on_grid_usage_jump_to_limit_percent = CONFIG_PROVIDER.on_grid_usage_jump_to_limit_percent()
-    on_grid_feed_fast_limit_decrease = CONFIG_PROVIDER.on_grid_feed_fast_limit_decrease()    
-    powermeter_target_point = CONFIG_PROVIDER.get_powermeter_target_point()
-    powermeter_max_point = CONFIG_PROVIDER.get_powermeter_max_point()
-    powermeter_min_point = CONFIG_PROVIDER.get_powermeter_min_point()
-    powermeter_tolerance = CONFIG_PROVIDER.get_powermeter_tolerance()
+    observe_loop_timing()
+    SPANS.next_cycle()
+    SPANS.call('config_reload', apply_config_change)
+    update_status_segment()
+    log_http_statistics()
+    SPANS.call('state_snapshot', save_state_snapshot)
+    save_energy_state()
+    SPANS.call('config_update', CONFIG_PROVIDER.update)
+    CONFIG = CONFIG_PROVIDER.get_snapshot(INVERTER_COUNT)
+    SPANS.call('publish_config', publish_config_state)
+    on_grid_usage_jump_to_limit_percent = CONFIG.on_grid_usage_jump_to_limit_percent
+    on_grid_feed_fast_limit_decrease = CONFIG.on_grid_feed_fast_limit_decrease
+    powermeter_target_point = CONFIG.powermeter_target_point
+    powermeter_max_point = CONFIG.powermeter_max_point
+    powermeter_min_point = CONFIG.powermeter_min_point
+    powermeter_tolerance = CONFIG.powermeter_tolerance
     if powermeter_max_point < (powermeter_target_point + powermeter_tolerance):
         powermeter_max_point = powermeter_target_point + powermeter_tolerance + 50
         logger.info(
@@ -689,39 +1179,64 @@ while True:
                 powermeter_max_point))
 
     try:
-        hoymiles_actual_power = get_hoymiles_actual_power()
         previous_limit_setpoint = new_limit_setpoint
-        if get_hoymiles_available() and get_check_battery():
+        inverters_available = SPANS.call('availability', get_hoymiles_available)
+        if inverters_available:
+            get_idle_interval.IdleCount = 0
+        if inverters_available and SPANS.call('battery_check', get_check_battery):
             if LOG_TEMPERATURE:
-                get_hoymiles_temperature()
-            for x in range(cast_to_int(LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS)):
-                powermeter_watts = get_powermeter_watts()
-                if powermeter_watts > powermeter_max_point:
-                    if on_grid_usage_jump_to_limit_percent > 0:
-                        new_limit_setpoint = cast_to_int(get_max_inverter_watt_from_all_inverters() * on_grid_usage_jump_to_limit_percent / 100)
-                        if (new_limit_setpoint <= previous_limit_setpoint) and (on_grid_usage_jump_to_limit_percent != 100):
+                SPANS.call('temperature', get_hoymiles_temperature)
+            with SPANS.span('meter_poll'):
+                poll_count = max(1, cast_to_int(LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS))
+                production_read = None
+                # the reading a limit was already set for, it is not checked for being new again below
+                acted_on_reading = None
+                for x in range(poll_count):
+                    if x == poll_count - 1:
+                        # the last reading is the one of the cycle, read the production at the same time
+                        production_read = METER_EXECUTOR.submit(read_intermediate_powermeter)
+                    powermeter_reading = get_powermeter_reading()
+                    powermeter_watts = get_age_compensated_watts(powermeter_reading)
+                    if (powermeter_watts > powermeter_max_point) and is_new_sample(powermeter_reading):
+                        if on_grid_usage_jump_to_limit_percent > 0:
+                            new_limit_setpoint = cast_to_int(get_max_inverter_watt_from_all_inverters() * on_grid_usage_jump_to_limit_percent / 100)
+                            if (new_limit_setpoint <= previous_limit_setpoint) and (on_grid_usage_jump_to_limit_percent != 100):
+                                new_limit_setpoint = previous_limit_setpoint + powermeter_watts - powermeter_target_point
+                        else:
                             new_limit_setpoint = previous_limit_setpoint + powermeter_watts - powermeter_target_point
-                    else:
+                        new_limit_setpoint = check_and_apply_upper_and_lower_limits(new_limit_setpoint)
+                        SPANS.call('set_limit', set_limit, new_limit_setpoint)
+                        acted_on_reading = powermeter_reading
+                        remaining_delay = cast_to_int((LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS - x) * POLL_INTERVAL_IN_SECONDS)
+                        if remaining_delay > 0:
+                            loop_sleep(remaining_delay)
+                            break
+                    elif (powermeter_watts < powermeter_min_point) and on_grid_feed_fast_limit_decrease and is_new_sample(powermeter_reading):
                         new_limit_setpoint = previous_limit_setpoint + powermeter_watts - powermeter_target_point
-                    new_limit_setpoint = check_and_apply_upper_and_lower_limits(new_limit_setpoint)
-                    set_limit(new_limit_setpoint)
-                    remaining_delay = cast_to_int((LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS - x) * POLL_INTERVAL_IN_SECONDS)
-                    if remaining_delay > 0:
-                        time.sleep(remaining_delay)
-                        break
-                elif (powermeter_watts < powermeter_min_point) and on_grid_feed_fast_limit_decrease:
-                    new_limit_setpoint = previous_limit_setpoint + powermeter_watts - powermeter_target_point
-                    new_limit_setpoint = check_and_apply_upper_and_lower_limits(new_limit_setpoint)
-                    set_limit(new_limit_setpoint)
-                    remaining_delay = cast_to_int((LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS - x) * POLL_INTERVAL_IN_SECONDS)
-                    if remaining_delay > 0:
-                        time.sleep(remaining_delay)
-                        break
-                else:
-                    time.sleep(POLL_INTERVAL_IN_SECONDS)
+                        new_limit_setpoint = check_and_apply_upper_and_lower_limits(new_limit_setpoint)
+                        SPANS.call('set_limit', set_limit, new_limit_setpoint)
+                        acted_on_reading = powermeter_reading
+                        remaining_delay = cast_to_int((LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS - x) * POLL_INTERVAL_IN_SECONDS)
+                        if remaining_delay > 0:
+                            loop_sleep(remaining_delay)
+                            break
+                    else:
+                        loop_sleep(POLL_INTERVAL_IN_SECONDS)
+
+            meter_sample = SPANS.call('meter_sample', get_meter_sample, powermeter_reading, production_read)
+            hoymiles_actual_power = meter_sample.hoymiles_actual_power
+            # the measured values are recorded, the control below works with the age compensated grid power
+            METRIC_GRID_POWER.set(meter_sample.powermeter_watts)
+            METRIC_PRODUCTION.set(hoymiles_actual_power)
+            ENERGY.add_sample(meter_sample.timestamp, meter_sample.powermeter_watts, hoymiles_actual_power, get_curtailment_watts(meter_sample.powermeter_watts, hoymiles_actual_power, new_limit_setpoint))
+            publish_energy_state()
+            SPANS.call('history', append_history, meter_sample)
+            if meter_sample.powermeter_reading is not acted_on_reading and not is_new_sample(meter_sample.powermeter_reading):
+                continue
+            powermeter_watts = get_age_compensated_watts(meter_sample.powermeter_reading)
 
             if MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER != 100:
-                cut_limit = cut_limit_to_production(new_limit_setpoint)
+                cut_limit = SPANS.call('cut_limit_to_production', cut_limit_to_production, new_limit_setpoint, hoymiles_actual_power)
                 if cut_limit != new_limit_setpoint:
                     new_limit_setpoint = cut_limit
                     previous_limit_setpoint = new_limit_setpoint
@@ -757,82 +1272,107 @@ while True:
                 else:
                     logger.info("Not enough energy producing: limit already at maximum")
 
-            # Check battery SoC and increase the limit, if necessary
             total_rated_power = get_max_watt_from_all_inverters()
-            if discharge_watts > 0 and new_limit_setpoint < (total_rated_power - discharge_watts):
-                new_limit_setpoint = discharge_watts * 1.1 + hoymiles_actual_power
-                logger.warning(f'Increasing limit to current discharge plus margin: {new_limit_setpoint}W')
-            else:
-                logger.warning(f'Leaving set point at: {new_limit_setpoint}')
-
-            # In principle, we do not need to adjust limits before the battery is full;
-            # however, there might be a temperature limitation which is cared for below.
+            battery_state = SPANS.call('battery_state', get_battery_state)
             limit_active = True
-            if soc < MAX_UNLIMITED_CHARGE_SOC:
-                new_limit_setpoint = powermeter_watts + powermeter_tolerance
-                limit_active = False
-                set_hoymiles_power_status(0, True)
-                set_hoymiles_power_status(1, True)
-                set_hoymiles_power_status(2, True)
-            elif soc >= MAX_UNLIMITED_CHARGE_SOC and soc < 97:
-                set_hoymiles_power_status(0, False)
-                set_hoymiles_power_status(1, True)
-                set_hoymiles_power_status(2, True)
-            elif soc >= 97 and soc < 99:
-                set_hoymiles_power_status(0, False)
-                set_hoymiles_power_status(1, False)
-                set_hoymiles_power_status(2, True)
-            elif soc >= 99:
-                set_hoymiles_power_status(0, False)
-                set_hoymiles_power_status(1, False)
-                set_hoymiles_power_status(2, False)
-
-            # adjust the limit with battery temperature
-            temperature_degradation = True
-            if bat_temperature <= 0:
-                new_limit_setpoint = powermeter_watts
-            elif bat_temperature > 0 and bat_temperature <= 10.0:
-                new_limit_setpoint = powermeter_watts + 510
-            elif bat_temperature > 10 and bat_temperature <= 20.0:
-                new_limit_setpoint = powermeter_watts + 2100
-            elif bat_temperature > 20.0 and bat_temperature <= 25.0:
-                new_limit_setpoint = powermeter_watts + 3200
-            else:
-                temperature_degradation = False
+            temperature_degradation = False
+            if battery_state is not None:
+                # Check battery discharge and increase the limit, if necessary
+                if battery_state.discharge_watts > 0 and new_limit_setpoint < (total_rated_power - battery_state.discharge_watts):
+                    new_limit_setpoint = battery_state.discharge_watts * 1.1 + hoymiles_actual_power
+                    logger.info('Increasing limit to current discharge plus margin: %sW', new_limit_setpoint)
+                    CYCLE_SUMMARY.add('discharge_limit_w', new_limit_setpoint)
+                else:
+                    logger.info('Leaving set point at: %s', new_limit_setpoint)
+
+                # In principle, we do not need to adjust limits before the battery is full;
+                # however, there might be a temperature limitation which is cared for below.
+                if battery_state.soc < MAX_UNLIMITED_CHARGE_SOC:
+                    new_limit_setpoint = powermeter_watts + powermeter_tolerance
+                    limit_active = False
+                    set_hoymiles_power_status(0, True)
+                    set_hoymiles_power_status(1, True)
+                    set_hoymiles_power_status(2, True)
+                elif battery_state.soc >= MAX_UNLIMITED_CHARGE_SOC and battery_state.soc < 97:
+                    set_hoymiles_power_status(0, False)
+                    set_hoymiles_power_status(1, True)
+                    set_hoymiles_power_status(2, True)
+                elif battery_state.soc >= 97 and battery_state.soc < 99:
+                    set_hoymiles_power_status(0, False)
+                    set_hoymiles_power_status(1, False)
+                    set_hoymiles_power_status(2, True)
+                elif battery_state.soc >= 99:
+                    set_hoymiles_power_status(0, False)
+                    set_hoymiles_power_status(1, False)
+                    set_hoymiles_power_status(2, False)
+
+                # adjust the limit with battery temperature
+                temperature_degradation = True
+                if battery_state.temperature <= 0:
+                    new_limit_setpoint = powermeter_watts
+                elif battery_state.temperature > 0 and battery_state.temperature <= 10.0:
+                    new_limit_setpoint = powermeter_watts + 510
+                elif battery_state.temperature > 10 and battery_state.temperature <= 20.0:
+                    new_limit_setpoint = powermeter_watts + 2100
+                elif battery_state.temperature > 20.0 and battery_state.temperature <= 25.0:
+                    new_limit_setpoint = powermeter_watts + 3200
+                else:
+                    temperature_degradation = False
 
             # check for upper and lower limits
             new_limit_setpoint = check_and_apply_upper_and_lower_limits(new_limit_setpoint)
 
             # set new limit to inverter
-            set_limit(new_limit_setpoint)
+            SPANS.call('set_limit', set_limit, new_limit_setpoint)
 
             # Log to console and publish to MQTT
-            logger.info(f'Power Consumption  : {powermeter_watts}W')
-            logger.info(f'PV Production      : {hoymiles_actual_power}W')
-            logger.info(f'Battery Temperature: {bat_temperature}ºC')
-            logger.info(f'Battery SoC        : {soc}%')
-            logger.info(f'Total Rated Power  : {total_rated_power}W')
-            logger.info(f'Inverter Limit     : {new_limit_setpoint}W')
-            logger.info(f'Temp. Degradation? : {temperature_degradation}')
-            logger.info(f'Limit Active?      : {limit_active}')
-            if discharge_watts > 0:
-                logger.info(f'Discharge Rate     : {discharge_watts}W')
-            elif chargePower > 0:
-                logger.info(f'Charge Rate        : {chargePower}W')
-
-            publish_global_state('total_limit_w', new_limit_setpoint)
-            publish_global_state('total_rated_power_w', total_rated_power)
-            publish_global_state('battery_soc_percent', soc)
-            publish_global_state('battery_cell_temperature_c', bat_temperature)
+            if LOG_MODE == 'summary':
+                CYCLE_SUMMARY.add('consumption_w', powermeter_watts)
+                CYCLE_SUMMARY.add('production_w', hoymiles_actual_power)
+                CYCLE_SUMMARY.add('rated_power_w', total_rated_power)
+                CYCLE_SUMMARY.add('limit_w', new_limit_setpoint)
+                CYCLE_SUMMARY.add('temperature_degradation', temperature_degradation)
+                CYCLE_SUMMARY.add('limit_active', limit_active)
+                if battery_state is not None:
+                    CYCLE_SUMMARY.add('battery_soc', battery_state.soc)
+                    CYCLE_SUMMARY.add('battery_temperature', battery_state.temperature)
+                    CYCLE_SUMMARY.add('battery_discharge_w', battery_state.discharge_watts)
+                    CYCLE_SUMMARY.add('battery_charge_w', battery_state.charge_watts)
+                CYCLE_SUMMARY.log(logger)
+            else:
+                logger.info('Power Consumption  : %sW', powermeter_watts)
+                logger.info('PV Production      : %sW', hoymiles_actual_power)
+                if battery_state is not None:
+                    logger.info('Battery Temperature: %sºC', battery_state.temperature)
+                    logger.info('Battery SoC        : %s%%', battery_state.soc)
+                logger.info('Total Rated Power  : %sW', total_rated_power)
+                logger.info('Inverter Limit     : %sW', new_limit_setpoint)
+                logger.info('Temp. Degradation? : %s', temperature_degradation)
+                logger.info('Limit Active?      : %s', limit_active)
+                if battery_state is not None:
+                    if battery_state.discharge_watts > 0:
+                        logger.info('Discharge Rate     : %sW', battery_state.discharge_watts)
+                    elif battery_state.charge_watts > 0:
+                        logger.info('Charge Rate        : %sW', battery_state.charge_watts)
+
+            with SPANS.span('publish'):
+                publish_global_state('total_limit_w', new_limit_setpoint)
+                publish_global_state('total_rated_power_w', total_rated_power)
+                if battery_state is not None:
+                    publish_global_state('battery_soc_percent', battery_state.soc)
+                    publish_global_state('battery_cell_temperature_c', battery_state.temperature)
+                publish_cycle_state()
         else:
             if hasattr(set_limit, "LastLimit"):
                 set_limit.LastLimit = -1
-            time.sleep(LOOP_INTERVAL_IN_SECONDS)
+            publish_cycle_state()
+            loop_sleep(get_idle_interval(inverters_available))
 
     except Exception as e:
         if hasattr(e, 'message'):
             logger.error(e.message)
         else:
             logger.error(e)
-        time.sleep(LOOP_INTERVAL_IN_SECONDS)
+        publish_cycle_state()
+        loop_sleep(LOOP_INTERVAL_IN_SECONDS)
 
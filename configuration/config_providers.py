@@ -1,10 +1,79 @@
 import json
 import logging
+import threading
+import time
 from configparser import ConfigParser
+from typing import NamedTuple
 
 logger = logging.getLogger()
 
+# the getters of ConfigProvider which are combined by ConfigProviderChain
+CONFIG_GETTERS = (
+    'get_powermeter_target_point',
+    'get_powermeter_max_point',
+    'get_powermeter_min_point',
+    'on_grid_usage_jump_to_limit_percent',
+    'on_grid_feed_fast_limit_decrease',
+    'get_powermeter_tolerance',
+    'get_min_wattage_in_percent',
+    'get_normal_wattage',
+    'get_reduce_wattage',
+    'get_battery_priority',
+)
+
+
+class ConfigSnapshot(NamedTuple):
+    """
+    Immutable view of the configuration, created by ConfigProvider.get_snapshot().
+    The per inverter values are tuples indexed by the inverter index.
+    """
+    version: int
+    powermeter_target_point: int
+    powermeter_max_point: int
+    powermeter_min_point: int
+    powermeter_tolerance: int
+    on_grid_usage_jump_to_limit_percent: int
+    on_grid_feed_fast_limit_decrease: bool
+    min_wattage_in_percent: tuple
+    normal_wattage: tuple
+    reduce_wattage: tuple
+    battery_priority: tuple
+
+
 class ConfigProvider:
+    # increased on every change of the configuration, so get_snapshot() knows when to rebuild the snapshot
+    version = 0
+    snapshot = None
+
+    def get_version(self):
+        return self.version
+
+    def get_snapshot(self, inverter_count: int) -> ConfigSnapshot:
+        """
+        Returns the configuration as an immutable snapshot. The snapshot is only rebuilt when the configuration
+        changed, otherwise the same snapshot is returned. Read it once per loop cycle to get a consistent view of
+        the configuration for the whole cycle.
+        """
+        version = self.get_version()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.version != version or len(snapshot.battery_priority) != inverter_count:
+            inverters = range(inverter_count)
+            snapshot = ConfigSnapshot(
+                version,
+                self.get_powermeter_target_point(),
+                self.get_powermeter_max_point(),
+                self.get_powermeter_min_point(),
+                self.get_powermeter_tolerance(),
+                self.on_grid_usage_jump_to_limit_percent(),
+                self.on_grid_feed_fast_limit_decrease(),
+                tuple(self.get_min_wattage_in_percent(i) for i in inverters),
+                tuple(self.get_normal_wattage(i) for i in inverters),
+                tuple(self.get_reduce_wattage(i) for i in inverters),
+                tuple(self.get_battery_priority(i) for i in inverters)
+            )
+            # swapped in with a single assignment, readers see either the old or the new snapshot
+            self.snapshot = snapshot
+        return snapshot
 
     def update(self):
         """
@@ -94,6 +163,12 @@ class ConfigFileConfigProvider(ConfigProvider):
     def __init__(self, config: ConfigParser):
         self.config = config
 
+    def reload(self):
+        """
+        Call after the content of the config was replaced, so the next snapshot is read from the new content.
+        """
+        self.version += 1
+
     def get_powermeter_target_point(self):
         return self.config.getint('CONTROL', 'POWERMETER_TARGET_POINT')
 
@@ -134,25 +209,37 @@ class ConfigProviderChain(ConfigProvider):
     """
     def __init__(self, providers):
         self.providers = providers
+        # instance attributes take precedence over the (empty) getters inherited from ConfigProvider
+        for name in CONFIG_GETTERS:
+            setattr(self, name, self.create_chained_method(name))
 
     def update(self):
         for provider in self.providers:
             provider.update()
 
-    def __getattribute__(self, name):
-        if name in ['update', 'providers']:
-            return object.__getattribute__(self, name)
+    def get_version(self):
+        # the versions of the providers only increase, so their sum changes whenever one of them changes
+        return sum(provider.get_version() for provider in self.providers)
+
+    def create_chained_method(self, name):
+        functions = [getattr(provider, name) for provider in self.providers if callable(getattr(provider, name, None))]
 
         def method(*args, **kwargs):
-            for provider in self.providers:
-                f = getattr(provider, name)
-                if callable(f):
-                    value = f(*args, **kwargs)
-                    if value is not None:
-                        return value
+            for f in functions:
+                value = f(*args, **kwargs)
+                if value is not None:
+                    return value
             return None
         return method
 
+    def __getattr__(self, name):
+        # only called for attributes which are not found otherwise, the chained method is cached on the instance
+        if name.startswith('__') or name == 'providers':
+            raise AttributeError(name)
+        method = self.create_chained_method(name)
+        setattr(self, name, method)
+        return method
+
 class OverridingConfigProvider(ConfigProvider):
     """
     This class is a config provider that allows to override the config values from code.
@@ -163,6 +250,9 @@ class OverridingConfigProvider(ConfigProvider):
     def __init__(self):
         self.common_config = {}
         self.inverter_config = []
+        self.version = 0
+        # the values are set from other threads (e.g. the MQTT client) while the main loop reads them
+        self.lock = threading.Lock()
 
     @staticmethod
     def cast_value(is_inverter_value, key, value):
@@ -181,26 +271,47 @@ class OverridingConfigProvider(ConfigProvider):
 
     def set_common_value(self, name, value):
         if value is None:
-            if name in self.common_config:
+            with self.lock:
+                if name not in self.common_config:
+                    return
                 del self.common_config[name]
-                logger.info(f"Unset common config value {name}")
+                self.version += 1
+            logger.info(f"Unset common config value {name}")
         else:
             cast_value = self.cast_value(False, name, value)
-            self.common_config[name] = cast_value
+            with self.lock:
+                if name in self.common_config and self.common_config[name] == cast_value:
+                    return
+                self.common_config[name] = cast_value
+                self.version += 1
             logger.info(f"Set common config value {name} to {cast_value}")
 
     def set_inverter_value(self, inverter_idx: int, name: str, value):
         if value is None:
-            if inverter_idx < len(self.inverter_config) and name in self.inverter_config[inverter_idx]:
+            with self.lock:
+                if inverter_idx >= len(self.inverter_config) or name not in self.inverter_config[inverter_idx]:
+                    return
                 del self.inverter_config[inverter_idx][name]
-                logger.info(f"Unset inverter {inverter_idx} config value {name}")
+                self.version += 1
+            logger.info(f"Unset inverter {inverter_idx} config value {name}")
         else:
-            while len(self.inverter_config) <= inverter_idx:
-                self.inverter_config.append({})
             cast_value = self.cast_value(True, name, value)
-            self.inverter_config[inverter_idx][name] = cast_value
+            with self.lock:
+                while len(self.inverter_config) <= inverter_idx:
+                    self.inverter_config.append({})
+                if name in self.inverter_config[inverter_idx] and self.inverter_config[inverter_idx][name] == cast_value:
+                    return
+                self.inverter_config[inverter_idx][name] = cast_value
+                self.version += 1
             logger.info(f"Set inverter {inverter_idx} config value {name} to {cast_value}")
 
+    def get_items(self):
+        """
+        Returns copies of the common and the inverter config values, safe to iterate while other threads change them.
+        """
+        with self.lock:
+            return dict(self.common_config), [dict(inverter_config) for inverter_config in self.inverter_config]
+
     def get_powermeter_target_point(self):
         return self.common_config.get('powermeter_target_point')
 
@@ -244,7 +355,8 @@ class MqttHandler(OverridingConfigProvider):
     """
     Config provider that subscribes to a MQTT topic and updates the configuration from the messages.
     """
-    def __init__(self, mqtt_broker, mqtt_port, client_id, mqtt_username, mqtt_password, topic_prefix, log_level):
+    def __init__(self, mqtt_broker, mqtt_port, client_id, mqtt_username, mqtt_password, topic_prefix, log_level,
+                 state_refresh_interval=300, state_as_json=False):
         super().__init__()
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
@@ -254,6 +366,15 @@ class MqttHandler(OverridingConfigProvider):
         self.set_topic = f"{self.topic_prefix}/set"
         self.reset_topic = f"{self.topic_prefix}/reset"
         self.log_level = log_level
+        # state topics are only published when their payload changed, and all of them again every
+        # state_refresh_interval seconds (0 = never)
+        self.state_refresh_interval = state_refresh_interval
+        self.last_state_refresh = time.time()
+        self.published_payloads = {}
+        # if enabled, the state is collected during a cycle and published as one JSON document by
+        # publish_state_document() at the end of the cycle
+        self.state_as_json = state_as_json
+        self.state_document = {}
 
         import paho.mqtt.client as mqtt
         self.mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
@@ -266,15 +387,36 @@ class MqttHandler(OverridingConfigProvider):
         self.mqtt_client.loop_start()
 
     def update(self):
-        # Publish all config values to MQTT
-        for key, value in self.common_config.items():
-            self.mqtt_client.publish(f"{self.topic_prefix}/state/{key}", payload=value, qos=1, retain=True)
-        for inverter_idx, inverter_config in enumerate(self.inverter_config):
+        if self.state_refresh_interval > 0 and time.time() - self.last_state_refresh >= self.state_refresh_interval:
+            # forget what was published, so everything is sent again for clients which missed a message
+            self.published_payloads.clear()
+            self.last_state_refresh = time.time()
+        # Publish the changed config values to MQTT
+        common_config, inverter_configs = self.get_items()
+        for key, value in common_config.items():
+            self.publish_if_changed(f"{self.topic_prefix}/state/{key}", value, qos=1, retain=True)
+        for inverter_idx, inverter_config in enumerate(inverter_configs):
             for key, value in inverter_config.items():
-                self.mqtt_client.publish(f"{self.topic_prefix}/state/inverter/{inverter_idx}/{key}", payload=value, qos=1, retain=True)
+                self.publish_if_changed(f"{self.topic_prefix}/state/inverter/{inverter_idx}/{key}", value, qos=1, retain=True)
+
+    def publish_if_changed(self, topic, payload, qos=0, retain=False):
+        from paho.mqtt.client import MQTT_ERR_SUCCESS
+        if self.published_payloads.get(topic) == payload:
+            return
+        # only remember what was handed over to the client, a failed publish is repeated with the next change check
+        if self.mqtt_client.publish(topic, payload=payload, qos=qos, retain=retain).rc == MQTT_ERR_SUCCESS:
+            self.published_payloads[topic] = payload
+
+    def publish_state_document(self):
+        if not self.state_document:
+            return
+        self.publish_if_changed(f"{self.topic_prefix}/state/json", json.dumps(self.state_document, sort_keys=True))
+        self.state_document = {}
 
     def on_connect(self, client, userdata, flags, reason_code, properties):
         print("Connected with result code " + str(reason_code))
+        # messages may have been lost while disconnected, publish all state topics again
+        self.published_payloads.clear()
         client.subscribe(f"{self.set_topic}/#")
         client.subscribe(f"{self.reset_topic}/#")
         client.publish(f"{self.topic_prefix}/status", payload="online", qos=1, retain=True)
@@ -329,28 +471,19 @@ class MqttHandler(OverridingConfigProvider):
         return value
 
     def publish_state(self, key, value):
-        self.mqtt_client.publish(f"{self.topic_prefix}/state/{key}", payload=self.cast_value_for_publish(value))
+        if self.state_as_json:
+            self.state_document[key] = value
+            return
+        self.publish_if_changed(f"{self.topic_prefix}/state/{key}", self.cast_value_for_publish(value))
 
     def publish_inverter_state(self, inverter_idx, key, value):
-        self.mqtt_client.publish(f"{self.topic_prefix}/state/inverter/{inverter_idx}/{key}", payload=self.cast_value_for_publish(value))
-
-    def publish_log_record(self, record: logging.LogRecord):
-        if self.log_level is None or record.levelno < self.log_level:
+        if self.state_as_json:
+            self.state_document.setdefault('inverter', {}).setdefault(str(inverter_idx), {})[key] = value
             return
+        self.publish_if_changed(f"{self.topic_prefix}/state/inverter/{inverter_idx}/{key}", self.cast_value_for_publish(value))
 
-        # Create a dictionary with the log record details
-        log_message = {
-            'name': record.name,
-            'level': record.levelname,
-            'msg': record.getMessage(),
-            'exc_info': record.exc_info
-        }
-
-        # Convert the dictionary to a JSON-formatted string
-        json_payload = json.dumps(log_message)
-
-        # Publish the JSON-formatted log message to the MQTT topic
-        self.mqtt_client.publish(f"{self.topic_prefix}/log", payload=json_payload)
+    def publish_log(self, payload):
+        self.mqtt_client.publish(f"{self.topic_prefix}/log", payload=payload)
 
     def __del__(self):
         logger.info("Disconnecting MQTT client")
@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+import time
+from configparser import ConfigParser
+
+logger = logging.getLogger()
+
+
+def read_sections(paths) -> dict:
+    """
+    Reads the config files like at the start (later files override earlier ones) and returns the raw values as
+    {section: {key: value}}.
+    """
+    parser = ConfigParser()
+    parser.read(paths)
+    return {section: dict(parser.items(section, raw=True)) for section in parser.sections()}
+
+
+def diff_sections(old: dict, new: dict) -> dict:
+    """
+    Returns {section: set of changed keys} for all sections whose keys were added, removed or changed.
+    """
+    changes = {}
+    for section in old.keys() | new.keys():
+        old_values = old.get(section, {})
+        new_values = new.get(section, {})
+        keys = {key for key in old_values.keys() | new_values.keys() if old_values.get(key) != new_values.get(key)}
+        if keys:
+            changes[section] = keys
+    return changes
+
+
+class ConfigFileWatcher:
+    """
+    Watches the config files by their modification time. A changed file is parsed and compared with the applied
+    configuration by a background thread, the main loop picks up the result between two cycles with get_change().
+    A file is only read after its modification time was unchanged for one interval, so a file which is just being
+    written is not read half-way.
+    """
+
+    def __init__(self, paths, interval: float = 5):
+        self.paths = [path for path in paths if path]
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.mtimes = self.get_mtimes()
+        self.seen_mtimes = self.mtimes
+        self.applied = read_sections(self.paths)
+        self.change = None
+        self.thread = threading.Thread(target=self.run, name='ConfigFileWatcher', daemon=True)
+        self.thread.start()
+
+    def get_mtimes(self):
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error('Config: unable to read the changed config file: %s', e)
+
+    def check(self):
+        mtimes = self.get_mtimes()
+        if mtimes == self.mtimes:
+            return
+        if mtimes != self.seen_mtimes:
+            # still being written, wait for the next interval
+            self.seen_mtimes = mtimes
+            return
+        self.mtimes = mtimes
+        sections = read_sections(self.paths)
+        with self.lock:
+            changes = diff_sections(self.applied, sections)
+            self.change = (sections, changes) if changes else None
+
+    def get_change(self):
+        """
+        Returns (sections, changes) of a changed config file that was not applied yet, or None. The returned
+        sections count as applied from now on.
+        """
+        with self.lock:
+            change, self.change = self.change, None
+            if change is not None:
+                self.applied = change[0]
+        return change
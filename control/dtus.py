@@ -6,15 +6,18 @@ metering and not a control device. Subclasses that control things reside in the
 """
 import time
 
-from packaging import version
 from requests.auth import HTTPBasicAuth
 
 from GLOBALS import *
-from metering.powermeters import Powermeter
+from metering.base import Powermeter
+from utils.cycle_summary import CHANGE
 from utils.helper_functions import cast_to_int, get_number_array
 
 
 class DTU(Powermeter):
+    # read by check_min_version()
+    firmware_version = None
+
     def __init__(self, inverter_count: int):
         self.inverter_count = inverter_count
 
@@ -59,6 +62,7 @@ class AhoyDTU(DTU):
         self.ip = ip
         self.password = password
         self.token = ''
+        self.live_fields = None
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
@@ -66,21 +70,27 @@ class AhoyDTU(DTU):
         data = None
         retry_count = 3
         while retry_count > 0 and data is None:
-            data = session.get(url, timeout=10).json()
+            data = self.session.get(url).json()
             retry_count -= 1
         return data
 
     def get_response_json(self, path, obj):
         url = f'http://{self.ip}{path}'
-        return session.post(url, json=obj, timeout=10).json()
+        return self.session.post(url, json=obj).json()
+
+    def get_live_field_index(self, p_field_list: str, p_field_name: str):
+        # the field names of /api/live only change with the firmware, so they are read once
+        if self.live_fields is None:
+            self.live_fields = self.get_json('/api/live')
+        return self.live_fields[p_field_list].index(p_field_name)
 
     def get_ac_power(self, p_inverter_id):
-        parsed_data = self.get_json('/api/live')
-        actual_power_index = parsed_data["ch0_fld_names"].index("P_AC")
+        actual_power_index = self.get_live_field_index("ch0_fld_names", "P_AC")
         parsed_data = self.get_json(f'/api/inverter/id/{p_inverter_id}')
         return cast_to_int(parsed_data["ch"][0][actual_power_index])
 
     def check_min_version(self):
+        from packaging import version
         min_version = '0.8.80'
         parsed_data = self.get_json('/api/system')
         try:
@@ -89,6 +99,7 @@ class AhoyDTU(DTU):
             ahoy_version = str((parsed_data["generic"]["version"]))
 
         logger.info('Ahoy: Current Version: %s', ahoy_version)
+        self.firmware_version = ahoy_version
         if version.parse(ahoy_version) < version.parse(min_version):
             logger.error(
                 'Error: Your AHOY Version is too old! Please update at least to Version %s - you can find the newest dev-releases here: https://github.com/lumapu/ahoy/actions',
@@ -108,8 +119,7 @@ class AhoyDTU(DTU):
         return limit_in_w
 
     def get_info(self, p_inverter_id: int):
-        parsed_data = self.get_json('/api/live')
-        temp_index = parsed_data["ch0_fld_names"].index("Temp")
+        temp_index = self.get_live_field_index("ch0_fld_names", "Temp")
 
         parsed_data = self.get_json(f'/api/inverter/id/{p_inverter_id}')
         SERIAL_NUMBER[p_inverter_id] = str(parsed_data['serial'])
@@ -119,16 +129,14 @@ class AhoyDTU(DTU):
                     SERIAL_NUMBER[p_inverter_id], TEMPERATURE[p_inverter_id])
 
     def get_temperature(self, p_inverter_id: int):
-        parsed_data = self.get_json('/api/live')
-        temp_index = parsed_data["ch0_fld_names"].index("Temp")
+        temp_index = self.get_live_field_index("ch0_fld_names", "Temp")
 
         parsed_data = self.get_json(f'/api/inverter/id/{p_inverter_id}')
         TEMPERATURE[p_inverter_id] = str(parsed_data["ch"][0][temp_index]) + ' degC'
         logger.info('Ahoy: Inverter "%s" temperature: %s', NAME[p_inverter_id], TEMPERATURE[p_inverter_id])
 
     def get_panel_min_voltage(self, p_inverter_id: int):
-        parsed_data = self.get_json('/api/live')
-        panel_vdc_index = parsed_data["fld_names"].index("U_DC")
+        panel_vdc_index = self.get_live_field_index("fld_names", "U_DC")
 
         parsed_data = self.get_json(f'/api/inverter/id/{p_inverter_id}')
         panel_vdc = []
@@ -169,7 +177,7 @@ class AhoyDTU(DTU):
             if ack:
                 logger.info('Ahoy: Inverter "%s": Limit acknowledged', NAME[p_inverter_id])
             else:
-                logger.info('Ahoy: Inverter "%s": Limit timeout!', NAME[p_inverter_id])
+                logger.info('Ahoy: Inverter "%s": Limit timeout!', NAME[p_inverter_id], extra=CHANGE)
             return ack
         except Exception as e:
             if hasattr(e, 'message'):
@@ -180,7 +188,7 @@ class AhoyDTU(DTU):
 
     def set_limit(self, p_inverter_id: int, p_limit: int):
         logger.info('Ahoy: Inverter "%s": setting new limit from %s Watt to %s Watt', NAME[p_inverter_id],
-                    cast_to_int(CURRENT_LIMIT[p_inverter_id]), cast_to_int(p_limit))
+                    cast_to_int(CURRENT_LIMIT[p_inverter_id]), cast_to_int(p_limit), extra=CHANGE)
         myobj = {'cmd': 'limit_nonpersistent_absolute', 'val': p_limit, "id": p_inverter_id, "token": self.token}
         response = self.get_response_json('/api/ctrl', myobj)
         if response["success"] == False and response["error"] == "ERR_PROTECTED":
@@ -221,28 +229,38 @@ class OpenDTU(DTU):
         self.ip = ip
         self.user = user
         self.password = password
+        self.serial_numbers = None
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
-        return session.get(url, auth=HTTPBasicAuth(self.user, self.password), timeout=10).json()
+        return self.session.get(url, auth=HTTPBasicAuth(self.user, self.password)).json()
 
     def get_response_json(self, path, send_str):
         url = f'http://{self.ip}{path}'
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        return session.post(url=url, headers=headers, data=send_str, auth=HTTPBasicAuth(self.user, self.password),
-                            timeout=10).json()
+        return self.session.post(url=url, headers=headers, data=send_str,
+                                 auth=HTTPBasicAuth(self.user, self.password)).json()
+
+    def get_serial_number(self, p_inverter_id: int):
+        # one /api/livedata/status request lists the serial numbers of all inverters, keep them for the others
+        if self.serial_numbers is None or p_inverter_id >= len(self.serial_numbers):
+            parsed_data = self.get_json('/api/livedata/status')
+            self.serial_numbers = [str(inverter['serial']) for inverter in parsed_data['inverters']]
+        return self.serial_numbers[p_inverter_id]
 
     def get_ac_power(self, p_inverter_id):
         parsed_data = self.get_json(f'/api/livedata/status?inv={SERIAL_NUMBER[p_inverter_id]}')
         return cast_to_int(parsed_data['inverters'][0]['AC']['0']['Power']['v'])
 
     def check_min_version(self):
+        from packaging import version
         min_version = 'v24.2.12'
         parsed_data = self.get_json('/api/system/status')
         open_dtu_version = str((parsed_data["git_hash"]))
         if "-Database" in open_dtu_version:  # trim string "v24.5.27-Database"
             open_dtu_version = open_dtu_version.replace("-Database", "")
         logger.info('OpenDTU: Current Version: %s', open_dtu_version)
+        self.firmware_version = open_dtu_version
         if version.parse(open_dtu_version) < version.parse(min_version):
             logger.error(
                 'Error: Your OpenDTU Version is too old! Please update at least to Version %s - you can find the newest dev-releases here: https://github.com/tbnobody/OpenDTU/actions',
@@ -265,8 +283,7 @@ class OpenDTU(DTU):
 
     def get_info(self, p_inverter_id: int):
         if SERIAL_NUMBER[p_inverter_id] == '':
-            parsed_data = self.get_json('/api/livedata/status')
-            SERIAL_NUMBER[p_inverter_id] = str(parsed_data['inverters'][p_inverter_id]['serial'])
+            SERIAL_NUMBER[p_inverter_id] = self.get_serial_number(p_inverter_id)
 
         parsed_data = self.get_json(f'/api/livedata/status?inv={SERIAL_NUMBER[p_inverter_id]}')
         TEMPERATURE[p_inverter_id] = str(
@@ -322,7 +339,7 @@ class OpenDTU(DTU):
             if ack:
                 logger.info('OpenDTU: Inverter "%s": Limit acknowledged', NAME[p_inverter_id])
             else:
-                logger.info('OpenDTU: Inverter "%s": Limit timeout!', NAME[p_inverter_id])
+                logger.info('OpenDTU: Inverter "%s": Limit timeout!', NAME[p_inverter_id], extra=CHANGE)
             return ack
         except Exception as e:
             if hasattr(e, 'message'):
@@ -333,7 +350,7 @@ class OpenDTU(DTU):
 
     def set_limit(self, p_inverter_id: int, p_limit: int):
         logger.info('OpenDTU: Inverter "%s": setting new limit from %s Watt to %s Watt', NAME[p_inverter_id],
-                    cast_to_int(CURRENT_LIMIT[p_inverter_id]), cast_to_int(p_limit))
+                    cast_to_int(CURRENT_LIMIT[p_inverter_id]), cast_to_int(p_limit), extra=CHANGE)
         rel_limit = cast_to_int(p_limit / HOY_INVERTER_WATT[p_inverter_id] * 100)
         my_send_str = f'''data={{"serial":"{SERIAL_NUMBER[p_inverter_id]}", "limit_type":1, "limit_value":{rel_limit}}}'''
         response = self.get_response_json('/api/limit/config', my_send_str)
@@ -393,7 +410,7 @@ class DebugDTU(DTU):
 
     def set_limit(self, p_inverter_id: int, p_limit: int):
         logger.info('Debug: Inverter "%s": setting new limit from %s Watt to %s Watt', NAME[p_inverter_id],
-                    cast_to_int(CURRENT_LIMIT[p_inverter_id]), cast_to_int(p_limit))
+                    cast_to_int(CURRENT_LIMIT[p_inverter_id]), cast_to_int(p_limit), extra=CHANGE)
         CURRENT_LIMIT[p_inverter_id] = p_limit
 
     def set_power_status(self, p_inverter_id: int, p_active: bool):
@@ -0,0 +1,50 @@
+# metering/base.py
+
+"""
+This module contains the base class of all meters. It does not import any driver, so the DTUs and the controller
+can use it without loading the powermeter classes.
+"""
+
+import time
+
+from GLOBALS import session
+from metering.samples import PowermeterReading
+from utils.http_clients import HttpClient
+
+# used by all devices which did not get their own client from the Factory
+DEFAULT_HTTP_CLIENT = HttpClient('default', session, timeout=(10, 10))
+
+
+class Powermeter:
+    # HttpClient for the requests to the device, the Factory assigns one per device
+    session = DEFAULT_HTTP_CLIENT
+    # set by get_powermeter_watts() of meters whose device reports when the value was measured
+    source_timestamp = None
+    # minimum of (receive time - source timestamp): clock offset of the device plus the minimal transfer delay
+    clock_offset = None
+    last_source_timestamp = None
+
+    def get_powermeter_watts(self) -> int:
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Stops the background activity of the meter, called when it is replaced after a change of the config file.
+        """
+        pass
+
+    def get_powermeter_reading(self) -> PowermeterReading:
+        self.source_timestamp = None
+        watts = self.get_powermeter_watts()
+        receive_time = time.time()
+        if self.source_timestamp is None:
+            return PowermeterReading(watts, None, receive_time)
+        offset = receive_time - self.source_timestamp
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        elif self.source_timestamp != self.last_source_timestamp:
+            # slowly let the offset rise again, so a drifting device clock is followed. Only on new values, a value
+            # read again is just older and says nothing about the clock
+            self.clock_offset = min(offset, self.clock_offset + 0.01)
+        self.last_source_timestamp = self.source_timestamp
+        return PowermeterReading(watts, self.source_timestamp, self.source_timestamp + self.clock_offset)
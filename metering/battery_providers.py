@@ -0,0 +1,164 @@
+# metering/battery_providers.py
+
+"""
+This module contains the providers for the state of a home battery (state of charge, cell temperature and
+charge / discharge power). The values are cached and only refreshed after the configured refresh interval,
+because they change slowly compared to the grid power.
+"""
+
+
+import json
+import time
+from typing import NamedTuple
+
+from GLOBALS import *
+
+from metering.powermeters import IoBrokerClient
+from utils.helper_functions import *
+
+
+class BatteryState(NamedTuple):
+    soc: float
+    temperature: float
+    discharge_watts: float
+    charge_watts: float
+    timestamp: float
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+
+class BatteryStateProvider:
+    def __init__(self, refresh_interval: int = 30, max_age: int = 300):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.state = None
+
+    def read_battery_state(self) -> BatteryState:
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Stops the background activity of the provider, called when it is replaced after a change of the config file.
+        """
+        pass
+
+    def get_battery_state(self) -> BatteryState:
+        if self.state is not None and self.state.age < self.refresh_interval:
+            return self.state
+        try:
+            self.state = self.read_battery_state()
+        except Exception as e:
+            # keep regulating with the last known state for a while, the battery state changes slowly
+            if self.state is None or self.state.age > self.max_age:
+                raise
+            logger.warning('%s: unable to refresh battery state (%s), using values from %.0f s ago',
+                           self.__class__.__name__, e, self.state.age)
+        return self.state
+
+
+class IoBrokerBatteryState(BatteryStateProvider):
+    def __init__(self, ip: str, port: str, soc_alias: str, temperature_alias: str, discharge_power_alias: str,
+                 charge_power_alias: str, power_factor: float = 1.0, refresh_interval: int = 30, max_age: int = 300):
+        super().__init__(refresh_interval, max_age)
+        self.ip = ip
+        self.port = port
+        self.soc_alias = soc_alias
+        self.temperature_alias = temperature_alias
+        self.discharge_power_alias = discharge_power_alias
+        self.charge_power_alias = charge_power_alias
+        self.power_factor = power_factor
+        self.client = IoBrokerClient.get_instance(ip, port)
+        self.client.register(soc_alias, temperature_alias, discharge_power_alias, charge_power_alias)
+
+    @property
+    def session(self):
+        return self.client.session
+
+    @session.setter
+    def session(self, value):
+        self.client.session = value
+
+    def read_battery_state(self):
+        aliases = [self.soc_alias, self.temperature_alias, self.discharge_power_alias, self.charge_power_alias]
+        items = self.client.get_items(aliases)
+        values = {alias: item['val'] for alias, item in items.items() if item is not None}
+        missing = [alias for alias in aliases if values.get(alias) is None]
+        if missing:
+            raise Exception(f'ioBroker: no value for {", ".join(missing)}')
+        return BatteryState(
+            float(values[self.soc_alias]),
+            float(values[self.temperature_alias]),
+            float(values[self.discharge_power_alias]) * self.power_factor,
+            float(values[self.charge_power_alias]) * self.power_factor,
+            time.time()
+        )
+
+
+class MqttBatteryState(BatteryStateProvider):
+    def __init__(
+        self,
+        broker: str,
+        port: int,
+        topics: dict,
+        json_paths: dict,
+        username: str = None,
+        password: str = None,
+        power_factor: float = 1.0,
+        max_age: int = 300,
+    ):
+        # values are pushed by the broker, so there is nothing to refresh
+        super().__init__(0, max_age)
+        self.topics = topics
+        self.json_paths = json_paths
+        self.power_factor = power_factor
+        self.values = {}
+        self.value_timestamp = None
+
+        import paho.mqtt.client as mqtt
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        if username and password:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(broker, port)
+        self.client.loop_start()
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        logger.info(f"Battery state: connected with result code {reason_code}")
+        for topic in set(self.topics.values()):
+            client.subscribe(topic)
+            logger.info(f"Battery state: subscribed to topic {topic}")
+
+    def on_message(self, client, userdata, msg):
+        payload = msg.payload.decode()
+        for key, topic in self.topics.items():
+            if msg.topic != topic:
+                continue
+            try:
+                if self.json_paths.get(key):
+                    self.values[key] = extract_json_value(json.loads(payload), self.json_paths[key])
+                else:
+                    self.values[key] = float(payload)
+                self.value_timestamp = time.time()
+            except (ValueError, json.JSONDecodeError):
+                logger.warning('Battery state: unable to parse %s from topic %s: %s', key, topic, payload)
+
+    def read_battery_state(self):
+        missing = [key for key in self.topics if key not in self.values]
+        if missing:
+            raise Exception(f'MQTT: no battery {", ".join(missing)} received yet')
+        if time.time() - self.value_timestamp > self.max_age:
+            raise Exception(f'MQTT: no battery state received for {time.time() - self.value_timestamp:.0f} s')
+        return BatteryState(
+            self.values['soc'],
+            self.values['temperature'],
+            self.values['discharge_power'] * self.power_factor,
+            self.values['charge_power'] * self.power_factor,
+            self.value_timestamp
+        )
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
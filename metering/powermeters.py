@@ -8,19 +8,99 @@ metering and not a control device. Subclasses that control things reside in the
 
 import json
 import subprocess
+import threading
 import time
-import paho.mqtt.client as mqtt
+from datetime import datetime
+
 
 from GLOBALS import *
 from requests.auth import HTTPDigestAuth
 
+from metering.base import DEFAULT_HTTP_CLIENT, Powermeter
 from utils.helper_functions import *
 
 
-class Powermeter:
-    def get_powermeter_watts(self) -> int:
+class PushPowermeter(Powermeter):
+    """
+    Base class for meters that get their values pushed (WebSocket, UDP, ...) instead of being polled.
+    A background thread keeps the connection open and stores the latest value of every key together with
+    its timestamp, so reading the meter only costs a dictionary lookup.
+    """
+    def __init__(self):
+        self.values = {}
+        # keys the device reported as unavailable, reading them fails right away instead of waiting
+        self.cleared_keys = set()
+        self.values_lock = threading.Lock()
+        self.connected = False
+        self.last_message_time = 0.0
+        self.receiver_thread = None
+        self.closed = False
+
+    def start_receiver(self):
+        self.receiver_thread = threading.Thread(target=self.receive_forever, name=self.__class__.__name__, daemon=True)
+        self.receiver_thread.start()
+
+    def receive_forever(self):
+        reconnect_delay = 1
+        while not self.closed:
+            try:
+                self.receive()
+                reconnect_delay = 1
+            except Exception as e:
+                if self.closed:
+                    break
+                logger.error('%s: connection lost: %s', self.__class__.__name__, e)
+                reconnect_delay = min(reconnect_delay * 2, 60)
+            self.connected = False
+            time.sleep(reconnect_delay)
+
+    def receive(self):
+        """
+        Connects to the device and processes pushed messages until the connection is closed or close() is called.
+        """
         raise NotImplementedError()
 
+    def close(self):
+        # the receiver thread ends with its next message or receive timeout
+        self.closed = True
+
+    def set_value(self, key, value, timestamp: float = None):
+        now = time.time()
+        with self.values_lock:
+            self.values[key] = (value, timestamp if timestamp is not None else now)
+            self.cleared_keys.discard(key)
+            self.last_message_time = now
+
+    def clear_value(self, key):
+        with self.values_lock:
+            self.values.pop(key, None)
+            self.cleared_keys.add(key)
+
+    def is_fresh(self, max_age: float = None):
+        if not self.connected:
+            return False
+        return max_age is None or time.time() - self.last_message_time <= max_age
+
+    def get_values(self, keys, timeout: float = 5):
+        """
+        Returns [(value, timestamp), ...] for all keys, taken from the cache in one consistent snapshot.
+        Waits up to timeout seconds if not all keys have been received yet. Fails right away if a key was cleared,
+        it will not be received before the device reports a new value.
+        """
+        start_time = time.time()
+        while True:
+            with self.values_lock:
+                cleared_keys = [key for key in keys if key in self.cleared_keys]
+                if cleared_keys:
+                    raise Exception(f'{self.__class__.__name__}: no value for {cleared_keys}, reported as unavailable')
+                if all(key in self.values for key in keys):
+                    values = [self.values[key] for key in keys]
+                    self.source_timestamp = max(value[1] for value in values)
+                    return values
+            if time.time() - start_time > timeout:
+                raise TimeoutError(f'{self.__class__.__name__}: timeout waiting for values {keys}')
+            time.sleep(0.1)
+
 
 class Tasmota(Powermeter):
     def __init__(self, ip: str, user: str, password: str, json_status: str, json_payload_mqtt_prefix: str,
@@ -38,13 +118,15 @@ class Tasmota(Powermeter):
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
-        return session.get(url, timeout=10).json()
+        return self.session.get(url).json()
 
     def get_powermeter_watts(self):
         if not self.user:
             parsed_data = self.get_json('/cm?cmnd=status%2010')
         else:
             parsed_data = self.get_json(f'/cm?user={self.user}&password={self.password}&cmnd=status%2010')
+        # the Time in the status is the time of the response, not of the measurement, so it is not used as
+        # source timestamp
         if not self.json_power_calculate:
             return cast_to_int(parsed_data[self.json_status][self.json_payload_mqtt_prefix][self.json_power_mqtt_label])
         else:
@@ -59,16 +141,18 @@ class Shelly(Powermeter):
         self.user = user
         self.password = password
         self.emeterindex = emeterindex
+        # keep one digest auth object, so the nonce of the last challenge is reused and every poll is one round trip
+        self.digest_auth = HTTPDigestAuth(self.user, self.password)
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
         headers = {"content-type": "application/json"}
-        return session.get(url, headers=headers, auth=(self.user, self.password), timeout=10).json()
+        return self.session.get(url, headers=headers, auth=(self.user, self.password)).json()
 
     def get_rpc_json(self, path):
         url = f'http://{self.ip}/rpc{path}'
         headers = {"content-type": "application/json"}
-        return session.get(url, headers=headers, auth=HTTPDigestAuth(self.user, self.password), timeout=10).json()
+        return self.session.get(url, headers=headers, auth=self.digest_auth).json()
 
     def get_powermeter_watts(self) -> int:
         raise NotImplementedError()
@@ -79,9 +163,91 @@ class Shelly1PM(Shelly):
         return cast_to_int(self.get_json('/status')['meters'][0]['power'])
 
 
-class ShellyPlus1PM(Shelly):
+class ShellyGen2(Shelly, PushPowermeter):
+    """
+    Shelly "Generation 2" device (RPC API). With use_websocket the device pushes NotifyStatus frames over a
+    WebSocket connection and the power value is cached as it arrives; otherwise (or while disconnected)
+    the RPC status is polled via HTTP.
+    """
+    rpc_method = ''
+    rpc_component = ''
+    power_key = ''
+
+    def __init__(self, ip: str, user: str, password: str, emeterindex: str, use_websocket: bool = False):
+        Shelly.__init__(self, ip, user, password, emeterindex)
+        PushPowermeter.__init__(self)
+        self.use_websocket = use_websocket
+        self.message_id = 0
+        self.auth = None
+        if self.use_websocket:
+            self.start_receiver()
+
+    def send_request(self, ws, method: str, params: dict, auth: dict = None):
+        self.message_id += 1
+        request = {'id': self.message_id, 'src': 'HoymilesZeroExport', 'method': method, 'params': params}
+        if auth is not None:
+            request['auth'] = auth
+        ws.send(json.dumps(request))
+
+    def build_auth(self, challenge: dict):
+        import hashlib
+        import secrets
+
+        def sha256(text):
+            return hashlib.sha256(text.encode()).hexdigest()
+        cnonce = secrets.randbelow(2 ** 31)
+        ha1 = sha256(f"admin:{challenge['realm']}:{self.password}")
+        ha2 = sha256('dummy_method:dummy_uri')
+        response = sha256(f"{ha1}:{challenge['nonce']}:{challenge.get('nc', 1)}:{cnonce}:auth:{ha2}")
+        return {'realm': challenge['realm'], 'username': 'admin', 'nonce': challenge['nonce'], 'cnonce': cnonce,
+                'response': response, 'algorithm': 'SHA-256'}
+
+    def set_status(self, status: dict, timestamp: float = None):
+        if self.power_key in status:
+            self.set_value(self.power_key, float(status[self.power_key]), timestamp)
+
+    def receive(self):
+        import websocket
+        ws = websocket.create_connection(f'ws://{self.ip}/rpc', timeout=30)
+        auth_failures = 0
+        try:
+            # any request with a "src" registers this connection for NotifyStatus frames
+            self.send_request(ws, self.rpc_method, {'id': 0}, self.auth)
+            while not self.closed:
+                try:
+                    message = json.loads(ws.recv())
+                except websocket.WebSocketTimeoutException:
+                    self.send_request(ws, self.rpc_method, {'id': 0}, self.auth)
+                    continue
+                if message.get('method') == 'NotifyStatus':
+                    params = message['params']
+                    if self.rpc_component in params:
+                        self.set_status(params[self.rpc_component], params.get('ts'))
+                elif 'error' in message:
+                    auth_failures += 1
+                    if message['error']['code'] != 401 or auth_failures > 1:
+                        raise Exception(f"Shelly: RPC error {message['error']}")
+                    self.auth = self.build_auth(json.loads(message['error']['message']))
+                    self.send_request(ws, self.rpc_method, {'id': 0}, self.auth)
+                elif 'result' in message:
+                    if not self.connected:
+                        logger.info('Shelly: WebSocket connected to %s', self.ip)
+                    self.connected = True
+                    auth_failures = 0
+                    self.set_status(message['result'])
+        finally:
+            ws.close()
+
     def get_powermeter_watts(self):
-        return cast_to_int(self.get_rpc_json('/Switch.GetStatus?id=0')['apower'])
+        if self.use_websocket and self.is_fresh():
+            return cast_to_int(self.get_values([self.power_key])[0][0])
+        return cast_to_int(self.get_rpc_json(f'/{self.rpc_method}?id=0')[self.power_key])
+
+
+class ShellyPlus1PM(ShellyGen2):
+    rpc_method = 'Switch.GetStatus'
+    rpc_component = 'switch:0'
+    power_key = 'apower'
 
 
 class ShellyEM(Shelly):
@@ -97,9 +263,10 @@ class Shelly3EM(Shelly):
         return cast_to_int(self.get_json('/status')['total_power'])
 
 
-class Shelly3EMPro(Shelly):
-    def get_powermeter_watts(self):
-        return cast_to_int(self.get_rpc_json('/EM.GetStatus?id=0')['total_act_power'])
+class Shelly3EMPro(ShellyGen2):
+    rpc_method = 'EM.GetStatus'
+    rpc_component = 'em:0'
+    power_key = 'total_act_power'
 
 
 class ESPHome(Powermeter):
@@ -111,13 +278,78 @@ class ESPHome(Powermeter):
 
     def get_json(self, path):
         url = f'http://{self.ip}:{self.port}{path}'
-        return session.get(url, timeout=10).json()
+        return self.session.get(url).json()
 
     def get_powermeter_watts(self):
         parsed_data = self.get_json(f'/{self.domain}/{self.id}')
         return cast_to_int(parsed_data['value'])
 
 
+def iter_event_lines(chunks):
+    """
+    Splits an event stream into lines. The lines end with LF or CRLF; iter_lines() of requests would treat CR and LF
+    as two line ends and yield an empty line in between, which terminates the event before its data arrived.
+    """
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            yield line.decode('utf-8', errors='replace')
+
+
+class ESPHomeEvents(ESPHome, PushPowermeter):
+    """
+    Keeps one connection to the Server-Sent Events stream (/events) of the ESPHome web server open and
+    caches the state of the configured entity per event. ESPHome sends a ping event every few seconds, so a
+    stream that stayed silent for max_age seconds is considered stale and the REST API is polled instead.
+    """
+    def __init__(self, ip: str, port: str, domain: str, id: str, max_age: float = 30):
+        ESPHome.__init__(self, ip, port, domain, id)
+        PushPowermeter.__init__(self)
+        self.max_age = max_age
+        self.event_id = f'{self.domain}-{self.id}'
+        self.start_receiver()
+
+    def handle_event(self, event: str, data: str):
+        self.last_message_time = time.time()
+        if event != 'state':
+            return
+        parsed_data = json.loads(data)
+        if parsed_data.get('id') == self.event_id and parsed_data.get('value') is not None:
+            self.set_value('value', parsed_data['value'])
+
+    def receive(self):
+        url = f'http://{self.ip}:{self.port}/events'
+        with self.session.get(url, stream=True, timeout=(self.session.timeout[0], self.max_age)) as response:
+            response.raise_for_status()
+            self.connected = True
+            logger.info('ESPHome: connected to event stream of %s', self.ip)
+            event = 'message'
+            data = []
+            # the stream is neither chunked nor has a content length, so read byte-wise to not wait for a full buffer
+            for line in iter_event_lines(response.iter_content(chunk_size=1)):
+                if self.closed:
+                    break
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data.append(line[len('data:'):].strip())
+                elif not line:
+                    # an empty line terminates the event
+                    if data:
+                        self.handle_event(event, '\n'.join(data))
+                    event = 'message'
+                    data = []
+
+    def get_powermeter_watts(self):
+        if not self.is_fresh(self.max_age):
+            return super().get_powermeter_watts()
+        return cast_to_int(self.get_values(['value'])[0][0])
+
+
 class Shrdzm(Powermeter):
     def __init__(self, ip: str, user: str, password: str):
         self.ip = ip
@@ -126,13 +358,62 @@ class Shrdzm(Powermeter):
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
-        return session.get(url, timeout=10).json()
+        return self.session.get(url).json()
 
     def get_powermeter_watts(self):
         parsed_data = self.get_json(f'/getLastData?user={self.user}&password={self.password}')
         return cast_to_int(cast_to_int(parsed_data['1.7.0']) - cast_to_int(parsed_data['2.7.0']))
 
 
+class ShrdzmUdp(Shrdzm, PushPowermeter):
+    """
+    Listens for the OBIS values a SHRDZM reader broadcasts via UDP and computes 1.7.0 - 2.7.0 from every datagram.
+    The HTTP API is only polled if no datagram arrived within max_age seconds.
+    """
+    def __init__(self, ip: str, user: str, password: str, udp_port: int, max_age: float = 30):
+        Shrdzm.__init__(self, ip, user, password)
+        PushPowermeter.__init__(self)
+        self.udp_port = udp_port
+        self.max_age = max_age
+        self.start_receiver()
+
+    def handle_datagram(self, payload: bytes):
+        parsed_data = json.loads(payload)
+        # depending on the firmware the OBIS values are either top level or wrapped in "data"
+        parsed_data = parsed_data.get('data', parsed_data)
+        if '1.7.0' not in parsed_data or '2.7.0' not in parsed_data:
+            return
+        timestamp = datetime.fromisoformat(parsed_data['timestamp']).timestamp() if 'timestamp' in parsed_data else None
+        self.set_value('power', cast_to_int(parsed_data['1.7.0']) - cast_to_int(parsed_data['2.7.0']), timestamp)
+
+    def receive(self):
+        import socket
+        sender_ip = socket.gethostbyname(self.ip)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            udp_socket.bind(('', self.udp_port))
+            # wake up regularly to notice close()
+            udp_socket.settimeout(5)
+            self.connected = True
+            logger.info('SHRDZM: listening for UDP datagrams on port %s', self.udp_port)
+            while not self.closed:
+                try:
+                    payload, address = udp_socket.recvfrom(4096)
+                except socket.timeout:
+                    continue
+                if address[0] != sender_ip:
+                    continue
+                try:
+                    self.handle_datagram(payload)
+                except Exception as e:
+                    logger.error('SHRDZM: invalid UDP datagram from %s: %s', address[0], e)
+
+    def get_powermeter_watts(self):
+        if not self.is_fresh(self.max_age):
+            return super().get_powermeter_watts()
+        return self.get_values(['power'])[0][0]
+
+
 class Emlog(Powermeter):
     def __init__(self, ip: str, meterindex: str, json_power_calculate: bool):
         self.ip = ip
@@ -141,7 +422,7 @@ class Emlog(Powermeter):
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
-        return session.get(url, timeout=10).json()
+        return self.session.get(url).json()
 
     def get_powermeter_watts(self):
         parsed_data = self.get_json(f'/pages/getinformation.php?heute&meterindex={self.meterindex}')
@@ -153,6 +434,60 @@ class Emlog(Powermeter):
             return cast_to_int(input_power - ouput_power)
 
 
+class IoBrokerClient:
+    """
+    Reads datapoints from an ioBroker simple-api instance. All meters and providers using the same instance register
+    their datapoints here, so one getBulk request fetches the values for all of them. The result is kept for a short
+    time, the consumers reading in the same cycle get their values from that single request.
+    """
+    instances = {}
+    instances_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, ip: str, port: str):
+        with cls.instances_lock:
+            key = (ip, str(port))
+            if key not in cls.instances:
+                cls.instances[key] = cls(ip, port)
+            return cls.instances[key]
+
+    session = DEFAULT_HTTP_CLIENT
+
+    def __init__(self, ip: str, port: str, max_age: float = 0.5):
+        self.ip = ip
+        self.port = port
+        self.max_age = max_age
+        self.aliases = []
+        self.items = {}
+        self.fetch_time = 0
+        self.lock = threading.Lock()
+
+    def register(self, *aliases):
+        with self.lock:
+            for alias in aliases:
+                if alias and alias not in self.aliases:
+                    self.aliases.append(alias)
+
+    def get_json(self, path):
+        url = f'http://{self.ip}:{self.port}{path}'
+        response = self.session.get(url)
+        if response.status_code != 200:
+            raise Exception(f'ioBroker: HTTP {response.status_code} from {url}, is the simple-api adapter listening on port {self.port}?')
+        return response.json()
+
+    def get_items(self, aliases):
+        self.register(*aliases)
+        with self.lock:
+            if time.time() - self.fetch_time > self.max_age or any(alias not in self.items for alias in aliases):
+                parsed_data = self.get_json(f'/getBulk/{",".join(self.aliases)}')
+                # e.g. the REST API adapter answers with a single object
+                if not isinstance(parsed_data, list) or not all(isinstance(item, dict) and 'id' in item for item in parsed_data):
+                    raise Exception(f'ioBroker: unexpected answer to getBulk, is {self.ip}:{self.port} the simple-api adapter? {str(parsed_data)[:200]}')
+                self.items = {item['id']: item for item in parsed_data}
+                self.fetch_time = time.time()
+            return {alias: self.items.get(alias) for alias in aliases}
+
+
 class IoBroker(Powermeter):
     def __init__(self, ip: str, port: str, current_power_alias: str, power_calculate: bool, power_input_alias: str,
                  power_output_alias: str):
@@ -162,28 +497,35 @@ class IoBroker(Powermeter):
         self.power_calculate = power_calculate
         self.power_input_alias = power_input_alias
         self.power_output_alias = power_output_alias
+        self.client = IoBrokerClient.get_instance(ip, port)
+        if not self.power_calculate:
+            self.client.register(self.current_power_alias)
+        else:
+            self.client.register(self.power_input_alias, self.power_output_alias)
 
-    def get_json(self, path):
-        url = f'http://{self.ip}:{self.port}{path}'
-        return session.get(url, timeout=10).json()
+    @property
+    def session(self):
+        return self.client.session
+
+    @session.setter
+    def session(self, value):
+        self.client.session = value
 
     def get_powermeter_watts(self):
-        input_power = -1
-        output_power = -1
         if not self.power_calculate:
-            parsed_data = self.get_json(f'/getBulk/{self.current_power_alias}')
-            for item in parsed_data:
-                if item['id'] == self.current_power_alias:
-                    return cast_to_int(item['val'])
+            aliases = [self.current_power_alias]
         else:
-            parsed_data = self.get_json(f'/getBulk/{self.power_input_alias},{self.power_output_alias}')
-            for item in parsed_data:
-                if item['id'] == self.power_input_alias:
-                    input_power = cast_to_int(item['val'])
-                if item['id'] == self.power_output_alias:
-                    output_power = cast_to_int(item['val'])
-
-            return cast_to_int(input_power - output_power)
+            aliases = [self.power_input_alias, self.power_output_alias]
+        items = self.client.get_items(aliases)
+        missing = [alias for alias in aliases if items[alias] is None or items[alias].get('val') is None]
+        if missing:
+            raise Exception(f'ioBroker: no value for {", ".join(missing)}')
+        for item in items.values():
+            if item.get('ts'):
+                self.source_timestamp = max(self.source_timestamp or 0, item['ts'] / 1000)
+        if not self.power_calculate:
+            return cast_to_int(items[self.current_power_alias]['val'])
+        return cast_to_int(cast_to_int(items[self.power_input_alias]['val']) - cast_to_int(items[self.power_output_alias]['val']))
 
 
 class HomeAssistant(Powermeter):
@@ -204,32 +546,218 @@ class HomeAssistant(Powermeter):
         else:
             url = f"http://{self.ip}:{self.port}{path}"
         headers = {"Authorization": "Bearer " + self.access_token, "content-type": "application/json"}
-        return session.get(url, headers=headers, timeout=10).json()
+        return self.session.get(url, headers=headers).json()
 
     def get_powermeter_watts(self):
         if not self.power_calculate:
             parsed_data = self.get_json(f"/api/states/{self.current_power_entity}")
+            self.source_timestamp = datetime.fromisoformat(parsed_data['last_updated']).timestamp()
             return cast_to_int(parsed_data['state'])
         else:
             parsed_data = self.get_json(f"/api/states/{self.power_input_alias}")
             input_power = cast_to_int(parsed_data['state'])
+            input_timestamp = datetime.fromisoformat(parsed_data['last_updated']).timestamp()
             parsed_data = self.get_json(f"/api/states/{self.power_output_alias}")
             output_power = cast_to_int(parsed_data['state'])
+            self.source_timestamp = max(input_timestamp, datetime.fromisoformat(parsed_data['last_updated']).timestamp())
             return cast_to_int(input_power - output_power)
 
 
+class HomeAssistantWebSocket(HomeAssistant, PushPowermeter):
+    """
+    Home Assistant meter that authenticates once on the WebSocket API and subscribes to state_changed events.
+    Input and output values are read from the same cache snapshot, so they always belong together.
+    Falls back to the REST API while the WebSocket is disconnected.
+    """
+    def __init__(self, ip: str, port: str, use_https: bool, access_token: str, current_power_entity: str,
+                 power_calculate: bool, power_input_alias: str, power_output_alias: str):
+        HomeAssistant.__init__(self, ip, port, use_https, access_token, current_power_entity, power_calculate,
+                               power_input_alias, power_output_alias)
+        PushPowermeter.__init__(self)
+        if self.power_calculate:
+            self.entities = [self.power_input_alias, self.power_output_alias]
+        else:
+            self.entities = [self.current_power_entity]
+        self.message_id = 0
+        self.start_receiver()
+
+    def send_command(self, ws, command: dict):
+        self.message_id += 1
+        command['id'] = self.message_id
+        ws.send(json.dumps(command))
+        return self.message_id
+
+    def set_entity_state(self, state: dict):
+        entity_id = state['entity_id']
+        if entity_id not in self.entities:
+            return
+        try:
+            value = float(state['state'])
+        except ValueError:
+            # 'unavailable' or 'unknown': do not keep an outdated value around
+            self.clear_value(entity_id)
+            return
+        timestamp = datetime.fromisoformat(state['last_updated']).timestamp() if 'last_updated' in state else None
+        self.set_value(entity_id, value, timestamp)
+
+    def receive(self):
+        import websocket
+        scheme = 'wss' if self.use_https else 'ws'
+        ws = websocket.create_connection(f'{scheme}://{self.ip}:{self.port}/api/websocket', timeout=30)
+        try:
+            json.loads(ws.recv())  # auth_required
+            ws.send(json.dumps({'type': 'auth', 'access_token': self.access_token}))
+            response = json.loads(ws.recv())
+            if response['type'] != 'auth_ok':
+                raise Exception(f"HomeAssistant: WebSocket authentication failed: {response.get('message')}")
+            self.message_id = 0
+            self.send_command(ws, {'type': 'subscribe_events', 'event_type': 'state_changed'})
+            get_states_id = self.send_command(ws, {'type': 'get_states'})
+            self.connected = True
+            logger.info('HomeAssistant: WebSocket connected, subscribed to %s', self.entities)
+            while not self.closed:
+                try:
+                    message = json.loads(ws.recv())
+                except websocket.WebSocketTimeoutException:
+                    # state_changed is only sent on changes, so a quiet line is fine as long as HA answers a ping
+                    self.send_command(ws, {'type': 'ping'})
+                    continue
+                if message['type'] == 'event':
+                    new_state = message['event']['data'].get('new_state')
+                    if new_state is not None:
+                        self.set_entity_state(new_state)
+                elif message['type'] == 'result' and message['id'] == get_states_id and message['success']:
+                    for state in message['result']:
+                        self.set_entity_state(state)
+        finally:
+            ws.close()
+
+    def get_powermeter_watts(self):
+        if not self.is_fresh():
+            return super().get_powermeter_watts()
+        values = self.get_values(self.entities)
+        if not self.power_calculate:
+            return cast_to_int(values[0][0])
+        return cast_to_int(values[0][0] - values[1][0])
+
+
+class VZLoggerPushReceiver:
+    """
+    Small embedded HTTP server that accepts the readings vzlogger pushes to a middleware URL
+    ("push": [{"url": "http://<this host>:<port>/"}] in vzlogger.conf). The last buffer_size readings of every
+    channel are kept in a buffer ordered by their timestamp. One receiver is shared by all meters using the same
+    port, it is stopped when the last of them is closed.
+    """
+    instances = {}
+    instances_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, port: int):
+        """
+        Returns the receiver of the port, every call must be paired with a call of close().
+        """
+        with cls.instances_lock:
+            if port not in cls.instances:
+                cls.instances[port] = cls(port)
+            receiver = cls.instances[port]
+            receiver.refcount += 1
+            return receiver
+
+    def __init__(self, port: int, buffer_size: int = 32):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.port = port
+        self.refcount = 0
+        self.buffer_size = buffer_size
+        # uuid -> [(timestamp, value), ...], oldest first
+        self.readings = {}
+        self.readings_lock = threading.Lock()
+        receiver = self
+
+        class PushRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    receiver.handle_push(json.loads(self.rfile.read(length)))
+                    self.send_response(200)
+                except Exception as e:
+                    logger.error('VZLogger: invalid push request: %s', e)
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('', port), PushRequestHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='VZLoggerPushReceiver', daemon=True).start()
+        logger.info('VZLogger: listening for pushed readings on port %s', port)
+
+    def handle_push(self, parsed_data):
+        import bisect
+        with self.readings_lock:
+            for channel in parsed_data['data']:
+                buffer = self.readings.setdefault(channel['uuid'], [])
+                for timestamp_in_ms, value in channel['tuples']:
+                    timestamp = timestamp_in_ms / 1000
+                    # a push may contain several tuples, not necessarily in order, and repeat tuples of the last one
+                    index = bisect.bisect_left(buffer, (timestamp,))
+                    if index < len(buffer) and buffer[index][0] == timestamp:
+                        buffer[index] = (timestamp, value)
+                    else:
+                        buffer.insert(index, (timestamp, value))
+                del buffer[:-self.buffer_size]
+
+    def get_latest(self, uuid: str):
+        """
+        Returns (timestamp, value) of the newest reading of the channel or None.
+        """
+        with self.readings_lock:
+            buffer = self.readings.get(uuid)
+            return buffer[-1] if buffer else None
+
+    def close(self):
+        """
+        Releases the receiver, the last release stops the server and frees the port.
+        """
+        with self.instances_lock:
+            self.refcount -= 1
+            if self.refcount > 0:
+                return
+            if self.instances.get(self.port) is self:
+                del self.instances[self.port]
+            # under the lock, a new receiver for the port can only bind it after it was freed
+            self.server.shutdown()
+            self.server.server_close()
+        logger.info('VZLogger: stopped listening on port %s', self.port)
+
+
 class VZLogger(Powermeter):
-    def __init__(self, ip: str, port: str, uuid: str):
+    def __init__(self, ip: str, port: str, uuid: str, push_port: int = None, max_age: float = 30):
         self.ip = ip
         self.port = port
         self.uuid = uuid
+        self.max_age = max_age
+        self.push_receiver = VZLoggerPushReceiver.get_instance(push_port) if push_port else None
 
     def get_json(self):
         url = f"http://{self.ip}:{self.port}/{self.uuid}"
-        return session.get(url, timeout=10).json()
+        return self.session.get(url).json()
 
     def get_powermeter_watts(self):
-        return cast_to_int(self.get_json()['data'][0]['tuples'][0][1])
+        if self.push_receiver is not None:
+            reading = self.push_receiver.get_latest(self.uuid)
+            if reading is not None and time.time() - reading[0] <= self.max_age:
+                self.source_timestamp = reading[0]
+                return cast_to_int(reading[1])
+        timestamp_in_ms, value = self.get_json()['data'][0]['tuples'][0][:2]
+        self.source_timestamp = timestamp_in_ms / 1000
+        return cast_to_int(value)
+
+    def close(self):
+        if self.push_receiver is not None:
+            self.push_receiver.close()
+            self.push_receiver = None
 
 
 class AmisReader(Powermeter):
@@ -238,7 +766,7 @@ class AmisReader(Powermeter):
 
     def get_json(self, path):
         url = f'http://{self.ip}{path}'
-        return session.get(url, timeout=10).json()
+        return self.session.get(url).json()
 
     def get_powermeter_watts(self):
         parsed_data = self.get_json('/rest')
@@ -282,8 +810,10 @@ class MqttPowermeter(Powermeter):
         self.password = password
         self.value_incoming = None
         self.value_outgoing = None
+        self.value_timestamp = None
 
-        # Initialize MQTT client
+        # Initialize MQTT client, paho is only imported when an MQTT powermeter is configured
+        import paho.mqtt.client as mqtt
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         if self.username and self.password:
             self.client.username_pw_set(self.username, self.password)
@@ -307,6 +837,7 @@ class MqttPowermeter(Powermeter):
         payload = msg.payload.decode()
         try:
             data = json.loads(payload)
+            self.value_timestamp = time.time()
             if msg.topic == self.topic_incoming:
                 self.value_incoming = extract_json_value(data, self.json_path_incoming) if self.json_path_incoming else int(float(payload))
                 logger.info('MQTT: Incoming power: %s Watt', self.value_incoming)
@@ -322,6 +853,7 @@ class MqttPowermeter(Powermeter):
         if self.topic_outgoing and self.value_outgoing is None:
             self.wait_for_message("outgoing")
 
+        self.source_timestamp = self.value_timestamp
         return self.value_incoming - (self.value_outgoing if self.value_outgoing is not None else 0)
 
     def wait_for_message(self, message_type, timeout=5):
@@ -330,3 +862,7 @@ class MqttPowermeter(Powermeter):
             if time.time() - start_time > timeout:
                 raise TimeoutError(f"Timeout waiting for MQTT {message_type} message")
             time.sleep(1)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
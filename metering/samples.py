@@ -0,0 +1,78 @@
+# metering/samples.py
+
+"""
+This module contains the meter readings and their bookkeeping in the control loop: whether a reading is new and
+how a reading measured before the last limit changes is compensated for them.
+"""
+
+import time
+from typing import NamedTuple
+
+from utils.helper_functions import logger
+
+
+class PowermeterReading(NamedTuple):
+    """
+    A powermeter value together with the time it was measured.
+    source_timestamp is the timestamp reported by the device (None if it does not report one), timestamp is the
+    measuring time on the local clock: the source timestamp corrected by the estimated clock offset of the device,
+    or the receive time if there is no source timestamp.
+    """
+    watts: int
+    source_timestamp: float
+    timestamp: float
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+
+class MeterSample(NamedTuple):
+    """
+    Grid meter reading and production value of one cycle, normally read concurrently.
+    timestamp is the mean of the grid measuring time and the production read time, skew their difference in seconds.
+    """
+    powermeter_reading: PowermeterReading
+    hoymiles_actual_power: int
+    timestamp: float
+    skew: float
+
+    @property
+    def powermeter_watts(self):
+        return self.powermeter_reading.watts
+
+
+def is_new_reading(reading, last_source_timestamp, last_change_time: float, duplicate_window: float, now: float = None) -> bool:
+    """
+    Returns False if the reading has the device timestamp of the reading used before and the limit was changed
+    less than duplicate_window seconds ago. Readings without a device timestamp are always new. Only shortly after
+    a limit change, as some devices keep the timestamp while the value does not change.
+    """
+    if reading.source_timestamp is None:
+        return True
+    if now is None:
+        now = time.time()
+    if now - last_change_time < duplicate_window and reading.source_timestamp == last_source_timestamp:
+        logger.info('metering: skip sample, it was already used (measured %.1f s ago)', now - reading.timestamp)
+        return False
+    return True
+
+
+def get_compensated_watts(reading, limit_history) -> int:
+    """
+    A reading measured before the last limit changes does not show their effect yet. Estimates the grid power of
+    now the same way the control loop does: the production follows the limit setpoint. limit_history are the
+    (time, limit setpoint) of the last limit changes, oldest first.
+    """
+    if reading.source_timestamp is None or not limit_history:
+        return reading.watts
+    limit_at_measurement = None
+    for change_time, limit in limit_history:
+        if change_time > reading.timestamp:
+            break
+        limit_at_measurement = limit
+    if limit_at_measurement is None or limit_at_measurement == limit_history[-1][1]:
+        return reading.watts
+    watts = reading.watts - (limit_history[-1][1] - limit_at_measurement)
+    logger.info('metering: sample measured %.1f s ago at a limit of %s Watt, compensated to %s Watt', reading.age, limit_at_measurement, watts)
+    return watts
@@ -0,0 +1,118 @@
+# monitoring/energy.py
+
+"""
+This module contains the energy accounting of the controller: grid import, grid export, PV production and
+curtailment in Wh. Every sample of the control loop adds the energy since the previous sample (trapezoidal rule),
+split at hour boundaries, so the hourly and daily sums add up exactly to the totals.
+Energy is only counted while samples arrive: if two samples are further apart than max_gap (e.g. at night, when the
+controller idles, or while it was stopped), the interval in between is skipped.
+"""
+
+import time
+from datetime import datetime
+
+from utils.cycle_summary import CHANGE
+from utils.helper_functions import logger
+
+ENERGY_NAMES = ('import', 'export', 'production', 'curtailment')
+HOURS_TO_KEEP = 48
+DAYS_TO_KEEP = 62
+
+
+def get_hour_key(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H')
+
+
+def get_next_hour(timestamp: float) -> float:
+    hour_start = datetime.fromtimestamp(timestamp).replace(minute=0, second=0, microsecond=0).timestamp()
+    next_hour = hour_start + 3600
+    if next_hour <= timestamp:
+        # the repeated hour at the end of daylight saving time is ambiguous, fall back to full UTC hours
+        next_hour = (timestamp // 3600 + 1) * 3600
+    return next_hour
+
+
+def new_values() -> dict:
+    return dict.fromkeys(ENERGY_NAMES, 0.0)
+
+
+class EnergyAccounting:
+    def __init__(self, max_gap: float = 300):
+        self.max_gap = max_gap
+        self.totals = new_values()
+        # completed hours and days, the current ones are the last entries
+        self.hours = {}
+        self.days = {}
+        self.last_sample = None
+
+    def add_sample(self, timestamp: float, grid_watts: float, production_watts: float, curtailment_watts: float):
+        """
+        grid_watts is positive for import and negative for export.
+        """
+        powers = (max(grid_watts, 0), max(-grid_watts, 0), max(production_watts, 0), max(curtailment_watts, 0))
+        last_sample, self.last_sample = self.last_sample, (timestamp, powers)
+        if last_sample is None:
+            return
+        last_timestamp, last_powers = last_sample
+        if not 0 < timestamp - last_timestamp <= self.max_gap:
+            return
+        # split the interval at hour boundaries, with the powers interpolated linearly
+        start = last_timestamp
+        start_powers = last_powers
+        while start < timestamp:
+            end = min(get_next_hour(start), timestamp)
+            fraction = (end - last_timestamp) / (timestamp - last_timestamp)
+            end_powers = [last + (current - last) * fraction for last, current in zip(last_powers, powers)]
+            self.add_energy(start, [(a + b) / 2 * (end - start) / 3600 for a, b in zip(start_powers, end_powers)])
+            start, start_powers = end, end_powers
+
+    def add_energy(self, timestamp: float, energies):
+        hour = get_hour_key(timestamp)
+        if hour not in self.hours:
+            self.start_hour(hour)
+        day = hour[:10]
+        for name, energy in zip(ENERGY_NAMES, energies):
+            self.totals[name] += energy
+            self.hours[hour][name] += energy
+            self.days[day][name] += energy
+
+    def start_hour(self, hour: str):
+        if self.hours:
+            last_hour = next(reversed(self.hours))
+            logger.info('Energy %s:00: %s', last_hour, format_values(self.hours[last_hour]))
+            if last_hour[:10] != hour[:10]:
+                logger.info('Energy %s: %s', last_hour[:10], format_values(self.days[last_hour[:10]]), extra=CHANGE)
+        self.hours[hour] = new_values()
+        self.days.setdefault(hour[:10], new_values())
+        while len(self.hours) > HOURS_TO_KEEP:
+            del self.hours[next(iter(self.hours))]
+        while len(self.days) > DAYS_TO_KEEP:
+            del self.days[next(iter(self.days))]
+
+    def get_states(self, now: float = None) -> dict:
+        """
+        Returns the totals, the values of today and of the last completed hour in Wh, rounded to whole Wh.
+        """
+        if now is None:
+            now = time.time()
+        today = get_hour_key(now)[:10]
+        last_hour = get_hour_key(get_next_hour(now) - 3600 - 1)
+        states = {}
+        for prefix, values in (('total', self.totals),
+                               ('today', self.days.get(today, new_values())),
+                               ('last_hour', self.hours.get(last_hour, new_values()))):
+            for name in ENERGY_NAMES:
+                states[f'energy_{prefix}_{name}_wh'] = round(values[name])
+        return states
+
+    def get_state(self) -> dict:
+        return {'totals': self.totals, 'hours': self.hours, 'days': self.days}
+
+    def restore_state(self, state: dict):
+        self.totals = {name: float(state['totals'].get(name, 0)) for name in ENERGY_NAMES}
+        self.hours = {key: {name: float(values.get(name, 0)) for name in ENERGY_NAMES} for key, values in sorted(state['hours'].items())}
+        self.days = {key: {name: float(values.get(name, 0)) for name in ENERGY_NAMES} for key, values in sorted(state['days'].items())}
+
+
+def format_values(values: dict) -> str:
+    return ', '.join(f'{name} {values[name]:.0f} Wh' for name in ENERGY_NAMES)
@@ -0,0 +1,329 @@
+# monitoring/history.py
+
+"""
+This module contains a compact binary history of the control loop. Every sample (timestamp, grid power, production,
+limit setpoint, battery SoC and the limits of all inverters) is appended as a fixed-width record to a file per day,
+which takes 17 + 2 * inverters bytes. The files are read with mmap: a time range is found by binary search over the
+timestamps and aggregated with numpy if it is installed, otherwise with struct.
+
+Usage as command line tool, from the folder of HoymilesZeroExport.py:
+
+    python -m monitoring.history history --from "2024-05-01 12:00" --to "2024-05-01 13:00"
+    python -m monitoring.history history --from 2024-05-01 --to 2024-06-01 --csv
+"""
+
+import mmap
+import os
+import struct
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from utils.helper_functions import logger
+
+MAGIC = b'HZEH'
+FORMAT_VERSION = 1
+# magic, format version, inverter count, record size
+HEADER = struct.Struct('<4sHHI')
+# timestamp, grid power, production, limit setpoint, battery SoC (-1 = unknown), followed by the inverter limits
+RECORD_PREFIX_FORMAT = '<Iiiib'
+NO_SOC = -1
+# samples further apart are treated as a gap (e.g. the controller was not running) and do not count as energy
+MAX_GAP_IN_SECONDS = 300
+
+
+def get_record_struct(inverter_count: int) -> struct.Struct:
+    return struct.Struct(RECORD_PREFIX_FORMAT + 'H' * inverter_count)
+
+
+def get_numpy_dtype(inverter_count: int):
+    fields = [('timestamp', '<u4'), ('grid', '<i4'), ('production', '<i4'), ('setpoint', '<i4'), ('soc', 'i1')]
+    fields += [(f'limit_{i}', '<u2') for i in range(inverter_count)]
+    return numpy.dtype(fields)
+
+
+def clamp(value, minimum, maximum):
+    return max(minimum, min(maximum, int(value)))
+
+
+class HistoryRecorder:
+    """
+    Appends samples to <directory>/<local date>.bin. If the file of the day was written with a different number
+    of inverters, a new file <local date>.<n>.bin is started.
+    """
+
+    def __init__(self, directory: str, inverter_count: int):
+        self.directory = directory
+        self.inverter_count = inverter_count
+        self.record = get_record_struct(inverter_count)
+        self.header = HEADER.pack(MAGIC, FORMAT_VERSION, inverter_count, self.record.size)
+        self.file = None
+        self.file_date = None
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, timestamp: float, grid_watts, production_watts, setpoint_watts, limits, soc=None):
+        day = date.fromtimestamp(timestamp)
+        if day != self.file_date:
+            self.open(day)
+        self.file.write(self.record.pack(
+            int(timestamp),
+            clamp(grid_watts, -2**31, 2**31 - 1),
+            clamp(production_watts, -2**31, 2**31 - 1),
+            clamp(setpoint_watts, -2**31, 2**31 - 1),
+            NO_SOC if soc is None else clamp(soc, 0, 100),
+            *[clamp(limit, 0, 65535) for limit in limits]))
+        self.file.flush()
+
+    def open(self, day: date):
+        self.close()
+        suffix = 0
+        while True:
+            path = os.path.join(self.directory, f'{day.isoformat()}{"" if suffix == 0 else f".{suffix}"}.bin')
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                self.file = open(path, 'ab')
+                self.file.write(self.header)
+                break
+            with open(path, 'rb') as file:
+                header = file.read(HEADER.size)
+            if header == self.header:
+                self.file = open(path, 'ab')
+                # cut off a record which was only partly written before a crash
+                excess = (os.path.getsize(path) - HEADER.size) % self.record.size
+                if excess:
+                    self.file.truncate(os.path.getsize(path) - excess)
+                break
+            suffix += 1
+        self.file_date = day
+
+    def close(self):
+        """
+        Closes the file, the next sample opens it again.
+        """
+        if self.file is not None:
+            try:
+                self.file.close()
+            finally:
+                self.file = None
+                self.file_date = None
+
+
+class HistoryFile:
+    """
+    A memory mapped history file. The records are sorted by time, as they were appended in that order.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            magic, version, self.inverter_count, self.record_size = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f'{path} is not a history file of version {FORMAT_VERSION}')
+            self.record = get_record_struct(self.inverter_count)
+            size = os.path.getsize(path)
+            self.count = (size - HEADER.size) // self.record_size
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.count > 0 else None
+
+    def timestamp_at(self, index: int) -> int:
+        return struct.unpack_from('<I', self.map, HEADER.size + index * self.record_size)[0]
+
+    def bisect(self, timestamp: float) -> int:
+        """
+        Returns the index of the first record at or after timestamp.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp_at(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_range(self, start: float, end: float):
+        if self.count == 0:
+            return 0, 0
+        return self.bisect(start), self.bisect(end)
+
+    def iter_records(self, start: float, end: float):
+        first, last = self.get_range(start, end)
+        if first == last:
+            return
+        with memoryview(self.map) as view:
+            yield from self.record.iter_unpack(view[HEADER.size + first * self.record_size:HEADER.size + last * self.record_size])
+
+    def get_columns(self, start: float, end: float, names):
+        """
+        Returns the given fields of the records in the time range as float arrays. They are copies, so the file
+        can be closed afterwards.
+        """
+        first, last = self.get_range(start, end)
+        if first == last:
+            return [numpy.empty(0) for name in names]
+        data = numpy.frombuffer(self.map, get_numpy_dtype(self.inverter_count), last - first, HEADER.size + first * self.record_size)
+        return [data[name].astype(numpy.float64) for name in names]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+
+def get_file_key(name: str):
+    """
+    Returns (date, n) of a file named <date>.bin (n = 0) or <date>.<n>.bin, None for other files. The files of a
+    day were started in the order of n, which the file names do not sort by (2024-05-01.1.bin < 2024-05-01.bin).
+    """
+    parts = name.split('.')
+    if len(parts) not in (2, 3) or parts[-1] != 'bin':
+        return None
+    try:
+        return date.fromisoformat(parts[0]), int(parts[1]) if len(parts) == 3 else 0
+    except ValueError:
+        return None
+
+
+class HistoryReader:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_files(self, start: float, end: float):
+        # the files are named after the local date, one extra day on both sides covers clock changes
+        first_day = date.fromtimestamp(start) - timedelta(days=1)
+        last_day = date.fromtimestamp(end) + timedelta(days=1)
+        paths = []
+        for name in os.listdir(self.directory):
+            key = get_file_key(name)
+            if key is not None and first_day <= key[0] <= last_day:
+                paths.append((key, os.path.join(self.directory, name)))
+        files = []
+        for key, path in sorted(paths):
+            try:
+                files.append(HistoryFile(path))
+            except (OSError, ValueError) as e:
+                logger.warning('History: skipping %s: %s', path, e)
+        return files
+
+    def records(self, start: float, end: float):
+        """
+        Yields (timestamp, grid, production, setpoint, soc, limits) of all samples with start <= timestamp < end.
+        """
+        files = self.get_files(start, end)
+        try:
+            for history_file in files:
+                for record in history_file.iter_records(start, end):
+                    yield record[0], record[1], record[2], record[3], None if record[4] == NO_SOC else record[4], record[5:]
+        finally:
+            for history_file in files:
+                history_file.close()
+
+    def summary(self, start: float, end: float, max_gap: float = MAX_GAP_IN_SECONDS) -> dict:
+        """
+        Aggregates the samples with start <= timestamp < end. The energies are integrated with the trapezoidal
+        rule between consecutive samples, grid import and export separately.
+        """
+        if numpy is not None:
+            return self.summary_numpy(start, end, max_gap)
+        timestamps, grid, production, setpoint = [], [], [], []
+        for record in self.records(start, end):
+            timestamps.append(record[0])
+            grid.append(record[1])
+            production.append(record[2])
+            setpoint.append(record[3])
+        return summarize(timestamps, grid, production, setpoint, max_gap)
+
+    def summary_numpy(self, start: float, end: float, max_gap: float) -> dict:
+        files = self.get_files(start, end)
+        try:
+            columns = [history_file.get_columns(start, end, ('timestamp', 'grid', 'production', 'setpoint')) for history_file in files]
+            if not columns:
+                return summarize([], [], [], [], max_gap)
+            timestamps, grid, production, setpoint = (numpy.concatenate([column[i] for column in columns]) for i in range(4))
+        finally:
+            for history_file in files:
+                history_file.close()
+        if len(timestamps) == 0:
+            return summarize([], [], [], [], max_gap)
+        interval = numpy.diff(timestamps)
+        valid = (interval > 0) & (interval <= max_gap)
+
+        def integrate(values):
+            return float(numpy.sum(((values[:-1] + values[1:]) / 2 * interval)[valid]) / 3600)
+
+        return {
+            'samples': len(timestamps),
+            'first': float(timestamps[0]),
+            'last': float(timestamps[-1]),
+            'grid_avg_w': float(grid.mean()),
+            'grid_min_w': float(grid.min()),
+            'grid_max_w': float(grid.max()),
+            'production_avg_w': float(production.mean()),
+            'production_max_w': float(production.max()),
+            'setpoint_avg_w': float(setpoint.mean()),
+            'import_wh': integrate(numpy.clip(grid, 0, None)),
+            'export_wh': integrate(numpy.clip(-grid, 0, None)),
+            'production_wh': integrate(production),
+        }
+
+
+def summarize(timestamps, grid, production, setpoint, max_gap: float) -> dict:
+    if not timestamps:
+        return {'samples': 0}
+    import_wh = export_wh = production_wh = 0.0
+    for i in range(1, len(timestamps)):
+        interval = timestamps[i] - timestamps[i - 1]
+        if interval <= 0 or interval > max_gap:
+            continue
+        import_wh += (max(grid[i - 1], 0) + max(grid[i], 0)) / 2 * interval
+        export_wh += (max(-grid[i - 1], 0) + max(-grid[i], 0)) / 2 * interval
+        production_wh += (production[i - 1] + production[i]) / 2 * interval
+    return {
+        'samples': len(timestamps),
+        'first': float(timestamps[0]),
+        'last': float(timestamps[-1]),
+        'grid_avg_w': sum(grid) / len(grid),
+        'grid_min_w': float(min(grid)),
+        'grid_max_w': float(max(grid)),
+        'production_avg_w': sum(production) / len(production),
+        'production_max_w': float(max(production)),
+        'setpoint_avg_w': sum(setpoint) / len(setpoint),
+        'import_wh': import_wh / 3600,
+        'export_wh': export_wh / 3600,
+        'production_wh': production_wh / 3600,
+    }
+
+
+def parse_time(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Query the binary history of HoymilesZeroExport')
+    parser.add_argument('directory', help='history folder, see HISTORY_DIR')
+    parser.add_argument('--from', dest='start', required=True, type=parse_time, help='local time, e.g. "2024-05-01 12:00"')
+    parser.add_argument('--to', dest='end', type=parse_time, default=None, help='local time, default: now')
+    parser.add_argument('--csv', action='store_true', help='print the samples instead of the summary')
+    args = parser.parse_args()
+    end = time.time() if args.end is None else args.end
+    reader = HistoryReader(args.directory)
+    if args.csv:
+        print('time;grid_w;production_w;setpoint_w;soc;limits_w')
+        for timestamp, grid, production, setpoint, soc, limits in reader.records(args.start, end):
+            print(f'{datetime.fromtimestamp(timestamp).isoformat()};{grid};{production};{setpoint};{"" if soc is None else soc};{",".join(map(str, limits))}')
+        return
+    start_time = time.perf_counter()
+    summary = reader.summary(args.start, end)
+    duration = time.perf_counter() - start_time
+    for key, value in summary.items():
+        if key in ('first', 'last'):
+            value = datetime.fromtimestamp(value).isoformat(sep=' ')
+        elif isinstance(value, float):
+            value = f'{value:.1f}'
+        print(f'{key:18}: {value}')
+    print(f'{"query_ms":18}: {duration * 1000:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# monitoring/metrics.py
+
+"""
+This module contains counters, gauges and histograms in the style of Prometheus and an optional HTTP endpoint
+which serves them in the Prometheus text format on /metrics.
+Updating a metric only changes a few numbers of a child object which is created once per label combination, so the
+metrics can stay enabled in production. Values which already exist elsewhere (e.g. the latency statistics of the HTTP
+clients or the current inverter limits) are read by collectors only when /metrics is requested.
+"""
+
+import threading
+from bisect import bisect_left
+
+from utils.helper_functions import logger
+
+# default histogram buckets in seconds, from fast local requests to DTU acknowledges
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra: str = ''):
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class GaugeChild:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts per bucket, the last one is +Inf. They are summed up only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.children_lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self.create_child()
+
+    def create_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """
+        Returns the child for the given label values. Keep the result if you update it often.
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self.children_lock:
+                child = self.children.setdefault(values, self.create_child())
+        return child
+
+    def render(self, lines: list):
+        lines.append(f'# HELP {self.name} {self.documentation}')
+        lines.append(f'# TYPE {self.name} {self.type}')
+        for values, child in list(self.children.items()):
+            self.render_child(lines, values, child)
+
+    def render_child(self, lines: list, values, child):
+        lines.append(f'{self.name}{format_labels(self.labelnames, values)} {format_value(child.value)}')
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def create_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.children[()].set(value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def render_child(self, lines: list, values, child):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        render_histogram(lines, self.name, self.labelnames, values, self.buckets, counts, total)
+
+
+def render_histogram(lines: list, name: str, labelnames, values, buckets, counts, total):
+    cumulative = 0
+    for bound, count in zip(buckets + (float('inf'),), counts):
+        cumulative += count
+        le = f'le="{format_value(bound)}"'
+        lines.append(f'{name}_bucket{format_labels(labelnames, values, le)} {cumulative}')
+    lines.append(f'{name}_sum{format_labels(labelnames, values)} {format_value(total)}')
+    lines.append(f'{name}_count{format_labels(labelnames, values)} {cumulative}')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """
+        collector(lines) is called for every request of /metrics and appends its own lines in the text format.
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+        for collector in self.collectors:
+            try:
+                collector(lines)
+            except Exception as e:
+                logger.warning('Metrics: collector %s failed: %s', getattr(collector, '__name__', collector), e)
+        return '\n'.join(lines) + '\n'
+
+
+def collect_http_clients(lines: list):
+    """
+    Exports the latency statistics which every HttpClient records anyway.
+    """
+    from utils.http_clients import HttpClient, LatencyHistogram
+    clients = HttpClient.get_instances()
+    name = 'hoymiles_http_request_duration_seconds'
+    lines.append(f'# HELP {name} Duration of the HTTP requests to the devices')
+    lines.append(f'# TYPE {name} histogram')
+    for client in clients:
+        with client.latency.lock:
+            counts = list(client.latency.counts)
+            total = client.latency.sum
+        render_histogram(lines, name, ('client',), (client.name,), LatencyHistogram.BUCKETS, counts, total)
+    lines.append('# HELP hoymiles_http_request_errors_total Failed HTTP requests to the devices')
+    lines.append('# TYPE hoymiles_http_request_errors_total counter')
+    for client in clients:
+        lines.append(f'hoymiles_http_request_errors_total{format_labels(("client",), (client.name,))} {client.latency.errors}')
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry on http://<address>:<port>/metrics from a background thread.
+    """
+
+    def __init__(self, registry: Registry, port: int, address: str = ''):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True).start()
+        logger.info('Metrics: serving /metrics on port %s', port)
@@ -0,0 +1,179 @@
+# monitoring/status_segment.py
+
+"""
+This module contains a live status block in a memory mapped file (e.g. under /dev/shm), which the controller
+updates in place once per cycle. Local dashboards and scripts can read it at any rate without MQTT and without
+disturbing the controller.
+
+Layout (little endian, no padding):
+
+    header    magic 'HZES', format version (H), inverter count (H), sequence (Q)
+    global    timestamp (d), cycle (Q), grid W (i), production W (i), limit setpoint W (i), rated power W (i),
+              battery SoC (b, -1 = unknown), active (B)
+    inverter  name (32s, UTF-8), current limit W (i), max W (i), available (B), limit acknowledged (B),
+              power status (b, -1 = unknown), battery mode (B), battery good voltage (B)   - once per inverter
+
+The sequence works as a seqlock: it is odd while the writer updates the block. A reader copies the block and
+accepts it only if the sequence was even and did not change meanwhile. The writer creates a new file on every
+start, readers notice that by the changed inode and map the new file.
+
+Usage as command line tool, from the folder of HoymilesZeroExport.py:
+
+    python -m monitoring.status_segment /dev/shm/HoymilesZeroExport.status
+"""
+
+import mmap
+import os
+import struct
+import time
+from typing import NamedTuple
+
+MAGIC = b'HZES'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+GLOBAL = struct.Struct('<dQiiiibB')
+INVERTER = struct.Struct('<32siiBBbBB')
+UNKNOWN = -1
+
+
+class InverterStatus(NamedTuple):
+    name: str
+    current_limit: int
+    max_watt: int
+    available: bool
+    limit_acknowledged: bool
+    power_status: object
+    battery_mode: bool
+    battery_good_voltage: bool
+
+
+class Status(NamedTuple):
+    sequence: int
+    timestamp: float
+    cycle: int
+    grid_watts: int
+    production_watts: int
+    limit_setpoint_watts: int
+    rated_power_watts: int
+    battery_soc: object
+    active: bool
+    inverters: list
+
+
+def get_size(inverter_count: int) -> int:
+    return HEADER.size + GLOBAL.size + inverter_count * INVERTER.size
+
+
+def to_tristate(value) -> int:
+    return UNKNOWN if value is None else int(bool(value))
+
+
+class StatusSegmentWriter:
+    def __init__(self, path: str, inverter_count: int):
+        self.inverter_count = inverter_count
+        self.sequence = 0
+        # a new file (inode) on every start, so readers of an old layout are not confused
+        if os.path.exists(path):
+            os.unlink(path)
+        with open(path, 'w+b') as file:
+            file.truncate(get_size(inverter_count))
+            self.map = mmap.mmap(file.fileno(), 0)
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, inverter_count, self.sequence)
+
+    def update(self, cycle: int, grid_watts, production_watts, limit_setpoint_watts, rated_power_watts, battery_soc,
+               active: bool, inverters):
+        """
+        inverters is a list of (name, current limit, max watt, available, limit acknowledged, power status,
+        battery mode, battery good voltage), power status may be None if unknown.
+        """
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        GLOBAL.pack_into(self.map, HEADER.size, time.time(), cycle, int(grid_watts), int(production_watts),
+                         int(limit_setpoint_watts), int(rated_power_watts),
+                         UNKNOWN if battery_soc is None else max(0, min(100, int(battery_soc))), int(active))
+        offset = HEADER.size + GLOBAL.size
+        for name, current_limit, max_watt, available, limit_acknowledged, power_status, battery_mode, battery_good_voltage in inverters[:self.inverter_count]:
+            INVERTER.pack_into(self.map, offset, str(name).encode()[:32], int(current_limit), int(max_watt), int(available),
+                               int(limit_acknowledged), to_tristate(power_status), int(battery_mode), int(battery_good_voltage))
+            offset += INVERTER.size
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        self.map.close()
+
+
+class StatusSegmentReader:
+    def __init__(self, path: str):
+        self.path = path
+        self.map = None
+        self.inode = None
+
+    def open(self):
+        self.close()
+        with open(self.path, 'rb') as file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.inverter_count, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or len(self.map) < get_size(self.inverter_count):
+            self.close()
+            raise ValueError(f'{self.path} is not a status segment of version {FORMAT_VERSION}')
+
+    def read(self, retries: int = 100) -> Status:
+        """
+        Returns a consistent copy of the status. Raises TimeoutError if every attempt overlapped an update.
+        """
+        if self.map is None or os.stat(self.path).st_ino != self.inode:
+            self.open()
+        size = get_size(self.inverter_count)
+        for _ in range(retries):
+            sequence = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+            if sequence % 2 == 0:
+                data = self.map[:size]
+                if SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] == sequence:
+                    return self.unpack(sequence, data)
+            time.sleep(0.0001)
+        raise TimeoutError(f'{self.path} was updated during every read attempt')
+
+    def unpack(self, sequence: int, data: bytes) -> Status:
+        timestamp, cycle, grid, production, setpoint, rated_power, soc, active = GLOBAL.unpack_from(data, HEADER.size)
+        inverters = []
+        for i in range(self.inverter_count):
+            name, current_limit, max_watt, available, acknowledged, power_status, battery_mode, good_voltage = \
+                INVERTER.unpack_from(data, HEADER.size + GLOBAL.size + i * INVERTER.size)
+            inverters.append(InverterStatus(name.rstrip(b'\0').decode(errors='replace'), current_limit, max_watt, bool(available),
+                                            bool(acknowledged), None if power_status == UNKNOWN else bool(power_status),
+                                            bool(battery_mode), bool(good_voltage)))
+        return Status(sequence, timestamp, cycle, grid, production, setpoint, rated_power, None if soc == UNKNOWN else soc,
+                      bool(active), inverters)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Print the live status of HoymilesZeroExport')
+    parser.add_argument('path', help='status segment file, see STATUS_SEGMENT_FILE')
+    parser.add_argument('--watch', type=float, default=0, help='print again every WATCH seconds')
+    args = parser.parse_args()
+    reader = StatusSegmentReader(args.path)
+    while True:
+        status = reader.read()
+        print(f'{time.strftime("%H:%M:%S", time.localtime(status.timestamp))} cycle {status.cycle}: grid {status.grid_watts} W, '
+              f'production {status.production_watts} W, setpoint {status.limit_setpoint_watts} W / {status.rated_power_watts} W, '
+              f'SoC {"-" if status.battery_soc is None else status.battery_soc}')
+        for inverter in status.inverters:
+            print(f'  {inverter.name}: limit {inverter.current_limit} / {inverter.max_watt} W, '
+                  f'available {inverter.available}, acknowledged {inverter.limit_acknowledged}, power {inverter.power_status}')
+        if args.watch <= 0:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
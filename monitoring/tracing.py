@@ -0,0 +1,149 @@
+# monitoring/tracing.py
+
+"""
+This module contains timing spans for the phases of a control cycle. The spans of a cycle are written as one
+compact JSON line when the next cycle starts, e.g.
+
+    {"cycle":12,"ts":1700000000.123,"ms":10021.4,"spans":[["config_update",0.1,0.4],["availability",0.6,35.2]]}
+
+where every span is [name, start offset in ms, duration in ms]. Spans can be nested, the nesting follows from the
+offsets. When the file exceeds max_bytes it is renamed to <file>.1 (replacing the previous one) and a new file is
+started. Optionally every Nth cycle is profiled with cProfile and the stats are dumped to a .prof file, which can be
+inspected with `python -m pstats <file>` or tools like snakeviz. Only the newest profile_keep_count profiles are kept.
+"""
+
+import cProfile
+import glob
+import json
+import os
+import time
+
+from utils.helper_functions import logger
+
+
+class Span:
+    __slots__ = ('recorder', 'name', 'start_time')
+
+    def __init__(self, recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_time = time.perf_counter()
+        cycle_start = self.recorder.cycle_start
+        self.recorder.spans.append([self.name, round((self.start_time - cycle_start) * 1000, 1), round((end_time - self.start_time) * 1000, 1)])
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class SpanRecorder:
+    """
+    Records the spans of the current cycle. If no file is given, span() returns a shared no-op span, so the
+    instrumentation costs next to nothing when it is disabled.
+    """
+
+    def __init__(self, path: str = None, profile_every_n_cycles: int = 0, profile_dir: str = None,
+                 max_bytes: int = 10 * 1024 * 1024, profile_keep_count: int = 10):
+        self.path = path
+        self.file = open(path, 'a') if path else None
+        self.max_bytes = max_bytes
+        self.profile_every_n_cycles = profile_every_n_cycles
+        self.profile_dir = profile_dir
+        self.profile_keep_count = profile_keep_count
+        if self.profile_every_n_cycles > 0:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        self.profiler = None
+        self.cycle = 0
+        self.cycle_start = None
+        self.cycle_timestamp = None
+        self.spans = []
+
+    def span(self, name: str):
+        if self.file is None or self.cycle_start is None:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def call(self, name: str, function, *args):
+        """
+        Calls function(*args) within a span and returns its result.
+        """
+        with self.span(name):
+            return function(*args)
+
+    def next_cycle(self):
+        """
+        Finishes the previous cycle (writes its spans, dumps its profile) and starts a new one.
+        """
+        now = time.perf_counter()
+        if self.cycle_start is not None:
+            self.finish_cycle(now)
+        self.cycle += 1
+        self.cycle_start = now
+        self.cycle_timestamp = time.time()
+        self.spans = []
+        if self.profile_every_n_cycles > 0 and self.cycle % self.profile_every_n_cycles == 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def finish_cycle(self, now: float):
+        if self.profiler is not None:
+            self.profiler.disable()
+            path = os.path.join(self.profile_dir, f'cycle-{self.cycle}.prof')
+            try:
+                self.profiler.dump_stats(path)
+                logger.info('Profile of cycle %s written to %s', self.cycle, path)
+                self.prune_profiles()
+            except OSError as e:
+                logger.warning('Unable to write profile %s: %s', path, e)
+            self.profiler = None
+        if self.file is not None:
+            record = {
+                'cycle': self.cycle,
+                'ts': round(self.cycle_timestamp, 3),
+                'ms': round((now - self.cycle_start) * 1000, 1),
+                'spans': self.spans,
+            }
+            try:
+                self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+                self.file.flush()
+                if self.max_bytes > 0 and self.file.tell() >= self.max_bytes:
+                    self.rotate()
+            except OSError as e:
+                logger.warning('Unable to write spans: %s', e)
+
+    def rotate(self):
+        """
+        Renames the spans file to <file>.1 and starts a new one.
+        """
+        self.file.close()
+        try:
+            os.replace(self.path, self.path + '.1')
+        finally:
+            self.file = open(self.path, 'a')
+
+    def prune_profiles(self):
+        """
+        Removes all but the newest profile_keep_count profiles. The cycle numbers start again after a restart, so
+        the profiles are ordered by their modification time.
+        """
+        if self.profile_keep_count <= 0:
+            return
+        profiles = sorted(glob.glob(os.path.join(self.profile_dir, 'cycle-*.prof')), key=os.path.getmtime)
+        for path in profiles[:-self.profile_keep_count]:
+            os.remove(path)
@@ -0,0 +1,121 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from requests import Session
+from requests.exceptions import ConnectionError, RetryError
+from urllib3.util.retry import Retry
+
+from utils.circuit_breaker import CircuitBreaker, CircuitBreakerAdapter, CircuitOpenError
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    status = 200
+
+    def do_GET(self):
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), StatusHandler)
+    server.status = 200
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_unused_port():
+    with socket.socket() as unused_socket:
+        unused_socket.bind(('127.0.0.1', 0))
+        return unused_socket.getsockname()[1]
+
+
+def create_session(adapter):
+    session = Session()
+    session.mount('http://', adapter)
+    return session
+
+
+def create_adapter():
+    retry = Retry(total=1, backoff_factor=0, status_forcelist=[503], allowed_methods={'GET'})
+    return CircuitBreakerAdapter(failure_threshold=2, reset_timeout=0.1, max_reset_timeout=1, max_retries=retry)
+
+
+def test_opens_after_threshold_and_fails_fast():
+    adapter = create_adapter()
+    session = create_session(adapter)
+    url = f'http://127.0.0.1:{get_unused_port()}/'
+    for _ in range(2):
+        with pytest.raises(ConnectionError) as error:
+            session.get(url, timeout=1)
+        assert not isinstance(error.value, CircuitOpenError)
+    assert adapter.get_breaker(url).state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        session.get(url, timeout=1)
+
+
+def test_half_open_probe_success_closes(server):
+    adapter = create_adapter()
+    session = create_session(adapter)
+    url = f'http://127.0.0.1:{server.server_port}/'
+    breaker = adapter.get_breaker(url)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.15)
+    assert session.get(url, timeout=1).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_half_open_probe_retry_error_opens_again(server):
+    adapter = create_adapter()
+    session = create_session(adapter)
+    url = f'http://127.0.0.1:{server.server_port}/'
+    breaker = adapter.get_breaker(url)
+    server.status = 503
+    for _ in range(2):
+        with pytest.raises(RetryError):
+            session.get(url, timeout=1)
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.15)
+    # the probe fails with a RetryError, the circuit opens again with a doubled reset timeout
+    with pytest.raises(RetryError):
+        session.get(url, timeout=1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.current_reset_timeout == pytest.approx(0.2)
+    with pytest.raises(CircuitOpenError):
+        session.get(url, timeout=1)
+    # the device recovers, the next probe closes the circuit
+    server.status = 200
+    time.sleep(0.25)
+    assert session.get(url, timeout=1).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.current_reset_timeout == pytest.approx(0.1)
+
+
+def test_only_one_probe_while_half_open():
+    breaker = CircuitBreaker('device', failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_reset_timeout_is_capped():
+    breaker = CircuitBreaker('device', failure_threshold=1, reset_timeout=10, max_reset_timeout=25)
+    breaker.record_failure()
+    for _ in range(3):
+        breaker.state = CircuitBreaker.HALF_OPEN
+        breaker.record_failure()
+    assert breaker.current_reset_timeout == 25
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytest
+
+from monitoring.energy import EnergyAccounting
+
+
+def at(hour, minute=0, second=0, day=1):
+    return datetime(2024, 5, day, hour, minute, second).timestamp()
+
+
+def test_constant_power_is_split_at_the_hour():
+    energy = EnergyAccounting(max_gap=7200)
+    energy.add_sample(at(12, 30), 1000, 0, 0)
+    energy.add_sample(at(13, 30), 1000, 0, 0)
+    assert energy.hours['2024-05-01T12']['import'] == pytest.approx(500)
+    assert energy.hours['2024-05-01T13']['import'] == pytest.approx(500)
+    assert energy.totals['import'] == pytest.approx(1000)
+    assert energy.days['2024-05-01']['import'] == pytest.approx(1000)
+
+
+def test_power_is_interpolated_at_the_hour():
+    energy = EnergyAccounting()
+    energy.add_sample(at(12, 59), 0, 0, 0)
+    energy.add_sample(at(13, 1), 1200, 0, 0)
+    # 0 -> 600 Watt in the first minute, 600 -> 1200 Watt in the second one
+    assert energy.hours['2024-05-01T12']['import'] == pytest.approx(5)
+    assert energy.hours['2024-05-01T13']['import'] == pytest.approx(15)
+
+
+def test_import_export_production_and_curtailment():
+    energy = EnergyAccounting()
+    energy.add_sample(at(12), -360, 720, 100)
+    energy.add_sample(at(12, 1), -360, 720, 100)
+    energy.add_sample(at(12, 2), 360, 720, -100)
+    assert energy.totals['export'] == pytest.approx(6 + 3)
+    assert energy.totals['import'] == pytest.approx(3)
+    assert energy.totals['production'] == pytest.approx(24)
+    # negative values count as 0
+    assert energy.totals['curtailment'] == pytest.approx(100 / 60 + 100 / 2 / 60)
+
+
+def test_gaps_are_not_counted():
+    energy = EnergyAccounting(max_gap=300)
+    energy.add_sample(at(12), 600, 0, 0)
+    energy.add_sample(at(12, 10), 600, 0, 0)
+    assert energy.totals['import'] == 0
+    # counting continues from the sample after the gap
+    energy.add_sample(at(12, 11), 600, 0, 0)
+    assert energy.totals['import'] == pytest.approx(10)
+    # repeated and older timestamps add nothing
+    energy.add_sample(at(12, 11), 600, 0, 0)
+    energy.add_sample(at(12, 5), 600, 0, 0)
+    assert energy.totals['import'] == pytest.approx(10)
+
+
+def test_days_add_up_to_the_totals():
+    energy = EnergyAccounting()
+    timestamp = at(23, 50)
+    while timestamp < at(0, 10, day=2):
+        energy.add_sample(timestamp, 600, 0, 0)
+        timestamp += 90
+    assert energy.days['2024-05-01']['import'] == pytest.approx(100)
+    assert sum(day['import'] for day in energy.days.values()) == pytest.approx(energy.totals['import'])
+    assert sum(hour['import'] for hour in energy.hours.values()) == pytest.approx(energy.totals['import'])
@@ -0,0 +1,66 @@
+import pytest
+
+from metering.powermeters import ESPHomeEvents, iter_event_lines
+
+
+class FakeResponse:
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.payload), chunk_size):
+            yield self.payload[i:i + chunk_size]
+
+
+class FakeSession:
+    timeout = (3.05, 5)
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    def get(self, url, **kwargs):
+        return FakeResponse(self.payload)
+
+
+@pytest.fixture
+def meter(monkeypatch):
+    # receive() is called directly by the tests
+    monkeypatch.setattr(ESPHomeEvents, 'start_receiver', lambda self: None)
+    return ESPHomeEvents('127.0.0.1', '80', 'sensor', 'power')
+
+
+def test_crlf_event_stream(meter):
+    meter.session = FakeSession(
+        b'retry: 30000\r\nid: 1\r\nevent: ping\r\ndata: {"title":"meter"}\r\n\r\n'
+        b'event: state\r\ndata: {"id":"sensor-other","value":7}\r\n\r\n'
+        b'event: state\r\ndata: {"id":"sensor-power","value":-235.4,"state":"-235.4 W"}\r\n\r\n')
+    meter.receive()
+    assert meter.values['value'][0] == -235.4
+    meter.connected = True
+    assert meter.get_powermeter_watts() == -235
+
+
+def test_lf_event_stream(meter):
+    meter.session = FakeSession(b'event: state\ndata: {"id":"sensor-power","value":80}\n\n')
+    meter.receive()
+    assert meter.values['value'][0] == 80
+
+
+def test_event_without_terminating_empty_line_is_ignored(meter):
+    meter.session = FakeSession(b'event: state\r\ndata: {"id":"sensor-power","value":80}\r\n')
+    meter.receive()
+    assert 'value' not in meter.values
+
+
+def test_iter_event_lines():
+    chunks = [b'event: st', b'ate\r', b'\ndata: {}\r\n', b'\r\n', b'\n', b'partial']
+    assert list(iter_event_lines(chunks)) == ['event: state', 'data: {}', '', '']
@@ -0,0 +1,36 @@
+import os
+from datetime import datetime
+
+from monitoring.history import HistoryReader, HistoryRecorder, get_file_key
+
+
+def test_file_key():
+    assert get_file_key('2024-05-01.bin') == (datetime(2024, 5, 1).date(), 0)
+    assert get_file_key('2024-05-01.12.bin') == (datetime(2024, 5, 1).date(), 12)
+    assert get_file_key('2024-05-01.bin.tmp') is None
+    assert get_file_key('notes.bin') is None
+
+
+def test_files_of_a_day_are_read_in_the_order_they_were_started(tmp_path):
+    directory = str(tmp_path)
+    start = datetime(2024, 5, 1, 12).timestamp()
+    # every change of the inverter count starts a new file of the day
+    for i, inverter_count in enumerate((1, 2, 3, 1, 4, 5, 6, 7, 8, 9, 10, 11)):
+        recorder = HistoryRecorder(directory, inverter_count)
+        recorder.append(start + i, i, 0, 0, [0] * inverter_count)
+        recorder.close()
+    assert '2024-05-01.10.bin' in os.listdir(directory)
+    timestamps = [record[0] for record in HistoryReader(directory).records(start, start + 60)]
+    # the 4th sample was appended to the first file again
+    assert timestamps == [start, start + 3, start + 1, start + 2] + [start + i for i in range(4, 12)]
+
+
+def test_recorder_opens_the_file_again_after_close(tmp_path):
+    directory = str(tmp_path)
+    start = datetime(2024, 5, 1, 12).timestamp()
+    recorder = HistoryRecorder(directory, 1)
+    recorder.append(start, 100, 0, 0, [0])
+    recorder.close()
+    recorder.append(start + 1, 200, 0, 0, [0])
+    recorder.close()
+    assert [record[1] for record in HistoryReader(directory).records(start, start + 60)] == [100, 200]
@@ -0,0 +1,224 @@
+import json
+import queue
+import time
+
+import pytest
+import websocket
+
+from metering.powermeters import HomeAssistantWebSocket, PushPowermeter
+
+CLOSE = object()
+
+
+class FakeWebSocket:
+    """
+    Local stand-in for the Home Assistant WebSocket API: answers the authentication and get_states, further
+    messages are pushed by the test with push().
+    """
+
+    def __init__(self, states, access_token='token'):
+        self.states = states
+        self.access_token = access_token
+        self.incoming = queue.Queue()
+        self.sent = []
+        self.closed = False
+        self.incoming.put({'type': 'auth_required'})
+
+    def send(self, payload):
+        message = json.loads(payload)
+        self.sent.append(message)
+        if message['type'] == 'auth':
+            ok = message['access_token'] == self.access_token
+            self.incoming.put({'type': 'auth_ok'} if ok else {'type': 'auth_invalid', 'message': 'invalid token'})
+        elif message['type'] == 'get_states':
+            self.incoming.put({'type': 'result', 'id': message['id'], 'success': True, 'result': self.states})
+        elif message['type'] == 'ping':
+            self.incoming.put({'type': 'pong', 'id': message['id']})
+
+    def push(self, message):
+        self.incoming.put(message)
+
+    def recv(self):
+        try:
+            message = self.incoming.get(timeout=0.1)
+        except queue.Empty:
+            raise websocket.WebSocketTimeoutException('timed out')
+        if message is CLOSE:
+            raise websocket.WebSocketConnectionClosedException('connection closed')
+        return json.dumps(message)
+
+    def close(self):
+        self.closed = True
+
+
+def state(entity_id, value, last_updated='2024-05-01T12:00:00+00:00'):
+    return {'entity_id': entity_id, 'state': str(value), 'last_updated': last_updated}
+
+
+def state_changed(entity_id, value):
+    return {'type': 'event', 'event': {'data': {'entity_id': entity_id, 'new_state': state(entity_id, value)}}}
+
+
+def wait_for(condition, timeout=5):
+    start_time = time.time()
+    while not condition():
+        if time.time() - start_time > timeout:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """
+    The fake connections in the order they are opened, a None entry makes that connection attempt fail.
+    """
+    planned = []
+    opened = []
+
+    def create_connection(url, timeout=None):
+        connection = planned.pop(0) if planned else None
+        if connection is None:
+            raise ConnectionRefusedError('connection refused')
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(websocket, 'create_connection', create_connection)
+    return planned, opened
+
+
+def create_meter(power_calculate=False):
+    return HomeAssistantWebSocket('127.0.0.1', '8123', False, 'token', 'sensor.power', power_calculate,
+                                  'sensor.power_in', 'sensor.power_out')
+
+
+def test_values_from_get_states_and_events(connections):
+    planned, opened = connections
+    planned.append(FakeWebSocket([state('sensor.power', 150), state('sensor.other', 1)]))
+    meter = create_meter()
+    try:
+        wait_for(lambda: meter.is_fresh() and 'sensor.power' in meter.values)
+        assert meter.get_powermeter_watts() == 150
+        opened[0].push(state_changed('sensor.power', -320.5))
+        wait_for(lambda: meter.values['sensor.power'][0] == -320.5)
+        assert meter.get_powermeter_watts() == -320
+        # entities which are not configured are not cached
+        assert 'sensor.other' not in meter.values
+        assert [message['type'] for message in opened[0].sent[:3]] == ['auth', 'subscribe_events', 'get_states']
+    finally:
+        meter.close()
+
+
+def test_input_and_output_from_one_snapshot(connections):
+    planned, opened = connections
+    planned.append(FakeWebSocket([state('sensor.power_in', 500), state('sensor.power_out', 120)]))
+    meter = create_meter(power_calculate=True)
+    try:
+        wait_for(lambda: meter.is_fresh() and len(meter.values) == 2)
+        assert meter.get_powermeter_watts() == 380
+        assert meter.source_timestamp == pytest.approx(1714564800)
+    finally:
+        meter.close()
+
+
+def test_unavailable_state_is_not_kept(connections):
+    planned, opened = connections
+    planned.append(FakeWebSocket([state('sensor.power', 150)]))
+    meter = create_meter()
+    try:
+        wait_for(lambda: 'sensor.power' in meter.values)
+        opened[0].push(state_changed('sensor.power', 'unavailable'))
+        wait_for(lambda: 'sensor.power' not in meter.values)
+        start_time = time.time()
+        with pytest.raises(Exception, match='unavailable'):
+            meter.get_powermeter_watts()
+        assert time.time() - start_time < 1
+    finally:
+        meter.close()
+
+
+def test_unavailable_input_or_output_fails_right_away(connections):
+    planned, opened = connections
+    planned.append(FakeWebSocket([state('sensor.power_in', 500), state('sensor.power_out', 120)]))
+    meter = create_meter(power_calculate=True)
+    try:
+        wait_for(lambda: meter.is_fresh() and len(meter.values) == 2)
+        opened[0].push(state_changed('sensor.power_out', 'unavailable'))
+        wait_for(lambda: 'sensor.power_out' not in meter.values)
+        start_time = time.time()
+        with pytest.raises(Exception, match='sensor.power_out.*unavailable'):
+            meter.get_powermeter_watts()
+        # no waiting for a value which will not come
+        assert time.time() - start_time < 1
+        opened[0].push(state_changed('sensor.power_out', 200))
+        wait_for(lambda: 'sensor.power_out' in meter.values)
+        assert meter.get_powermeter_watts() == 300
+    finally:
+        meter.close()
+
+
+def test_rest_fallback_and_reconnect(connections, monkeypatch):
+    planned, opened = connections
+    # the first attempt fails, the second connection is lost, the third one stays
+    planned.extend([None, FakeWebSocket([state('sensor.power', 100)]), FakeWebSocket([state('sensor.power', 200)])])
+    monkeypatch.setattr(HomeAssistantWebSocket, 'get_json',
+                        lambda self, path: {'state': '42', 'last_updated': '2024-05-01T12:00:00+00:00'})
+    meter = create_meter()
+    try:
+        # not connected yet: the REST API is read
+        assert meter.get_powermeter_watts() == 42
+        wait_for(lambda: meter.is_fresh() and meter.values.get('sensor.power', (None,))[0] == 100, timeout=10)
+        assert meter.get_powermeter_watts() == 100
+        opened[0].push(CLOSE)
+        wait_for(lambda: not meter.connected)
+        assert opened[0].closed
+        assert meter.get_powermeter_watts() == 42
+        wait_for(lambda: meter.is_fresh() and meter.values['sensor.power'][0] == 200, timeout=10)
+        assert meter.get_powermeter_watts() == 200
+        assert len(opened) == 2
+    finally:
+        meter.close()
+
+
+def test_quiet_connection_is_pinged(connections):
+    planned, opened = connections
+    planned.append(FakeWebSocket([state('sensor.power', 150)]))
+    meter = create_meter()
+    try:
+        wait_for(lambda: any(message['type'] == 'ping' for message in opened[0].sent))
+        assert meter.is_fresh()
+    finally:
+        meter.close()
+
+
+def test_failed_authentication_reconnects(connections):
+    planned, opened = connections
+    planned.append(FakeWebSocket([], access_token='other'))
+    meter = create_meter()
+    try:
+        wait_for(lambda: opened and opened[0].closed)
+        assert not meter.is_fresh()
+    finally:
+        meter.close()
+
+
+def test_freshness_by_age():
+    meter = PushPowermeter()
+    assert not meter.is_fresh()
+    meter.connected = True
+    meter.set_value('power', 10)
+    assert meter.is_fresh(max_age=5)
+    meter.last_message_time = time.time() - 10
+    assert not meter.is_fresh(max_age=5)
+    assert meter.is_fresh()
+
+
+def test_get_values_waits_for_missing_keys():
+    meter = PushPowermeter()
+    with pytest.raises(TimeoutError):
+        meter.get_values(['power'], timeout=0.2)
+    meter.set_value('power', 10, 1000.0)
+    assert meter.get_values(['power']) == [(10, 1000.0)]
+    assert meter.source_timestamp == 1000.0
+    meter.clear_value('power')
+    with pytest.raises(Exception, match='unavailable'):
+        meter.get_values(['power'], timeout=5)
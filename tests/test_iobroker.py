@@ -0,0 +1,69 @@
+import pytest
+
+from metering.battery_providers import IoBrokerBatteryState
+from metering.powermeters import IoBroker, IoBrokerClient
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self, status_code, data):
+        self.response = FakeResponse(status_code, data)
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        return self.response
+
+
+@pytest.fixture(autouse=True)
+def clear_instances():
+    IoBrokerClient.instances.clear()
+    yield
+    IoBrokerClient.instances.clear()
+
+
+def item(alias, value, ts=1714564800000):
+    return {'id': alias, 'val': value, 'ts': ts, 'ack': True}
+
+
+def test_meter_and_battery_share_one_get_bulk_request():
+    meter = IoBroker('127.0.0.1', '8087', 'grid', False, '', '')
+    battery = IoBrokerBatteryState('127.0.0.1', '8087', 'soc', 'temperature', 'discharge', 'charge', 1000)
+    session = FakeSession(200, [item('grid', 420), item('soc', 55), item('temperature', 21.5),
+                                item('discharge', 0.3), item('charge', 0)])
+    meter.session = session
+    assert meter.get_powermeter_watts() == 420
+    assert meter.source_timestamp == 1714564800
+    state = battery.get_battery_state()
+    assert (state.soc, state.temperature, state.discharge_watts, state.charge_watts) == (55, 21.5, 300, 0)
+    assert session.urls == ['http://127.0.0.1:8087/getBulk/grid,soc,temperature,discharge,charge']
+
+
+def test_http_error_is_reported():
+    battery = IoBrokerBatteryState('127.0.0.1', '8093', 'soc', 'temperature', 'discharge', 'charge')
+    battery.session = FakeSession(404, None)
+    with pytest.raises(Exception, match='HTTP 404.*simple-api'):
+        battery.get_battery_state()
+
+
+def test_answer_of_another_api_is_reported():
+    battery = IoBrokerBatteryState('127.0.0.1', '8093', 'soc', 'temperature', 'discharge', 'charge')
+    # the REST API adapter answers with a single state
+    battery.session = FakeSession(200, {'val': 55, 'ts': 1714564800000})
+    with pytest.raises(Exception, match='unexpected answer to getBulk'):
+        battery.get_battery_state()
+
+
+def test_missing_datapoint_is_reported():
+    meter = IoBroker('127.0.0.1', '8087', '', True, 'power_in', 'power_out')
+    meter.session = FakeSession(200, [item('power_in', 500), item('power_out', None)])
+    with pytest.raises(Exception, match='no value for power_out'):
+        meter.get_powermeter_watts()
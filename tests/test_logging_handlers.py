@@ -0,0 +1,85 @@
+import json
+import logging
+
+import pytest
+
+from utils.logging_handlers import BatchingLogShipper
+
+
+@pytest.fixture
+def shipped():
+    return []
+
+
+@pytest.fixture
+def shipper(shipped):
+    # the background thread does not ship during a test, the tests call ship() themselves
+    handler = BatchingLogShipper(lambda payload: shipped.append(json.loads(payload)), queue_size=3, interval=3600,
+                                 max_records_per_batch=2)
+    logger = logging.getLogger('test_logging_handlers')
+    logger.propagate = False
+    logger.addHandler(handler)
+    yield handler
+    logger.removeHandler(handler)
+    handler.publish = lambda payload: None
+    handler.close()
+
+
+def log():
+    return logging.getLogger('test_logging_handlers')
+
+
+def test_repeated_messages_are_collapsed(shipper, shipped):
+    log().warning('meter: no answer from %s', '192.168.1.2')
+    log().warning('meter: no answer from %s', '192.168.1.2')
+    log().error('dtu: offline')
+    shipper.ship()
+    records = shipped[0]['records']
+    assert [(record['msg'], record['count']) for record in records] == [
+        ('meter: no answer from 192.168.1.2', 2), ('dtu: offline', 1)]
+    assert shipped[0]['dropped'] == 0
+    # nothing new, nothing to publish
+    shipper.ship()
+    assert len(shipped) == 1
+
+
+def test_record_is_formatted_when_it_is_logged(shipper, shipped):
+    values = [1]
+    log().warning('values %s', values)
+    values.append(2)
+    try:
+        raise ValueError('bad value')
+    except ValueError:
+        log().exception('parse failed')
+    queued = list(shipper.records)
+    assert all(record.args is None and record.exc_info is None for record in queued)
+    shipper.ship()
+    records = shipped[0]['records']
+    assert records[0]['msg'] == 'values [1]'
+    assert records[1]['msg'].startswith('parse failed\nTraceback')
+    assert 'ValueError: bad value' in records[1]['msg']
+
+
+def test_dropped_records_are_counted(shipper, shipped):
+    for i in range(5):
+        log().warning('message %s', i)
+    shipper.ship()
+    # the queue keeps the newest 3, the batch the newest 2
+    assert [record['msg'] for record in shipped[0]['records']] == ['message 3', 'message 4']
+    assert shipped[0]['dropped'] == 3
+    log().warning('message 5')
+    shipper.ship()
+    assert shipped[1]['dropped'] == 0
+
+
+def test_failed_publish_does_not_raise(shipper, shipped):
+    def publish(payload):
+        raise ConnectionError('broker is gone')
+
+    shipper.publish = publish
+    log().warning('lost')
+    shipper.try_ship()
+    shipper.publish = lambda payload: shipped.append(json.loads(payload))
+    log().warning('next')
+    shipper.ship()
+    assert [record['msg'] for record in shipped[0]['records']] == ['next']
@@ -0,0 +1,87 @@
+import json
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from configuration.config_providers import MqttHandler
+
+
+class FakeMessageInfo:
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class FakeClient:
+    """
+    Stand-in for the paho client, publish() fails with MQTT_ERR_NO_CONN while connected is False.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.connected = True
+        self.published = []
+
+    def will_set(self, *args, **kwargs):
+        pass
+
+    def username_pw_set(self, *args):
+        pass
+
+    def connect(self, *args):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, topic):
+        pass
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            return FakeMessageInfo(mqtt.MQTT_ERR_NO_CONN)
+        self.published.append((topic, payload))
+        return FakeMessageInfo(mqtt.MQTT_ERR_SUCCESS)
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(mqtt, 'Client', FakeClient)
+    return MqttHandler('127.0.0.1', 1883, 'test', None, None, 'zeropower', None, state_refresh_interval=0)
+
+
+def test_unchanged_state_is_published_once(handler):
+    handler.publish_state('limit_w', 500)
+    handler.publish_state('limit_w', 500)
+    handler.publish_state('limit_w', 600)
+    assert handler.mqtt_client.published == [('zeropower/state/limit_w', 500), ('zeropower/state/limit_w', 600)]
+
+
+def test_failed_publish_is_repeated(handler):
+    handler.mqtt_client.connected = False
+    handler.publish_state('limit_w', 500)
+    handler.mqtt_client.connected = True
+    handler.publish_state('limit_w', 500)
+    assert handler.mqtt_client.published == [('zeropower/state/limit_w', 500)]
+
+
+def test_everything_is_published_again_after_a_reconnect(handler):
+    handler.publish_state('limit_w', 500)
+    handler.on_connect(handler.mqtt_client, None, None, 0, None)
+    handler.publish_state('limit_w', 500)
+    assert handler.mqtt_client.published.count(('zeropower/state/limit_w', 500)) == 2
+
+
+def test_state_document_of_the_cycle(handler):
+    handler.state_as_json = True
+    handler.publish_state('limit_w', 500)
+    handler.publish_inverter_state(0, 'limit_w', 300)
+    assert handler.mqtt_client.published == []
+    handler.publish_state_document()
+    topic, payload = handler.mqtt_client.published[0]
+    assert topic == 'zeropower/state/json'
+    assert json.loads(payload) == {'limit_w': 500, 'inverter': {'0': {'limit_w': 300}}}
+    # the config update of the next cycle does not publish the document again
+    handler.update()
+    assert [topic for topic, payload in handler.mqtt_client.published].count('zeropower/state/json') == 1
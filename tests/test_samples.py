@@ -0,0 +1,47 @@
+from metering.samples import PowermeterReading, get_compensated_watts, is_new_reading
+
+NOW = 1714564800.0
+
+
+def reading(watts, measured_at, source_timestamp=True):
+    return PowermeterReading(watts, measured_at - 0.5 if source_timestamp else None, measured_at)
+
+
+def test_reading_is_used_once_after_a_limit_change():
+    used = reading(300, NOW - 1)
+    # the poll loop sets a new limit for the reading
+    last_change_time = NOW
+    assert is_new_reading(used, None, last_change_time, 30, NOW)
+    # read again with the same device timestamp shortly after the change
+    assert not is_new_reading(reading(300, NOW - 1), used.source_timestamp, last_change_time, 30, NOW + 2)
+    # a new value of the device
+    assert is_new_reading(reading(250, NOW + 1), used.source_timestamp, last_change_time, 30, NOW + 2)
+    # long after the change a repeated timestamp is a device which keeps it while the value does not change
+    assert is_new_reading(reading(300, NOW - 1), used.source_timestamp, last_change_time, 30, NOW + 31)
+
+
+def test_readings_without_device_timestamp_are_always_new():
+    assert is_new_reading(reading(300, NOW, source_timestamp=False), None, NOW, 30, NOW + 1)
+
+
+def test_reading_before_a_limit_change_is_compensated():
+    history = [(NOW - 60, 500), (NOW - 2, 800)]
+    # measured at a limit of 500 Watt, the production rises by 300 Watt with the new limit
+    assert get_compensated_watts(reading(300, NOW - 3), history) == 0
+    # measured after the change
+    assert get_compensated_watts(reading(300, NOW - 1), history) == 300
+
+
+def test_reading_over_several_limit_changes_is_compensated():
+    history = [(NOW - 60, 500), (NOW - 4, 800), (NOW - 2, 600)]
+    assert get_compensated_watts(reading(300, NOW - 5), history) == 200
+    assert get_compensated_watts(reading(300, NOW - 3), history) == 500
+
+
+def test_readings_which_cannot_be_compensated():
+    history = [(NOW - 60, 500), (NOW - 2, 800)]
+    # no device timestamp: the measuring time is not known
+    assert get_compensated_watts(reading(300, NOW - 3, source_timestamp=False), history) == 300
+    # older than the history
+    assert get_compensated_watts(reading(300, NOW - 120), history) == 300
+    assert get_compensated_watts(reading(300, NOW - 3), []) == 300
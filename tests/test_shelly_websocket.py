@@ -0,0 +1,175 @@
+import hashlib
+import json
+import queue
+import secrets
+import time
+
+import pytest
+import websocket
+
+from metering.powermeters import Shelly3EMPro
+
+CLOSE = object()
+REALM = 'shellypro3em-c8f09e8'
+NONCE = 1714564800
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class FakeShellySocket:
+    """
+    Local stand-in for the RPC WebSocket of a Shelly Pro 3EM: answers EM.GetStatus, with a password only after the
+    digest authentication. NotifyStatus frames are pushed by the test with push().
+    """
+
+    def __init__(self, total_act_power, password=None):
+        self.total_act_power = total_act_power
+        self.password = password
+        self.incoming = queue.Queue()
+        self.sent = []
+        self.closed = False
+
+    def is_authenticated(self, auth):
+        if self.password is None:
+            return True
+        if auth is None or auth['nonce'] != NONCE:
+            return False
+        ha1 = sha256(f"admin:{REALM}:{self.password}")
+        ha2 = sha256('dummy_method:dummy_uri')
+        return auth['response'] == sha256(f"{ha1}:{NONCE}:1:{auth['cnonce']}:auth:{ha2}")
+
+    def send(self, payload):
+        request = json.loads(payload)
+        self.sent.append(request)
+        if not self.is_authenticated(request.get('auth')):
+            challenge = {'auth_type': 'digest', 'nonce': NONCE, 'nc': 1, 'realm': REALM, 'algorithm': 'SHA-256'}
+            self.incoming.put({'id': request['id'], 'src': REALM, 'dst': request['src'],
+                               'error': {'code': 401, 'message': json.dumps(challenge)}})
+            return
+        self.incoming.put({'id': request['id'], 'src': REALM, 'dst': request['src'],
+                           'result': {'id': 0, 'total_act_power': self.total_act_power}})
+
+    def push(self, message):
+        self.incoming.put(message)
+
+    def recv(self):
+        try:
+            message = self.incoming.get(timeout=0.1)
+        except queue.Empty:
+            raise websocket.WebSocketTimeoutException('timed out')
+        if message is CLOSE:
+            raise websocket.WebSocketConnectionClosedException('connection closed')
+        return json.dumps(message)
+
+    def close(self):
+        self.closed = True
+
+
+def notify_status(component, status, ts=1714564801.5):
+    return {'src': REALM, 'dst': 'HoymilesZeroExport', 'method': 'NotifyStatus',
+            'params': {'ts': ts, component: status}}
+
+
+def wait_for(condition, timeout=5):
+    start_time = time.time()
+    while not condition():
+        if time.time() - start_time > timeout:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """
+    The fake connections in the order they are opened, a None entry makes that connection attempt fail.
+    """
+    planned = []
+    opened = []
+
+    def create_connection(url, timeout=None):
+        assert url == 'ws://127.0.0.1/rpc'
+        connection = planned.pop(0) if planned else None
+        if connection is None:
+            raise ConnectionRefusedError('connection refused')
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(websocket, 'create_connection', create_connection)
+    return planned, opened
+
+
+def create_meter(password='secret', use_websocket=True):
+    return Shelly3EMPro('127.0.0.1', 'admin', password, '', use_websocket)
+
+
+def test_digest_response(monkeypatch):
+    monkeypatch.setattr(secrets, 'randbelow', lambda limit: 123456)
+    meter = create_meter(use_websocket=False)
+    auth = meter.build_auth({'auth_type': 'digest', 'nonce': NONCE, 'nc': 1, 'realm': REALM,
+                             'algorithm': 'SHA-256'})
+    ha1 = sha256(f'admin:{REALM}:secret')
+    ha2 = sha256('dummy_method:dummy_uri')
+    assert auth == {'realm': REALM, 'username': 'admin', 'nonce': NONCE, 'cnonce': 123456,
+                    'response': sha256(f'{ha1}:{NONCE}:1:123456:auth:{ha2}'), 'algorithm': 'SHA-256'}
+
+
+def test_authentication_and_notify_status(connections):
+    planned, opened = connections
+    planned.append(FakeShellySocket(150.2, password='secret'))
+    meter = create_meter()
+    try:
+        wait_for(lambda: meter.is_fresh() and meter.power_key in meter.values)
+        assert meter.get_powermeter_watts() == 150
+        # the first request is answered with the challenge, the second one carries the response
+        assert 'auth' not in opened[0].sent[0]
+        assert opened[0].sent[1]['auth']['nonce'] == NONCE
+        opened[0].push(notify_status('em:0', {'id': 0, 'total_act_power': -250.4}))
+        wait_for(lambda: meter.values[meter.power_key][0] == -250.4)
+        assert meter.get_powermeter_watts() == -250
+        assert meter.source_timestamp == pytest.approx(1714564801.5)
+        # status of other components and without the power value is ignored
+        opened[0].push(notify_status('switch:0', {'id': 0, 'total_act_power': 999}))
+        opened[0].push(notify_status('em:0', {'id': 0, 'a_current': 1.2}))
+        opened[0].push(notify_status('em:0', {'id': 0, 'total_act_power': -100}))
+        wait_for(lambda: meter.values[meter.power_key][0] == -100)
+    finally:
+        meter.close()
+
+
+def test_wrong_password_reconnects(connections):
+    planned, opened = connections
+    planned.append(FakeShellySocket(150, password='other'))
+    meter = create_meter()
+    try:
+        wait_for(lambda: opened and opened[0].closed)
+        # one answer to the challenge, no endless retries on the same connection
+        assert len(opened[0].sent) == 2
+        assert not meter.is_fresh()
+    finally:
+        meter.close()
+
+
+def test_http_fallback_and_reconnect(connections, monkeypatch):
+    planned, opened = connections
+    # the first attempt fails, the second connection is lost, the third one stays
+    planned.extend([None, FakeShellySocket(100, password='secret'), FakeShellySocket(200, password='secret')])
+    monkeypatch.setattr(Shelly3EMPro, 'get_rpc_json', lambda self, path: {'id': 0, 'total_act_power': 42})
+    meter = create_meter()
+    try:
+        # not connected yet: the RPC status is polled
+        assert meter.get_powermeter_watts() == 42
+        wait_for(lambda: meter.is_fresh() and meter.values.get(meter.power_key, (None,))[0] == 100, timeout=10)
+        assert meter.get_powermeter_watts() == 100
+        opened[0].push(CLOSE)
+        wait_for(lambda: not meter.connected)
+        assert opened[0].closed
+        assert meter.get_powermeter_watts() == 42
+        wait_for(lambda: meter.is_fresh() and meter.values[meter.power_key][0] == 200, timeout=10)
+        assert meter.get_powermeter_watts() == 200
+        # the response of the last challenge is sent right away on the new connection
+        assert opened[1].sent[0]['auth']['nonce'] == NONCE
+        assert len(opened) == 2
+    finally:
+        meter.close()
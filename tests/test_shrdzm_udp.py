@@ -0,0 +1,76 @@
+import json
+import socket
+import time
+from datetime import datetime
+
+import pytest
+
+from metering.powermeters import ShrdzmUdp
+
+
+def get_free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        udp_socket.bind(('127.0.0.1', 0))
+        return udp_socket.getsockname()[1]
+
+
+def wait_for(condition, timeout=5):
+    start_time = time.time()
+    while not condition():
+        if time.time() - start_time > timeout:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def meter(monkeypatch):
+    monkeypatch.setattr(ShrdzmUdp, 'get_json', lambda self, path: {'1.7.0': '1000', '2.7.0': '0'})
+    meter = ShrdzmUdp('127.0.0.1', 'user', 'password', get_free_udp_port(), max_age=0.5)
+    wait_for(lambda: meter.connected)
+    yield meter
+    meter.close()
+
+
+def send(meter, payload, source_ip='127.0.0.1'):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        udp_socket.bind((source_ip, 0))
+        udp_socket.sendto(payload if isinstance(payload, bytes) else json.dumps(payload).encode(), ('127.0.0.1', meter.udp_port))
+
+
+def test_datagram_top_level_values(meter):
+    send(meter, {'1.7.0': '350', '2.7.0': '20'})
+    wait_for(lambda: 'power' in meter.values)
+    assert meter.get_powermeter_watts() == 330
+
+
+def test_datagram_wrapped_in_data_with_timestamp(meter):
+    send(meter, {'id': 'reader', 'data': {'timestamp': '2024-05-01T12:00:00', '1.7.0': '0', '2.7.0': '410'}})
+    wait_for(lambda: 'power' in meter.values)
+    assert meter.get_powermeter_watts() == -410
+    assert meter.source_timestamp == datetime(2024, 5, 1, 12).timestamp()
+
+
+def test_invalid_and_incomplete_datagrams_are_ignored(meter):
+    send(meter, b'not json')
+    send(meter, {'1.7.0': '350'})
+    send(meter, {'1.7.0': '100', '2.7.0': '0'})
+    wait_for(lambda: 'power' in meter.values)
+    assert meter.get_powermeter_watts() == 100
+
+
+def test_datagrams_of_other_senders_are_ignored(meter):
+    send(meter, {'1.7.0': '999', '2.7.0': '0'}, source_ip='127.0.0.2')
+    send(meter, {'1.7.0': '100', '2.7.0': '0'})
+    wait_for(lambda: 'power' in meter.values)
+    assert meter.get_powermeter_watts() == 100
+
+
+def test_http_fallback_while_no_datagrams_arrive(meter):
+    # nothing received yet
+    assert meter.get_powermeter_watts() == 1000
+    send(meter, {'1.7.0': '100', '2.7.0': '0'})
+    wait_for(lambda: 'power' in meter.values)
+    assert meter.get_powermeter_watts() == 100
+    # the last datagram is older than max_age
+    time.sleep(0.6)
+    assert meter.get_powermeter_watts() == 1000
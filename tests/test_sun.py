@@ -0,0 +1,77 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from utils.sun import get_seconds_until_daylight, get_sun_times, get_wait_interval
+
+BERLIN = (52.52, 13.405)
+GREENWICH = (51.4769, 0.0)
+SYDNEY = (-33.87, 151.21)
+TROMSO = (69.65, 18.96)
+MCMURDO = (-77.85, 166.67)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def assert_close(actual, expected, minutes=3):
+    assert abs(actual - expected) <= timedelta(minutes=minutes), f'{actual} is not {expected}'
+
+
+# published sunrise and sunset times, converted to UTC
+@pytest.mark.parametrize('location, day, sunrise, sunset', [
+    # summer solstice, 04:43 / 21:33 CEST
+    (BERLIN, date(2024, 6, 21), utc(2024, 6, 21, 2, 43), utc(2024, 6, 21, 19, 33)),
+    # equinox at the prime meridian
+    (GREENWICH, date(2024, 3, 20), utc(2024, 3, 20, 6, 3), utc(2024, 3, 20, 18, 13)),
+    # southern summer east of Greenwich, 05:41 / 20:05 AEDT: the sunrise is on the previous UTC day
+    (SYDNEY, date(2024, 12, 21), utc(2024, 12, 20, 18, 41), utc(2024, 12, 21, 9, 5)),
+])
+def test_sun_times_of_known_dates(location, day, sunrise, sunset):
+    actual_sunrise, actual_sunset = get_sun_times(*location, day)
+    assert_close(actual_sunrise, sunrise)
+    assert_close(actual_sunset, sunset)
+
+
+def test_polar_day_and_night():
+    # midnight sun: the whole day
+    assert get_sun_times(*TROMSO, date(2024, 6, 21)) == (utc(2024, 6, 21), utc(2024, 6, 22))
+    assert get_sun_times(*TROMSO, date(2024, 12, 21)) is None
+    # the seasons are the other way round in the south
+    assert get_sun_times(*MCMURDO, date(2024, 6, 21)) is None
+    assert get_seconds_until_daylight(*TROMSO, 30, utc(2024, 6, 21, 23, 0)) == 0
+    assert get_seconds_until_daylight(*TROMSO, 30, utc(2024, 12, 21, 12, 0)) is None
+
+
+def test_seconds_until_daylight():
+    # 02:43 UTC sunrise, the day starts 30 minutes earlier
+    assert get_seconds_until_daylight(*BERLIN, 30, utc(2024, 6, 21, 1, 0)) == pytest.approx(73 * 60, abs=180)
+    assert get_seconds_until_daylight(*BERLIN, 30, utc(2024, 6, 21, 2, 30)) == 0
+    assert get_seconds_until_daylight(*BERLIN, 30, utc(2024, 6, 21, 19, 50)) == 0
+    # after sunset + margin the next sunrise is on the next day
+    assert get_seconds_until_daylight(*BERLIN, 30, utc(2024, 6, 21, 21, 0)) == pytest.approx(312 * 60, abs=180)
+    # Sydney at 18:00 UTC is early morning of the next local day
+    assert get_seconds_until_daylight(*SYDNEY, 0, utc(2024, 12, 20, 18, 0)) == pytest.approx(41 * 60, abs=180)
+
+
+def test_backoff_only_without_available_inverter():
+    idle_count = 0
+    intervals = []
+    for _ in range(6):
+        interval, idle_count = get_wait_interval(False, idle_count, 10, 60, 900)
+        intervals.append(interval)
+    assert intervals == [10, 20, 40, 60, 60, 60]
+    # an available inverter (e.g. only the battery voltage is too low) waits the loop interval and ends the backoff
+    assert get_wait_interval(True, idle_count, 10, 60, 900) == (10, 0)
+    # also at night
+    assert get_wait_interval(True, idle_count, 10, 60, 900, seconds_until_daylight=3600) == (10, 0)
+
+
+def test_night_probe_interval():
+    assert get_wait_interval(False, 3, 10, 60, 900, seconds_until_daylight=3600) == (900, 0)
+    # wakes up at daylight, but not earlier than the loop interval
+    assert get_wait_interval(False, 0, 10, 60, 900, seconds_until_daylight=300.5) == (300, 0)
+    assert get_wait_interval(False, 0, 10, 60, 900, seconds_until_daylight=2) == (10, 0)
+    # polar night
+    assert get_wait_interval(False, 0, 10, 60, 900, seconds_until_daylight=None) == (900, 0)
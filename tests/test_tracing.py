@@ -0,0 +1,44 @@
+import json
+import os
+import time
+
+from monitoring.tracing import SpanRecorder
+
+
+def run_cycles(recorder, count):
+    for _ in range(count):
+        recorder.next_cycle()
+        with recorder.span('work'):
+            pass
+    recorder.next_cycle()
+
+
+def test_spans_are_written_per_cycle(tmp_path):
+    path = str(tmp_path / 'spans.jsonl')
+    recorder = SpanRecorder(path)
+    run_cycles(recorder, 2)
+    records = [json.loads(line) for line in open(path)]
+    assert [record['cycle'] for record in records] == [1, 2]
+    assert records[0]['spans'][0][0] == 'work'
+
+
+def test_spans_file_is_rotated(tmp_path):
+    path = str(tmp_path / 'spans.jsonl')
+    recorder = SpanRecorder(path, max_bytes=200)
+    run_cycles(recorder, 10)
+    assert os.path.getsize(path) < 200
+    assert os.path.getsize(path + '.1') >= 200
+    assert not os.path.exists(path + '.2')
+    cycles = [json.loads(line)['cycle'] for name in (path + '.1', path) for line in open(name)]
+    # nothing got lost with the last rotation
+    assert cycles == sorted(cycles) and cycles[-1] == 10
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    profile_dir = str(tmp_path / 'profiles')
+    recorder = SpanRecorder(str(tmp_path / 'spans.jsonl'), 1, profile_dir, profile_keep_count=3)
+    for _ in range(6):
+        recorder.next_cycle()
+        # the profiles are ordered by their modification time
+        time.sleep(0.01)
+    assert sorted(os.listdir(profile_dir)) == ['cycle-3.prof', 'cycle-4.prof', 'cycle-5.prof']
@@ -0,0 +1,67 @@
+import json
+import socket
+import time
+import urllib.request
+
+from metering.powermeters import VZLogger, VZLoggerPushReceiver
+
+
+def get_free_tcp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+        tcp_socket.bind(('127.0.0.1', 0))
+        return tcp_socket.getsockname()[1]
+
+
+def push(port, uuid, tuples):
+    payload = json.dumps({'data': [{'uuid': uuid, 'tuples': tuples}]}).encode()
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/', payload, {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status
+
+
+def test_newest_pushed_reading_is_used():
+    port = get_free_tcp_port()
+    meter = VZLogger('127.0.0.1', '8080', 'grid', port)
+    try:
+        now_in_ms = time.time() * 1000
+        assert push(port, 'grid', [[now_in_ms, 250], [now_in_ms - 1000, 100]]) == 200
+        assert meter.get_powermeter_watts() == 250
+        assert meter.source_timestamp == now_in_ms / 1000
+    finally:
+        meter.close()
+
+
+def test_buffer_is_ordered_and_bounded():
+    port = get_free_tcp_port()
+    receiver = VZLoggerPushReceiver.get_instance(port)
+    receiver.buffer_size = 3
+    try:
+        receiver.handle_push({'data': [{'uuid': 'grid', 'tuples': [[3000, 30], [1000, 10]]}]})
+        # repeated tuple of the last push with a corrected value, and a late one
+        receiver.handle_push({'data': [{'uuid': 'grid', 'tuples': [[3000, 31], [2000, 20]]}]})
+        assert receiver.readings['grid'] == [(1.0, 10), (2.0, 20), (3.0, 31)]
+        receiver.handle_push({'data': [{'uuid': 'grid', 'tuples': [[5000, 50], [4000, 40]]}]})
+        assert receiver.readings['grid'] == [(3.0, 31), (4.0, 40), (5.0, 50)]
+        assert receiver.get_latest('grid') == (5.0, 50)
+        assert receiver.get_latest('other') is None
+    finally:
+        receiver.close()
+
+
+def test_receiver_is_shared_and_stopped_with_the_last_meter():
+    port = get_free_tcp_port()
+    grid_meter = VZLogger('127.0.0.1', '8080', 'grid', port)
+    # e.g. the new meter after a change of the config file, created before the old one is closed
+    other_meter = VZLogger('127.0.0.1', '8080', 'grid', port)
+    receiver = grid_meter.push_receiver
+    assert other_meter.push_receiver is receiver
+    grid_meter.close()
+    assert VZLoggerPushReceiver.instances[port] is receiver
+    assert push(port, 'grid', [[time.time() * 1000, 50]]) == 200
+    assert other_meter.get_powermeter_watts() == 50
+    other_meter.close()
+    assert port not in VZLoggerPushReceiver.instances
+    # the port is free again. Like the HTTP server, ignore the connections of the push in TIME_WAIT
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+        tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp_socket.bind(('', port))
@@ -0,0 +1,104 @@
+"""
+This module contains a circuit breaker for the HTTP requests to the devices. After a number of consecutive
+failures the circuit of a device opens and requests to it fail immediately instead of waiting for connect timeouts
+and retries. After a backoff time one probe request is let through (half-open), if it succeeds the circuit closes
+again, otherwise the backoff time is doubled.
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+from requests import ConnectionError
+from requests.adapters import HTTPAdapter
+
+from utils.helper_functions import logger
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 10, max_reset_timeout: float = 300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.current_reset_timeout = reset_timeout
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.current_reset_timeout - time.time()
+            if self.state == self.OPEN and remaining <= 0:
+                # let exactly one probe request through, all others keep failing fast until it returns
+                self.state = self.HALF_OPEN
+                logger.info('circuit breaker %s: half-open, probing', self.name)
+                return
+            raise CircuitOpenError(f'circuit breaker {self.name} is {self.state}, next probe in {max(remaining, 0):.0f} s')
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info('circuit breaker %s: closed, device reachable again', self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self.current_reset_timeout = self.reset_timeout
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.current_reset_timeout = min(self.current_reset_timeout * 2, self.max_reset_timeout)
+            elif self.state == self.OPEN or self.failures < self.failure_threshold:
+                return
+            self.state = self.OPEN
+            self.opened_at = time.time()
+            logger.warning('circuit breaker %s: open after %s failures, next probe in %.0f s',
+                           self.name, self.failures, self.current_reset_timeout)
+
+
+class CircuitBreakerAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which keeps one circuit breaker per host and port, so an unreachable device does not slow down
+    the requests to the other devices.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 10, max_reset_timeout: float = 300, **kwargs):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.breakers = {}
+        self.breakers_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def get_breaker(self, url):
+        endpoint = urlsplit(url).netloc
+        with self.breakers_lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout,
+                                                         self.max_reset_timeout)
+            return self.breakers[endpoint]
+
+    def send(self, request, **kwargs):
+        breaker = self.get_breaker(request.url)
+        breaker.before_request()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            # besides connection errors and timeouts e.g. a RetryError after the retries of the status codes ran out,
+            # a half-open probe must always be settled
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return response
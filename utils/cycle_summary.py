@@ -0,0 +1,36 @@
+"""
+This module contains the cycle summary logging (LOG_MODE = summary). The routine messages of a control cycle are not
+logged one by one, instead the facts of a cycle are collected and logged as one summary record at its end. Changes
+of limits and power states, warnings and errors are still logged immediately.
+"""
+
+import logging
+
+# pass as extra= to mark a message as a change, which is logged in summary mode as well
+CHANGE = {'change': True}
+
+
+class RoutineMessageFilter(logging.Filter):
+    """
+    Drops all INFO and DEBUG records which are not marked as change. The records are dropped before they are
+    formatted, so their formatting costs nothing.
+    """
+
+    def filter(self, record):
+        return record.levelno > logging.INFO or getattr(record, 'change', False)
+
+
+class CycleSummary:
+    def __init__(self):
+        self.facts = {}
+
+    def add(self, key: str, value):
+        self.facts[key] = value
+
+    def log(self, logger: logging.Logger):
+        if not self.facts:
+            return
+        facts, self.facts = self.facts, {}
+        args = [item for fact in facts.items() for item in fact]
+        # the facts are also attached to the record, so handlers can ship them as structured data
+        logger.info('cycle: ' + ', '.join(['%s=%s'] * len(facts)), *args, extra={'change': True, 'cycle_summary': facts})
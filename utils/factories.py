@@ -1,6 +1,463 @@
+"""
+The Factory creates the powermeters, the DTU and the battery state provider selected in the config.
+Every driver is registered with its selection key and a builder function. The builders import their driver
+only when it is selected, so the dependencies of unused drivers (e.g. paho-mqtt, websockets) are never loaded.
+"""
+
+from typing import TYPE_CHECKING
+
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
 from GLOBALS import *
-from metering.powermeters import *
-from control.dtus import *
+from utils.circuit_breaker import CircuitBreakerAdapter
+from utils.http_clients import HttpClient
+
+if TYPE_CHECKING:
+    from control.dtus import DTU
+    from metering.battery_providers import BatteryStateProvider
+    from metering.base import Powermeter
+
+
+def get_shelly_config(section: str, suffix: str = ''):
+    return (
+        config.get(section, 'SHELLY_IP' + suffix),
+        config.get(section, 'SHELLY_USER' + suffix),
+        config.get(section, 'SHELLY_PASS' + suffix),
+        config.get(section, 'EMETER_INDEX')
+    )
+
+
+def build_shelly_em():
+    from metering.powermeters import ShellyEM
+    return ShellyEM(*get_shelly_config('SHELLY'))
+
+
+def build_shelly_3em():
+    from metering.powermeters import Shelly3EM
+    return Shelly3EM(*get_shelly_config('SHELLY'))
+
+
+def build_shelly_3em_pro():
+    from metering.powermeters import Shelly3EMPro
+    return Shelly3EMPro(
+        *get_shelly_config('SHELLY'),
+        config.getboolean('SHELLY', 'SHELLY_USE_WEBSOCKET', fallback=False)
+    )
+
+
+def build_tasmota():
+    from metering.powermeters import Tasmota
+    return Tasmota(
+        config.get('TASMOTA', 'TASMOTA_IP'),
+        config.get('TASMOTA', 'TASMOTA_USER'),
+        config.get('TASMOTA', 'TASMOTA_PASS'),
+        config.get('TASMOTA', 'TASMOTA_JSON_STATUS'),
+        config.get('TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX'),
+        config.get('TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL'),
+        config.get('TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL'),
+        config.get('TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL'),
+        config.getboolean('TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE', fallback=False)
+    )
+
+
+def build_esphome():
+    from metering.powermeters import ESPHome, ESPHomeEvents
+    if config.getboolean('ESPHOME', 'ESPHOME_USE_EVENTS', fallback=False):
+        esphome_class = ESPHomeEvents
+    else:
+        esphome_class = ESPHome
+    return esphome_class(
+        config.get('ESPHOME', 'ESPHOME_IP'),
+        config.get('ESPHOME', 'ESPHOME_PORT', fallback='80'),
+        config.get('ESPHOME', 'ESPHOME_DOMAIN'),
+        config.get('ESPHOME', 'ESPHOME_ID')
+    )
+
+
+def build_shrdzm():
+    from metering.powermeters import Shrdzm, ShrdzmUdp
+    if config.get('SHRDZM', 'SHRDZM_UDP_PORT', fallback=''):
+        return ShrdzmUdp(
+            config.get('SHRDZM', 'SHRDZM_IP'),
+            config.get('SHRDZM', 'SHRDZM_USER'),
+            config.get('SHRDZM', 'SHRDZM_PASS'),
+            config.getint('SHRDZM', 'SHRDZM_UDP_PORT')
+        )
+    return Shrdzm(
+        config.get('SHRDZM', 'SHRDZM_IP'),
+        config.get('SHRDZM', 'SHRDZM_USER'),
+        config.get('SHRDZM', 'SHRDZM_PASS')
+    )
+
+
+def build_emlog():
+    from metering.powermeters import Emlog
+    return Emlog(
+        config.get('EMLOG', 'EMLOG_IP'),
+        config.get('EMLOG', 'EMLOG_METERINDEX'),
+        config.getboolean('EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback=False)
+    )
+
+
+def build_iobroker():
+    from metering.powermeters import IoBroker
+    return IoBroker(
+        config.get('IOBROKER', 'IOBROKER_IP'),
+        config.get('IOBROKER', 'IOBROKER_PORT'),
+        config.get('IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS'),
+        config.getboolean('IOBROKER', 'IOBROKER_POWER_CALCULATE'),
+        config.get('IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS'),
+        config.get('IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS')
+    )
+
+
+def build_homeassistant():
+    from metering.powermeters import HomeAssistant, HomeAssistantWebSocket
+    if config.getboolean('HOMEASSISTANT', 'HA_USE_WEBSOCKET', fallback=False):
+        homeassistant_class = HomeAssistantWebSocket
+    else:
+        homeassistant_class = HomeAssistant
+    return homeassistant_class(
+        config.get('HOMEASSISTANT', 'HA_IP'),
+        config.get('HOMEASSISTANT', 'HA_PORT'),
+        config.getboolean('HOMEASSISTANT', 'HA_HTTPS', fallback=False),
+        config.get('HOMEASSISTANT', 'HA_ACCESSTOKEN'),
+        config.get('HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY'),
+        config.getboolean('HOMEASSISTANT', 'HA_POWER_CALCULATE'),
+        config.get('HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS'),
+        config.get('HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS')
+    )
+
+
+def build_vzlogger():
+    from metering.powermeters import VZLogger
+    return VZLogger(
+        config.get('VZLOGGER', 'VZL_IP'),
+        config.get('VZLOGGER', 'VZL_PORT'),
+        config.get('VZLOGGER', 'VZL_UUID'),
+        config.getint('VZLOGGER', 'VZL_PUSH_PORT', fallback=None)
+    )
+
+
+def build_script():
+    from metering.powermeters import Script
+    return Script(
+        config.get('SCRIPT', 'SCRIPT_FILE'),
+        config.get('SCRIPT', 'SCRIPT_IP'),
+        config.get('SCRIPT', 'SCRIPT_USER'),
+        config.get('SCRIPT', 'SCRIPT_PASS')
+    )
+
+
+def build_amis_reader():
+    from metering.powermeters import AmisReader
+    return AmisReader(
+        config.get('AMIS_READER', 'AMIS_READER_IP')
+    )
+
+
+def build_mqtt():
+    from metering.powermeters import MqttPowermeter
+    return MqttPowermeter(
+        config.get('MQTT_POWERMETER', 'MQTT_BROKER', fallback=config.get("MQTT_CONFIG", "MQTT_BROKER", fallback=None)),
+        config.getint('MQTT_POWERMETER', 'MQTT_PORT', fallback=config.getint("MQTT_CONFIG", "MQTT_PORT", fallback=1883)),
+        config.get('MQTT_POWERMETER', 'MQTT_TOPIC_INCOMING'),
+        config.get('MQTT_POWERMETER', 'MQTT_JSON_PATH_INCOMING', fallback=None),
+        config.get('MQTT_POWERMETER', 'MQTT_TOPIC_OUTGOING', fallback=None),
+        config.get('MQTT_POWERMETER', 'MQTT_JSON_PATH_OUTGOING', fallback=None),
+        config.get('MQTT_POWERMETER', 'MQTT_USERNAME', fallback=config.get('MQTT_CONFIG', 'MQTT_USERNAME', fallback=None)),
+        config.get('MQTT_POWERMETER', 'MQTT_PASSWORD', fallback=config.get('MQTT_CONFIG', 'MQTT_PASSWORD', fallback=None))
+    )
+
+
+def build_debug_reader():
+    from metering.powermeters import DebugReader
+    return DebugReader()
+
+
+# selection key in [SELECT_POWERMETER] -> builder, the first selected driver is used
+POWERMETER_BUILDERS = {
+    'USE_SHELLY_EM': build_shelly_em,
+    'USE_SHELLY_3EM': build_shelly_3em,
+    'USE_SHELLY_3EM_PRO': build_shelly_3em_pro,
+    'USE_TASMOTA': build_tasmota,
+    'USE_ESPHOME': build_esphome,
+    'USE_SHRDZM': build_shrdzm,
+    'USE_EMLOG': build_emlog,
+    'USE_IOBROKER': build_iobroker,
+    'USE_HOMEASSISTANT': build_homeassistant,
+    'USE_VZLOGGER': build_vzlogger,
+    'USE_SCRIPT': build_script,
+    'USE_AMIS_READER': build_amis_reader,
+    'USE_MQTT': build_mqtt,
+    'USE_DEBUG_READER': build_debug_reader,
+}
+
+
+def build_tasmota_intermediate():
+    from metering.powermeters import Tasmota
+    return Tasmota(
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_USER_INTERMEDIATE'),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_PASS_INTERMEDIATE'),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_STATUS_INTERMEDIATE'),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE'),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE'),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE', fallback=None),
+        config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE', fallback=None),
+        config.getboolean('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE', fallback=False)
+    )
+
+
+def build_shelly_em_intermediate():
+    from metering.powermeters import ShellyEM
+    return ShellyEM(*get_shelly_config('INTERMEDIATE_SHELLY', '_INTERMEDIATE'))
+
+
+def build_shelly_3em_intermediate():
+    from metering.powermeters import Shelly3EM
+    return Shelly3EM(*get_shelly_config('INTERMEDIATE_SHELLY', '_INTERMEDIATE'))
+
+
+def build_shelly_3em_pro_intermediate():
+    from metering.powermeters import Shelly3EMPro
+    return Shelly3EMPro(
+        *get_shelly_config('INTERMEDIATE_SHELLY', '_INTERMEDIATE'),
+        config.getboolean('INTERMEDIATE_SHELLY', 'SHELLY_USE_WEBSOCKET_INTERMEDIATE', fallback=False)
+    )
+
+
+def build_shelly_1pm_intermediate():
+    from metering.powermeters import Shelly1PM
+    return Shelly1PM(*get_shelly_config('INTERMEDIATE_SHELLY', '_INTERMEDIATE'))
+
+
+def build_shelly_plus_1pm_intermediate():
+    from metering.powermeters import ShellyPlus1PM
+    return ShellyPlus1PM(
+        *get_shelly_config('INTERMEDIATE_SHELLY', '_INTERMEDIATE'),
+        config.getboolean('INTERMEDIATE_SHELLY', 'SHELLY_USE_WEBSOCKET_INTERMEDIATE', fallback=False)
+    )
+
+
+def build_esphome_intermediate():
+    from metering.powermeters import ESPHome, ESPHomeEvents
+    if config.getboolean('INTERMEDIATE_ESPHOME', 'ESPHOME_USE_EVENTS_INTERMEDIATE', fallback=False):
+        esphome_class = ESPHomeEvents
+    else:
+        esphome_class = ESPHome
+    return esphome_class(
+        config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_PORT_INTERMEDIATE', fallback='80'),
+        config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_DOMAIN_INTERMEDIATE'),
+        config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_ID_INTERMEDIATE')
+    )
+
+
+def build_shrdzm_intermediate():
+    from metering.powermeters import Shrdzm, ShrdzmUdp
+    if config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_UDP_PORT_INTERMEDIATE', fallback=''):
+        return ShrdzmUdp(
+            config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_IP_INTERMEDIATE'),
+            config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_USER_INTERMEDIATE'),
+            config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_PASS_INTERMEDIATE'),
+            config.getint('INTERMEDIATE_SHRDZM', 'SHRDZM_UDP_PORT_INTERMEDIATE')
+        )
+    return Shrdzm(
+        config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_USER_INTERMEDIATE'),
+        config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_PASS_INTERMEDIATE')
+    )
+
+
+def build_emlog_intermediate():
+    from metering.powermeters import Emlog
+    return Emlog(
+        config.get('INTERMEDIATE_EMLOG', 'EMLOG_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_EMLOG', 'EMLOG_METERINDEX_INTERMEDIATE'),
+        config.getboolean('INTERMEDIATE_EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback=False)
+    )
+
+
+def build_iobroker_intermediate():
+    from metering.powermeters import IoBroker
+    return IoBroker(
+        config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_PORT_INTERMEDIATE'),
+        config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE'),
+        config.getboolean('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_CALCULATE', fallback=False),
+        config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE', fallback=None),
+        config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback=None)
+    )
+
+
+def build_homeassistant_intermediate():
+    from metering.powermeters import HomeAssistant, HomeAssistantWebSocket
+    if config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_USE_WEBSOCKET_INTERMEDIATE', fallback=False):
+        homeassistant_class = HomeAssistantWebSocket
+    else:
+        homeassistant_class = HomeAssistant
+    return homeassistant_class(
+        config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_PORT_INTERMEDIATE'),
+        config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_HTTPS_INTERMEDIATE', fallback=False),
+        config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_ACCESSTOKEN_INTERMEDIATE'),
+        config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY_INTERMEDIATE'),
+        config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_CALCULATE_INTERMEDIATE', fallback=False),
+        config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS_INTERMEDIATE', fallback=None),
+        config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback=None)
+    )
+
+
+def build_vzlogger_intermediate():
+    from metering.powermeters import VZLogger
+    return VZLogger(
+        config.get('INTERMEDIATE_VZLOGGER', 'VZL_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_VZLOGGER', 'VZL_PORT_INTERMEDIATE'),
+        config.get('INTERMEDIATE_VZLOGGER', 'VZL_UUID_INTERMEDIATE'),
+        config.getint('INTERMEDIATE_VZLOGGER', 'VZL_PUSH_PORT_INTERMEDIATE', fallback=None)
+    )
+
+
+def build_script_intermediate():
+    from metering.powermeters import Script
+    return Script(
+        config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_FILE_INTERMEDIATE'),
+        config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_IP_INTERMEDIATE'),
+        config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_USER_INTERMEDIATE'),
+        config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_PASS_INTERMEDIATE')
+    )
+
+
+def build_mqtt_intermediate():
+    from metering.powermeters import MqttPowermeter
+    return MqttPowermeter(
+        config.get('INTERMEDIATE_MQTT', 'MQTT_BROKER', fallback=config.get("MQTT_CONFIG", "MQTT_BROKER", fallback=None)),
+        config.getint('INTERMEDIATE_MQTT', 'MQTT_PORT', fallback=config.getint("MQTT_CONFIG", "MQTT_PORT", fallback=1883)),
+        config.get('INTERMEDIATE_MQTT', 'MQTT_TOPIC_INCOMING'),
+        config.get('INTERMEDIATE_MQTT', 'MQTT_JSON_PATH_INCOMING', fallback=None),
+        config.get('INTERMEDIATE_MQTT', 'MQTT_TOPIC_OUTGOING', fallback=None),
+        config.get('INTERMEDIATE_MQTT', 'MQTT_JSON_PATH_OUTGOING', fallback=None),
+        config.get('INTERMEDIATE_MQTT', 'MQTT_USERNAME', fallback=config.get("MQTT_CONFIG", "MQTT_USERNAME", fallback=None)),
+        config.get('INTERMEDIATE_MQTT', 'MQTT_PASSWORD', fallback=config.get("MQTT_CONFIG", "MQTT_PASSWORD", fallback=None))
+    )
+
+
+def build_amis_reader_intermediate():
+    from metering.powermeters import AmisReader
+    return AmisReader(
+        config.get('INTERMEDIATE_AMIS_READER', 'AMIS_READER_IP_INTERMEDIATE')
+    )
+
+
+def build_debug_reader_intermediate():
+    from metering.powermeters import DebugReader
+    return DebugReader()
+
+
+# selection key in [SELECT_INTERMEDIATE_METER] -> builder, the first selected driver is used
+INTERMEDIATE_POWERMETER_BUILDERS = {
+    'USE_TASMOTA_INTERMEDIATE': build_tasmota_intermediate,
+    'USE_SHELLY_EM_INTERMEDIATE': build_shelly_em_intermediate,
+    'USE_SHELLY_3EM_INTERMEDIATE': build_shelly_3em_intermediate,
+    'USE_SHELLY_3EM_PRO_INTERMEDIATE': build_shelly_3em_pro_intermediate,
+    'USE_SHELLY_1PM_INTERMEDIATE': build_shelly_1pm_intermediate,
+    'USE_SHELLY_PLUS_1PM_INTERMEDIATE': build_shelly_plus_1pm_intermediate,
+    'USE_ESPHOME_INTERMEDIATE': build_esphome_intermediate,
+    'USE_SHRDZM_INTERMEDIATE': build_shrdzm_intermediate,
+    'USE_EMLOG_INTERMEDIATE': build_emlog_intermediate,
+    'USE_IOBROKER_INTERMEDIATE': build_iobroker_intermediate,
+    'USE_HOMEASSISTANT_INTERMEDIATE': build_homeassistant_intermediate,
+    'USE_VZLOGGER_INTERMEDIATE': build_vzlogger_intermediate,
+    'USE_SCRIPT_INTERMEDIATE': build_script_intermediate,
+    'USE_MQTT_INTERMEDIATE': build_mqtt_intermediate,
+    'USE_AMIS_READER_INTERMEDIATE': build_amis_reader_intermediate,
+    'USE_DEBUG_READER_INTERMEDIATE': build_debug_reader_intermediate,
+}
+
+
+def build_ahoy():
+    from control.dtus import AhoyDTU
+    return AhoyDTU(
+        config.getint('COMMON', 'INVERTER_COUNT'),
+        config.get('AHOY_DTU', 'AHOY_IP'),
+        config.get('AHOY_DTU', 'AHOY_PASS', fallback='')
+    )
+
+
+def build_opendtu():
+    from control.dtus import OpenDTU
+    return OpenDTU(
+        config.getint('COMMON', 'INVERTER_COUNT'),
+        config.get('OPEN_DTU', 'OPENDTU_IP'),
+        config.get('OPEN_DTU', 'OPENDTU_USER'),
+        config.get('OPEN_DTU', 'OPENDTU_PASS')
+    )
+
+
+def build_debug():
+    from control.dtus import DebugDTU
+    return DebugDTU(
+        config.getint('COMMON', 'INVERTER_COUNT')
+    )
+
+
+# selection key in [SELECT_DTU] -> builder, the first selected driver is used
+DTU_BUILDERS = {
+    'USE_AHOY': build_ahoy,
+    'USE_OPENDTU': build_opendtu,
+    'USE_DEBUG': build_debug,
+}
+
+
+def build_iobroker_battery():
+    from metering.battery_providers import IoBrokerBatteryState
+    return IoBrokerBatteryState(
+        config.get('IOBROKER_BATTERY', 'IOBROKER_BATTERY_IP'),
+        config.get('IOBROKER_BATTERY', 'IOBROKER_BATTERY_PORT'),
+        config.get('IOBROKER_BATTERY', 'IOBROKER_BATTERY_SOC_ALIAS'),
+        config.get('IOBROKER_BATTERY', 'IOBROKER_BATTERY_TEMPERATURE_ALIAS'),
+        config.get('IOBROKER_BATTERY', 'IOBROKER_BATTERY_DISCHARGE_POWER_ALIAS'),
+        config.get('IOBROKER_BATTERY', 'IOBROKER_BATTERY_CHARGE_POWER_ALIAS'),
+        config.getfloat('IOBROKER_BATTERY', 'IOBROKER_BATTERY_POWER_FACTOR', fallback=1.0),
+        config.getint('SELECT_BATTERY_STATE', 'BATTERY_STATE_REFRESH_INTERVAL_IN_SECONDS', fallback=30),
+        config.getint('SELECT_BATTERY_STATE', 'BATTERY_STATE_MAX_AGE_IN_SECONDS', fallback=300)
+    )
+
+
+def build_mqtt_battery():
+    from metering.battery_providers import MqttBatteryState
+    keys = ['soc', 'temperature', 'discharge_power', 'charge_power']
+    return MqttBatteryState(
+        config.get('MQTT_BATTERY', 'MQTT_BROKER', fallback=config.get("MQTT_CONFIG", "MQTT_BROKER", fallback=None)),
+        config.getint('MQTT_BATTERY', 'MQTT_PORT', fallback=config.getint("MQTT_CONFIG", "MQTT_PORT", fallback=1883)),
+        {key: config.get('MQTT_BATTERY', f'MQTT_TOPIC_{key.upper()}') for key in keys},
+        {key: config.get('MQTT_BATTERY', f'MQTT_JSON_PATH_{key.upper()}', fallback=None) for key in keys},
+        config.get('MQTT_BATTERY', 'MQTT_USERNAME', fallback=config.get('MQTT_CONFIG', 'MQTT_USERNAME', fallback=None)),
+        config.get('MQTT_BATTERY', 'MQTT_PASSWORD', fallback=config.get('MQTT_CONFIG', 'MQTT_PASSWORD', fallback=None)),
+        config.getfloat('MQTT_BATTERY', 'MQTT_POWER_FACTOR', fallback=1.0),
+        config.getint('SELECT_BATTERY_STATE', 'BATTERY_STATE_MAX_AGE_IN_SECONDS', fallback=300)
+    )
+
+
+# selection key in [SELECT_BATTERY_STATE] -> builder, the first selected driver is used
+BATTERY_STATE_BUILDERS = {
+    'USE_IOBROKER_BATTERY': build_iobroker_battery,
+    'USE_MQTT_BATTERY': build_mqtt_battery,
+}
+
+
+# config sections of every driver, a change of one of them rebuilds that driver when the config file is reloaded
+DRIVER_SECTIONS = {
+    'dtu': ('SELECT_DTU', 'AHOY_DTU', 'OPEN_DTU'),
+    'powermeter': ('SELECT_POWERMETER', 'TASMOTA', 'SHELLY', 'ESPHOME', 'SHRDZM', 'EMLOG', 'IOBROKER', 'HOMEASSISTANT',
+                   'VZLOGGER', 'SCRIPT', 'AMIS_READER', 'MQTT_POWERMETER'),
+    'intermediate meter': ('SELECT_INTERMEDIATE_METER', 'INTERMEDIATE_TASMOTA', 'INTERMEDIATE_SHELLY', 'INTERMEDIATE_ESPHOME',
+                           'INTERMEDIATE_SHRDZM', 'INTERMEDIATE_EMLOG', 'INTERMEDIATE_IOBROKER', 'INTERMEDIATE_HOMEASSISTANT',
+                           'INTERMEDIATE_VZLOGGER', 'INTERMEDIATE_SCRIPT', 'INTERMEDIATE_AMIS_READER', 'INTERMEDIATE_MQTT'),
+    'battery': ('SELECT_BATTERY_STATE', 'IOBROKER_BATTERY', 'MQTT_BATTERY'),
+}
 
 
 class Factory:
@@ -8,214 +465,65 @@ class Factory:
         return
 
     @staticmethod
-    def create_powermeter() -> Powermeter:
-        shelly_ip = config.get('SHELLY', 'SHELLY_IP')
-        shelly_user = config.get('SHELLY', 'SHELLY_USER')
-        shelly_pass = config.get('SHELLY', 'SHELLY_PASS')
-        shelly_emeterindex = config.get('SHELLY', 'EMETER_INDEX')
-        if config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_EM'):
-            return ShellyEM(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_3EM'):
-            return Shelly3EM(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_3EM_PRO'):
-            return Shelly3EMPro(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_POWERMETER', 'USE_TASMOTA'):
-            return Tasmota(
-                config.get('TASMOTA', 'TASMOTA_IP'),
-                config.get('TASMOTA', 'TASMOTA_USER'),
-                config.get('TASMOTA', 'TASMOTA_PASS'),
-                config.get('TASMOTA', 'TASMOTA_JSON_STATUS'),
-                config.get('TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX'),
-                config.get('TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL'),
-                config.get('TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL'),
-                config.get('TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL'),
-                config.getboolean('TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE', fallback=False)
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_SHRDZM'):
-            return Shrdzm(
-                config.get('SHRDZM', 'SHRDZM_IP'),
-                config.get('SHRDZM', 'SHRDZM_USER'),
-                config.get('SHRDZM', 'SHRDZM_PASS')
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_EMLOG'):
-            return Emlog(
-                config.get('EMLOG', 'EMLOG_IP'),
-                config.get('EMLOG', 'EMLOG_METERINDEX'),
-                config.getboolean('EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback=False)
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_IOBROKER'):
-            return IoBroker(
-                config.get('IOBROKER', 'IOBROKER_IP'),
-                config.get('IOBROKER', 'IOBROKER_PORT'),
-                config.get('IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS'),
-                config.getboolean('IOBROKER', 'IOBROKER_POWER_CALCULATE'),
-                config.get('IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS'),
-                config.get('IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS')
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_HOMEASSISTANT'):
-            return HomeAssistant(
-                config.get('HOMEASSISTANT', 'HA_IP'),
-                config.get('HOMEASSISTANT', 'HA_PORT'),
-                config.getboolean('HOMEASSISTANT', 'HA_HTTPS', fallback=False),
-                config.get('HOMEASSISTANT', 'HA_ACCESSTOKEN'),
-                config.get('HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY'),
-                config.getboolean('HOMEASSISTANT', 'HA_POWER_CALCULATE'),
-                config.get('HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS'),
-                config.get('HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS')
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_VZLOGGER'):
-            return VZLogger(
-                config.get('VZLOGGER', 'VZL_IP'),
-                config.get('VZLOGGER', 'VZL_PORT'),
-                config.get('VZLOGGER', 'VZL_UUID')
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_SCRIPT'):
-            return Script(
-                config.get('SCRIPT', 'SCRIPT_FILE'),
-                config.get('SCRIPT', 'SCRIPT_IP'),
-                config.get('SCRIPT', 'SCRIPT_USER'),
-                config.get('SCRIPT', 'SCRIPT_PASS')
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_AMIS_READER'):
-            return AmisReader(
-                config.get('AMIS_READER', 'AMIS_READER_IP')
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_MQTT'):
-            return MqttPowermeter(
-                config.get('MQTT_POWERMETER', 'MQTT_BROKER', fallback=config.get("MQTT_CONFIG", "MQTT_BROKER", fallback=None)),
-                config.getint('MQTT_POWERMETER', 'MQTT_PORT', fallback=config.getint("MQTT_CONFIG", "MQTT_PORT", fallback=1883)),
-                config.get('MQTT_POWERMETER', 'MQTT_TOPIC_INCOMING'),
-                config.get('MQTT_POWERMETER', 'MQTT_JSON_PATH_INCOMING', fallback=None),
-                config.get('MQTT_POWERMETER', 'MQTT_TOPIC_OUTGOING', fallback=None),
-                config.get('MQTT_POWERMETER', 'MQTT_JSON_PATH_OUTGOING', fallback=None),
-                config.get('MQTT_POWERMETER', 'MQTT_USERNAME', fallback=config.get('MQTT_CONFIG', 'MQTT_USERNAME', fallback=None)),
-                config.get('MQTT_POWERMETER', 'MQTT_PASSWORD', fallback=config.get('MQTT_CONFIG', 'MQTT_PASSWORD', fallback=None))
-            )
-        elif config.getboolean('SELECT_POWERMETER', 'USE_DEBUG_READER'):
-            return DebugReader()
-        else:
+    def create_from_registry(section: str, builders: dict):
+        for key, builder in builders.items():
+            if config.getboolean(section, key, fallback=False):
+                return builder()
+        return None
+
+    @staticmethod
+    def create_powermeter() -> 'Powermeter':
+        powermeter = Factory.create_from_registry('SELECT_POWERMETER', POWERMETER_BUILDERS)
+        if powermeter is None:
             raise Exception("Error: no metering defined!")
+        return powermeter
 
     @staticmethod
-    def create_intermediate_powermeter(dtu: DTU) -> Powermeter:
-        shelly_ip = config.get('INTERMEDIATE_SHELLY', 'SHELLY_IP_INTERMEDIATE')
-        shelly_user = config.get('INTERMEDIATE_SHELLY', 'SHELLY_USER_INTERMEDIATE')
-        shelly_pass = config.get('INTERMEDIATE_SHELLY', 'SHELLY_PASS_INTERMEDIATE')
-        shelly_emeterindex = config.get('INTERMEDIATE_SHELLY', 'EMETER_INDEX')
-        if config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_TASMOTA_INTERMEDIATE'):
-            return Tasmota(
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_USER_INTERMEDIATE'),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_PASS_INTERMEDIATE'),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_STATUS_INTERMEDIATE'),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE'),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE'),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE', fallback=None),
-                config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE', fallback=None),
-                config.getboolean('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE', fallback=False)
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_EM_INTERMEDIATE'):
-            return ShellyEM(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_3EM_INTERMEDIATE'):
-            return Shelly3EM(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_3EM_PRO_INTERMEDIATE'):
-            return Shelly3EMPro(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_1PM_INTERMEDIATE'):
-            return Shelly1PM(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_PLUS_1PM_INTERMEDIATE'):
-            return ShellyPlus1PM(shelly_ip, shelly_user, shelly_pass, shelly_emeterindex)
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_ESPHOME_INTERMEDIATE'):
-            return ESPHome(
-                config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_PORT_INTERMEDIATE', fallback='80'),
-                config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_DOMAIN_INTERMEDIATE'),
-                config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_ID_INTERMEDIATE')
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHRDZM_INTERMEDIATE'):
-            return Shrdzm(
-                config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_USER_INTERMEDIATE'),
-                config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_PASS_INTERMEDIATE')
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_EMLOG_INTERMEDIATE'):
-            return Emlog(
-                config.get('INTERMEDIATE_EMLOG', 'EMLOG_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_EMLOG', 'EMLOG_METERINDEX_INTERMEDIATE'),
-                config.getboolean('INTERMEDIATE_EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback=False)
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_IOBROKER_INTERMEDIATE'):
-            return IoBroker(
-                config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_PORT_INTERMEDIATE'),
-                config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE'),
-                config.getboolean('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_CALCULATE', fallback=False),
-                config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE', fallback=None),
-                config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback=None)
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_HOMEASSISTANT_INTERMEDIATE'):
-            return HomeAssistant(
-                config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_PORT_INTERMEDIATE'),
-                config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_HTTPS_INTERMEDIATE', fallback=False),
-                config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_ACCESSTOKEN_INTERMEDIATE'),
-                config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY_INTERMEDIATE'),
-                config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_CALCULATE_INTERMEDIATE', fallback=False),
-                config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS_INTERMEDIATE', fallback=None),
-                config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback=None)
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_VZLOGGER_INTERMEDIATE'):
-            return VZLogger(
-                config.get('INTERMEDIATE_VZLOGGER', 'VZL_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_VZLOGGER', 'VZL_PORT_INTERMEDIATE'),
-                config.get('INTERMEDIATE_VZLOGGER', 'VZL_UUID_INTERMEDIATE')
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SCRIPT_INTERMEDIATE'):
-            return Script(
-                config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_FILE_INTERMEDIATE'),
-                config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_IP_INTERMEDIATE'),
-                config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_USER_INTERMEDIATE'),
-                config.get('INTERMEDIATE_SCRIPT', 'SCRIPT_PASS_INTERMEDIATE')
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_MQTT_INTERMEDIATE'):
-            return MqttPowermeter(
-                config.get('INTERMEDIATE_MQTT', 'MQTT_BROKER', fallback=config.get("MQTT_CONFIG", "MQTT_BROKER", fallback=None)),
-                config.getint('INTERMEDIATE_MQTT', 'MQTT_PORT', fallback=config.getint("MQTT_CONFIG", "MQTT_PORT", fallback=1883)),
-                config.get('INTERMEDIATE_MQTT', 'MQTT_TOPIC_INCOMING'),
-                config.get('INTERMEDIATE_MQTT', 'MQTT_JSON_PATH_INCOMING', fallback=None),
-                config.get('INTERMEDIATE_MQTT', 'MQTT_TOPIC_OUTGOING', fallback=None),
-                config.get('INTERMEDIATE_MQTT', 'MQTT_JSON_PATH_OUTGOING', fallback=None),
-                config.get('INTERMEDIATE_MQTT', 'MQTT_USERNAME', fallback=config.get("MQTT_CONFIG", "MQTT_USERNAME", fallback=None)),
-                config.get('INTERMEDIATE_MQTT', 'MQTT_PASSWORD', fallback=config.get("MQTT_CONFIG", "MQTT_PASSWORD", fallback=None))
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_AMIS_READER_INTERMEDIATE'):
-            return AmisReader(
-                config.get('INTERMEDIATE_AMIS_READER', 'AMIS_READER_IP_INTERMEDIATE')
-            )
-        elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_DEBUG_READER_INTERMEDIATE'):
-            return DebugReader()
-        else:
-            return dtu
+    def create_intermediate_powermeter(dtu: 'DTU') -> 'Powermeter':
+        powermeter = Factory.create_from_registry('SELECT_INTERMEDIATE_METER', INTERMEDIATE_POWERMETER_BUILDERS)
+        return dtu if powermeter is None else powermeter
 
     @staticmethod
-    def create_dtu() -> DTU:
-        inverter_count = config.getint('COMMON', 'INVERTER_COUNT')
-        if config.getboolean('SELECT_DTU', 'USE_AHOY'):
-            return AhoyDTU(
-                inverter_count,
-                config.get('AHOY_DTU', 'AHOY_IP'),
-                config.get('AHOY_DTU', 'AHOY_PASS', fallback='')
-            )
-        elif config.getboolean('SELECT_DTU', 'USE_OPENDTU'):
-            return OpenDTU(
-                inverter_count,
-                config.get('OPEN_DTU', 'OPENDTU_IP'),
-                config.get('OPEN_DTU', 'OPENDTU_USER'),
-                config.get('OPEN_DTU', 'OPENDTU_PASS')
-            )
-        elif config.getboolean('SELECT_DTU', 'USE_DEBUG'):
-            return DebugDTU(
-                inverter_count
-            )
-        else:
+    def create_dtu() -> 'DTU':
+        dtu = Factory.create_from_registry('SELECT_DTU', DTU_BUILDERS)
+        if dtu is None:
             raise Exception("Error: no DTU defined!")
+        return dtu
+
+    @staticmethod
+    def create_battery_state_provider() -> 'BatteryStateProvider':
+        return Factory.create_from_registry('SELECT_BATTERY_STATE', BATTERY_STATE_BUILDERS)
+
+    @staticmethod
+    def create_http_adapter(pool_size: int = 10) -> HTTPAdapter:
+        retry = Retry(total=config.getint('COMMON', 'MAX_RETRIES', fallback=3),
+                      backoff_factor=config.getfloat('COMMON', 'RETRY_BACKOFF_FACTOR', fallback=0.1),
+                      status_forcelist=[int(status_code) for status_code in
+                                        config.get('COMMON', 'RETRY_STATUS_CODES', fallback='500,502,503,504').split(',')],
+                      allowed_methods={"GET", "POST"})
+        failure_threshold = config.getint('COMMON', 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', fallback=3)
+        if failure_threshold > 0:
+            return CircuitBreakerAdapter(
+                failure_threshold,
+                config.getfloat('COMMON', 'CIRCUIT_BREAKER_RESET_TIMEOUT_IN_SECONDS', fallback=10),
+                config.getfloat('COMMON', 'CIRCUIT_BREAKER_MAX_RESET_TIMEOUT_IN_SECONDS', fallback=300),
+                pool_maxsize=pool_size,
+                max_retries=retry
+            )
+        return HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
 
+    @staticmethod
+    def create_http_client(device_class: str, name: str) -> HttpClient:
+        # device_class is METER or DTU, both have their own timeouts
+        default_timeout = (3.05, 5) if device_class == 'METER' else (5, 10)
+        timeout = (
+            config.getfloat('COMMON', f'{device_class}_CONNECT_TIMEOUT_IN_SECONDS', fallback=default_timeout[0]),
+            config.getfloat('COMMON', f'{device_class}_READ_TIMEOUT_IN_SECONDS', fallback=default_timeout[1])
+        )
+        pool_size = config.getint('COMMON', 'HTTP_POOL_SIZE', fallback=2)
+        return HttpClient(name, timeout=timeout, adapter=Factory.create_http_adapter(pool_size))
+
+    @staticmethod
+    def assign_http_client(device, device_class: str, name: str):
+        if device is not None:
+            device.session = Factory.create_http_client(device_class, f'{name} {device.__class__.__name__}')
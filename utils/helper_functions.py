@@ -4,6 +4,7 @@ are used throughout the project.
 """
 
 import logging
+from functools import lru_cache
 
 
 logging.basicConfig(
@@ -37,10 +38,15 @@ def get_number_array(p_excluded_panels):
         result.append(number)
     return result
 
-def extract_json_value(data, path):
+@lru_cache(maxsize=32)
+def parse_json_path(path):
+    # parsing a JSON path is much slower than applying it, and the paths come from the config and never change
     from jsonpath_ng import parse
-    jsonpath_expr = parse(path)
-    match = jsonpath_expr.find(data)
+    return parse(path)
+
+
+def extract_json_value(data, path):
+    match = parse_json_path(path).find(data)
     if match:
         return int(float(match[0].value))
     else:
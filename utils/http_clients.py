@@ -0,0 +1,99 @@
+"""
+This module contains the HTTP clients used by the drivers. Every device gets its own client with a keep-alive
+connection pool, its own (connect, read) timeout and latency statistics of its requests.
+"""
+
+import threading
+import time
+import weakref
+from collections import deque
+
+from requests import Session
+
+
+class LatencyHistogram:
+    # upper bounds of the buckets in seconds, the last bucket takes everything above
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, window: int = 256):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, error: bool = False):
+        index = 0
+        while index < len(self.BUCKETS) and latency > self.BUCKETS[index]:
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum += latency
+            if error:
+                self.errors += 1
+            self.recent.append(latency)
+
+    def percentile(self, percent: float):
+        with self.lock:
+            recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * percent / 100))]
+
+    def summary(self):
+        p50, p90, p99 = self.percentile(50), self.percentile(90), self.percentile(99)
+        if p50 is None:
+            return 'no requests'
+        return (f'{self.total} requests, {self.errors} errors, '
+                f'p50 {p50 * 1000:.0f} ms, p90 {p90 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms')
+
+
+class HttpClient:
+    """
+    Wrapper around a requests Session with the timeout policy and latency statistics of one device.
+    It provides get() and post() like a Session, a timeout passed by the caller overrides the default one.
+    """
+    # weak references, the client of a replaced driver disappears from the statistics with the driver
+    instances = weakref.WeakSet()
+    instances_lock = threading.Lock()
+
+    def __init__(self, name: str, session: Session = None, timeout=(5, 10), adapter=None):
+        self.name = name
+        self.session = session if session is not None else Session()
+        self.timeout = timeout
+        self.latency = LatencyHistogram()
+        if adapter is not None:
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        with self.instances_lock:
+            self.instances.add(self)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            self.latency.record(time.perf_counter() - start, error=True)
+            raise
+        self.latency.record(time.perf_counter() - start, error=not response.ok)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    @classmethod
+    def get_instances(cls):
+        with cls.instances_lock:
+            return sorted(cls.instances, key=lambda client: client.name)
+
+    @classmethod
+    def log_statistics(cls, logger):
+        for client in cls.get_instances():
+            if client.latency.total:
+                logger.info('HTTP %s: %s', client.name, client.latency.summary())
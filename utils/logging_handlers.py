@@ -0,0 +1,101 @@
+"""
+This module contains logging handlers which ship log records to remote systems. They never block the control
+loop: emit() only formats the record and puts it into a bounded queue, everything else is done by a background
+thread.
+"""
+
+import copy
+import json
+import logging
+import threading
+from collections import deque
+
+
+class BatchingLogShipper(logging.Handler):
+    """
+    Collects log records in a bounded queue and passes them in batches to publish() from a background thread.
+    Identical messages within a batch are collapsed into one entry with a count. If the queue is full, the oldest
+    records are dropped and counted.
+    """
+
+    def __init__(self, publish, level=logging.NOTSET, queue_size: int = 1000, interval: float = 5,
+                 max_records_per_batch: int = 100):
+        super().__init__(level)
+        self.publish = publish
+        self.records = deque(maxlen=queue_size)
+        self.interval = interval
+        self.max_records_per_batch = max_records_per_batch
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='log-shipper', daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        # called with the handler lock held, so the drop counter needs no lock of its own
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+    def prepare(self, record):
+        """
+        Formats the record in the logging thread, like QueueHandler.prepare(): the arguments and the traceback may
+        change or be released before the record is shipped. The queue then only keeps strings.
+        """
+        message = self.format(record)
+        record = copy.copy(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.try_ship()
+
+    def try_ship(self):
+        try:
+            self.ship()
+        except Exception:
+            # never log from here, the record would end up in this handler again
+            pass
+
+    def ship(self):
+        records = []
+        while self.records:
+            records.append(self.records.popleft())
+        dropped, self.dropped = self.dropped, 0
+        if not records and not dropped:
+            return
+        entries = {}
+        for record in records:
+            message = record.getMessage()
+            key = (record.levelname, record.name, message)
+            if key in entries:
+                entries[key]['count'] += 1
+                entries[key]['last'] = record.created
+                continue
+            entries[key] = {
+                'name': record.name,
+                'level': record.levelname,
+                'msg': message,
+                'count': 1,
+                'first': record.created,
+                'last': record.created,
+            }
+        batch = list(entries.values())
+        if len(batch) > self.max_records_per_batch:
+            dropped += sum(entry['count'] for entry in batch[:-self.max_records_per_batch])
+            batch = batch[-self.max_records_per_batch:]
+        self.publish(json.dumps({'records': batch, 'dropped': dropped}))
+
+    def close(self):
+        self.stopped.set()
+        self.try_ship()
+        super().close()
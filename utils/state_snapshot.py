@@ -0,0 +1,43 @@
+"""
+This module saves the state of the controller (limits, power states, inverter info, voltage histories) to a
+small JSON file. After a restart the controller can continue with this state instead of initializing all
+inverters again, as long as the snapshot is recent enough.
+"""
+
+import json
+import os
+import time
+
+from utils.helper_functions import logger
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def save_snapshot(path, state: dict):
+    state = dict(state, format_version=SNAPSHOT_FORMAT_VERSION, timestamp=time.time())
+    # write to a temporary file first, so a crash while writing never leaves a broken snapshot behind
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, max_age: float):
+    try:
+        with open(path) as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning('Unable to read state snapshot %s: %s', path, e)
+        return None
+    if state.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        return None
+    age = time.time() - state.get('timestamp', 0)
+    if age < 0 or age > max_age:
+        logger.info('State snapshot is %.0f s old, starting from scratch', age)
+        return None
+    state['age'] = age
+    return state
@@ -0,0 +1,84 @@
+"""
+This module calculates sunrise and sunset locally from the coordinates of the PV system, using the
+NOAA approximation (General Solar Position Calculations). The result is accurate to a few minutes,
+which is plenty for deciding whether the inverters can produce power.
+"""
+
+import math
+from datetime import date, datetime, timedelta, timezone
+
+# zenith angle of sunrise / sunset, corrected for atmospheric refraction and the size of the solar disk
+SUNRISE_ZENITH_IN_DEG = 90.833
+
+
+def get_sun_times(latitude: float, longitude: float, day: date):
+    """
+    Returns (sunrise, sunset) of the given day as timezone aware UTC datetimes.
+    Returns None during polar night; during midnight sun the whole day is returned.
+    Longitude is positive east of Greenwich.
+    """
+    day_of_year = day.timetuple().tm_yday
+    # fractional year at noon in radians
+    gamma = 2 * math.pi / 365 * (day_of_year - 1)
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                                 - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    declination = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+                   - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+                   - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+    latitude_rad = math.radians(latitude)
+    cos_hour_angle = (math.cos(math.radians(SUNRISE_ZENITH_IN_DEG)) / (math.cos(latitude_rad) * math.cos(declination))
+                      - math.tan(latitude_rad) * math.tan(declination))
+    midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    if cos_hour_angle > 1:
+        return None
+    if cos_hour_angle < -1:
+        return midnight, midnight + timedelta(days=1)
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+    sunrise_minutes = 720 - 4 * (longitude + hour_angle) - equation_of_time
+    sunset_minutes = 720 - 4 * (longitude - hour_angle) - equation_of_time
+    return midnight + timedelta(minutes=sunrise_minutes), midnight + timedelta(minutes=sunset_minutes)
+
+
+def get_seconds_until_daylight(latitude: float, longitude: float, margin_in_minutes: float = 0, now: datetime = None):
+    """
+    Returns 0 if the sun is up (sunrise - margin until sunset + margin), otherwise the seconds until
+    the next sunrise - margin. Returns None if there is no sunrise within the next days (polar night).
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    margin = timedelta(minutes=margin_in_minutes)
+    next_start = None
+    # the UTC day and the local day differ, so look at the neighbouring days as well
+    for offset in range(-1, 3):
+        sun_times = get_sun_times(latitude, longitude, (now + timedelta(days=offset)).date())
+        if sun_times is None:
+            continue
+        start, end = sun_times[0] - margin, sun_times[1] + margin
+        if start <= now <= end:
+            return 0
+        if start > now and (next_start is None or start < next_start):
+            next_start = start
+    if next_start is None:
+        return None
+    return (next_start - now).total_seconds()
+
+
+def get_wait_interval(inverters_available: bool, idle_count: int, loop_interval: float, max_interval: float,
+                      night_probe_interval: float, seconds_until_daylight: float = 0):
+    """
+    Returns (seconds to wait until the next cycle, idle count of the next cycle). With an available inverter this
+    is the loop interval and the backoff starts over. Without one the wait doubles with every idle cycle, up to
+    max_interval. At night (seconds_until_daylight None or > 0) the inverters are only probed every
+    night_probe_interval seconds, but the wait ends at daylight, and never before the loop interval.
+    """
+    if inverters_available:
+        return loop_interval, 0
+    if seconds_until_daylight is None or seconds_until_daylight > 0:
+        interval = night_probe_interval
+        if seconds_until_daylight is not None:
+            interval = max(min(interval, seconds_until_daylight), loop_interval)
+        return int(interval), 0
+    interval = min(loop_interval * 2 ** idle_count, max(max_interval, loop_interval))
+    if interval < max_interval:
+        idle_count += 1
+    return interval, idle_count